@@ -38,15 +38,20 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'debug_toolbar',
+    'django.contrib.postgres',
     'social_django',
     'crispy_forms',
     'crispy_bootstrap5',
     'django_extensions',
+    'rest_framework',
+    'django_filters',
+    'drf_spectacular',
     'cinema_app',
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole middleware stack
+    'cinema_app.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,10 +59,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
-
 ]
 
+# The toolbar middleware is sync-only: under ASGI it would run every view, async ones included, through a
+# thread. Development only, with its URLs (cinema_app/urls.py).
+if DEBUG:
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('cinema_app'), 'debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'cinema.urls'
 
 TEMPLATES = [
@@ -136,12 +145,77 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
 
 LOGIN_REDIRECT_URL = 'profile'
 LOGOUT_REDIRECT_URL = 'home'
 
+# Cache
+# Seat maps of sessions are kept in Redis when REDIS_URL is set, in local memory otherwise
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'cinema_app.cache_backends.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'cinema_app.cache_backends.LocMemCache',
+        }
+    }
+SEAT_MAP_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Server-Sent Events with seat updates (seconds, except the client retry delay)
+SEAT_EVENTS_POLL_INTERVAL = 0.5
+SEAT_EVENTS_KEEPALIVE = 15
+SEAT_EVENTS_MAX_AGE = 60 * 5
+SEAT_EVENTS_RETRY_MS = 2000
+
+# Seats picked in purchase_ticket are held in the cache for SEAT_HOLD_TTL seconds before an order exists
+SEAT_HOLD_TTL = config('SEAT_HOLD_TTL', default=60 * 10, cast=int)
+SEAT_HOLD_RESYNC = 5
+
+# Celery: the Redis broker when REDIS_URL is set; otherwise tasks run inline instead of failing to reach a broker
+if REDIS_URL:
+    CELERY_BROKER_URL = REDIS_URL
+    CELERY_RESULT_BACKEND = REDIS_URL
+else:
+    CELERY_TASK_ALWAYS_EAGER = True
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+
+# Rendered schedule fragments; invalidated by Session/Movie/Hall changes (see cinema_app/schedule.py)
+SCHEDULE_CACHE_TIMEOUT = 60 * 60
+
+# Performance instrumentation (cinema_app.instrumentation): Prometheus metrics at /metrics/, closed with a
+# bearer token when METRICS_TOKEN is set. A SLOW_REQUEST_SAMPLE_RATE share of the requests (0 turns it off)
+# is logged to cinema_app.performance with its slowest queries when it takes SLOW_REQUEST_THRESHOLD_MS or more.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+SLOW_REQUEST_SAMPLE_RATE = config('SLOW_REQUEST_SAMPLE_RATE', default=0.0, cast=float)
+SLOW_REQUEST_THRESHOLD_MS = config('SLOW_REQUEST_THRESHOLD_MS', default=500, cast=int)
+
+# Read-only REST API at /api/v1/ (cinema_app.api), schema and docs generated by drf-spectacular
+REST_FRAMEWORK = {
+    # Public data only: no session or user lookups per request
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+}
+SPECTACULAR_SETTINGS = {
+    'TITLE': 'Cinema API',
+    'DESCRIPTION': 'Movies, halls and the session schedule with seat availability',
+    'VERSION': '1.0.0',
+    'SERVE_INCLUDE_SCHEMA': False,
+}
+
 SESSION_COOKIE_NAME = 'sessionid'
+# Not cached_db: with a per-process LocMemCache a logout on one worker would leave the session cached on the
+# others (settings_prod reads sessions through Redis)
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 
 
@@ -180,6 +254,7 @@ SOCIAL_AUTH_PIPELINE = (
 STRIPE_PUBLISHABLE_KEY = config('STRIPE_PUBLISHABLE_KEY')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
 STRIPE_API_VERSION = '2024-11-20.acacia'
+STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
 
 
 # DEBUG TOOLBAR
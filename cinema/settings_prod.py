@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 import os
 from pathlib import Path
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 from cinema_app.pipeline import check_email_exists
 from celery.schedules import crontab
 
@@ -22,10 +23,10 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-#ikgj4ezmp&dykdo((3i7(x$tpuxovvc&%xi$$7$wf(df$d8!%'
+SECRET_KEY = config('SECRET_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = config('DEBUG', default=False, cast=bool)
 
 
 ALLOWED_HOSTS = ['mysite.com', 'localhost', 'aluiel3.pythonanywhere.com', '127.0.0.1']
@@ -39,16 +40,21 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'debug_toolbar',
+    'django.contrib.postgres',
     'social_django',
     'crispy_forms',
     'crispy_bootstrap5',
     'django_extensions',
     'django_celery_beat',
+    'rest_framework',
+    'django_filters',
+    'drf_spectacular',
     'cinema_app',
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole middleware stack
+    'cinema_app.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,8 +62,6 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
-
 ]
 
 ROOT_URLCONF = 'cinema.urls'
@@ -92,9 +96,24 @@ DATABASES = {
         'PASSWORD': config('DATABASE_PASSWORD'),
         'HOST': config('DATABASE_HOST'),
         'PORT': config('DATABASE_PORT', cast=int),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Connections are reused instead of opened per request: a psycopg 3 pool per server process by default
+# (works under ASGI, where persistent connections are closed after every request), or persistent
+# connections kept for DATABASE_CONN_MAX_AGE seconds when DATABASE_POOL is off.
+if config('DATABASE_POOL', default=True, cast=bool):
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': config('DATABASE_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DATABASE_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': config('DATABASE_POOL_TIMEOUT', default=10, cast=int),
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = config('DATABASE_CONN_MAX_AGE', default=60, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -144,13 +163,63 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
 
 LOGIN_REDIRECT_URL = 'profile'
 LOGOUT_REDIRECT_URL = 'home'
 
+# Cache
+# Seat maps of sessions are kept in Redis (see cinema_app/seats.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'cinema_app.cache_backends.RedisCache',
+        'LOCATION': config('REDIS_URL'),
+    }
+}
+SEAT_MAP_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Server-Sent Events with seat updates (seconds, except the client retry delay)
+SEAT_EVENTS_POLL_INTERVAL = 0.5
+SEAT_EVENTS_KEEPALIVE = 15
+SEAT_EVENTS_MAX_AGE = 60 * 5
+SEAT_EVENTS_RETRY_MS = 2000
+
+# Seats picked in purchase_ticket are held in the cache for SEAT_HOLD_TTL seconds before an order exists
+SEAT_HOLD_TTL = config('SEAT_HOLD_TTL', default=60 * 10, cast=int)
+SEAT_HOLD_RESYNC = 5
+
+# Rendered schedule fragments; invalidated by Session/Movie/Hall changes (see cinema_app/schedule.py)
+SCHEDULE_CACHE_TIMEOUT = 60 * 60
+
+# Performance instrumentation (cinema_app.instrumentation): Prometheus metrics at /metrics/, closed with a
+# bearer token. A SLOW_REQUEST_SAMPLE_RATE share of the requests (0 turns it off) is logged to
+# cinema_app.performance with its slowest queries when it takes SLOW_REQUEST_THRESHOLD_MS or more.
+# Required here: an empty token would publish per-view latencies and query counts on the public host.
+METRICS_TOKEN = config('METRICS_TOKEN')
+if not METRICS_TOKEN:
+    raise ImproperlyConfigured('METRICS_TOKEN must be set to protect /metrics/')
+SLOW_REQUEST_SAMPLE_RATE = config('SLOW_REQUEST_SAMPLE_RATE', default=0.0, cast=float)
+SLOW_REQUEST_THRESHOLD_MS = config('SLOW_REQUEST_THRESHOLD_MS', default=500, cast=int)
+
+# Read-only REST API at /api/v1/ (cinema_app.api), schema and docs generated by drf-spectacular
+REST_FRAMEWORK = {
+    # Public data only: no session or user lookups per request
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+}
+SPECTACULAR_SETTINGS = {
+    'TITLE': 'Cinema API',
+    'DESCRIPTION': 'Movies, halls and the session schedule with seat availability',
+    'VERSION': '1.0.0',
+    'SERVE_INCLUDE_SCHEMA': False,
+}
+
 SESSION_COOKIE_NAME = 'sessionid'
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# Sessions are read from Redis and written through to the database, so they survive a cache flush
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 
 
 # GMAIL settings
@@ -188,13 +257,7 @@ SOCIAL_AUTH_PIPELINE = (
 STRIPE_PUBLISHABLE_KEY = config('STRIPE_PUBLISHABLE_KEY')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
 STRIPE_API_VERSION = '2024-11-20.acacia'
-
-
-# DEBUG TOOLBAR
-INTERNAL_IPS = [
-    '127.0.0.1',
-    '172.17.0.1',
-]
+STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
 
 
 CELERY_BROKER_URL = config('REDIS_URL')
@@ -205,8 +268,18 @@ CELERY_TIMEZONE = TIME_ZONE
 
 
 CELERY_BEAT_SCHEDULE = {
+    # Orders expire through their own expire_order task; this is only a safety sweep
     'run-periodic-task': {
         'task': 'cinema_app.tasks.cancel_unpaid_orders',
-        'schedule': crontab(minute='*/1'),
+        'schedule': crontab(minute='*/15'),
+    },
+    'reconcile-seat-maps': {
+        'task': 'cinema_app.tasks.reconcile_seat_maps',
+        'schedule': crontab(minute='*/5'),
+    },
+    # Webhook events are processed as they arrive; this catches events whose task was never enqueued
+    'process-stripe-events': {
+        'task': 'cinema_app.tasks.process_stripe_events',
+        'schedule': crontab(minute='*'),
     },
 }
@@ -10,7 +10,7 @@ class GenreAdmin(admin.ModelAdmin):
 
 @admin.register(Hall)
 class HallAdmin(admin.ModelAdmin):
-    list_display = ('name', 'capacity')
+    list_display = ('name', 'capacity', 'seats_per_row')
 
 
 @admin.register(Movie)
@@ -29,6 +29,13 @@ class SessionAdmin(admin.ModelAdmin):
     # exclude = ('end_time',)
 
 
+@admin.register(SessionStats)
+class SessionStatsAdmin(admin.ModelAdmin):
+    list_display = ('session', 'capacity', 'booked', 'reserved', 'available', 'revenue', 'updated_at')
+    readonly_fields = ('session', 'capacity', 'booked', 'reserved', 'available', 'revenue', 'updated_at')
+    list_select_related = ('session__hall',)
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('user', 'session', 'status',)
@@ -89,3 +96,10 @@ class TicketAdmin(admin.ModelAdmin):
     def get_hall_name(self, obj):
         return obj.session.hall.name
     get_hall_name.short_description = 'Зал'
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'type', 'order_id', 'payment_status', 'created_at', 'processed_at')
+    list_filter = ('type',)
+    search_fields = ('event_id', 'order_id')
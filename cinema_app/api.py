@@ -0,0 +1,198 @@
+"""
+Read-only REST API (/api/v1/) for the mobile and kiosk clients.
+
+Listings are cursor-paginated and take ``?fields=slug,title`` to return only
+some fields. Their ETag is derived from the schedule cache versions
+(cinema_app.schedule), which change whenever what they show changes, so a
+request with a matching If-None-Match gets a 304 before any query runs. The
+seat counters of sessions have a version of their own, part of the ETag only
+when they are among the fields. Seat maps change with every reservation and
+are tagged by content instead.
+"""
+import hashlib
+import json
+from datetime import date
+
+from django.db.models import Prefetch
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_date
+from django_filters import rest_framework as filters
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema, extend_schema_view
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from .models import Genre, Hall, Movie, Session
+from .pricing import session_category_prices
+from .schedule import get_availability_version, get_catalog_version, get_schedule_version
+from .seats import apply_seat_holds, get_cached_seat_map, get_seat_holds, seat_grid_payload
+from .serializers import GenreSerializer, HallSerializer, MovieSerializer, SeatMapSerializer, SessionSerializer
+
+FIELDS_PARAMETER = OpenApiParameter('fields', OpenApiTypes.STR,
+                                    description='Comma-separated fields to return, all of them by default')
+
+
+def make_etag(*parts):
+    return '"{}"'.format(hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest())
+
+
+def conditional_response(request, etag, render):
+    """``render()`` tagged with ``etag``, or a 304 without calling it when the client has that version."""
+    response = get_conditional_response(request, etag=etag) or render()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        # The browsable API and JSON of the same URL are different representations
+        patch_vary_headers(response, ['Accept'])
+    return response
+
+
+class ApiCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class MoviePagination(ApiCursorPagination):
+    ordering = ('-release_date', 'id')
+
+
+class NamePagination(ApiCursorPagination):
+    ordering = ('name', 'id')
+
+
+class SessionPagination(ApiCursorPagination):
+    ordering = ('session_date', 'start_time', 'id')
+
+
+class ReadOnlyApiViewSet(viewsets.ReadOnlyModelViewSet):
+    """Sparse fieldsets and conditional GET keyed by :meth:`get_version`."""
+
+    def get_version(self):
+        return get_catalog_version()
+
+    def requested_fields(self):
+        return [name for name in self.request.query_params.get('fields', '').split(',') if name]
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+    def conditional(self, handler, request, *args, **kwargs):
+        etag = make_etag(self.get_version(), request.get_full_path(), request.accepted_renderer.format)
+        return conditional_response(request, etag, lambda: handler(request, *args, **kwargs))
+
+
+class MovieFilter(filters.FilterSet):
+    genre = filters.CharFilter(method='filter_genre', help_text='Genre name')
+
+    class Meta:
+        model = Movie
+        fields = ('genre', 'age_limit')
+
+    def filter_genre(self, queryset, name, value):
+        # Semi-join on the m2m table instead of JOIN + DISTINCT over the whole movie row
+        return queryset.filter(id__in=Movie.genre.through.objects.filter(genre__name=value).values('movie_id'))
+
+
+@extend_schema_view(list=extend_schema(parameters=[FIELDS_PARAMETER]),
+                    retrieve=extend_schema(parameters=[FIELDS_PARAMETER]))
+class MovieViewSet(ReadOnlyApiViewSet):
+    serializer_class = MovieSerializer
+    pagination_class = MoviePagination
+    filterset_class = MovieFilter
+    lookup_field = 'slug'
+
+    def get_queryset(self):
+        queryset = Movie.objects.defer('search_vector')
+        fields = self.requested_fields()
+        if fields and 'description' not in fields:
+            queryset = queryset.defer('description')
+        if not fields or 'genres' in fields:
+            queryset = queryset.prefetch_related(Prefetch('genre', queryset=Genre.objects.only('name')))
+        return queryset
+
+
+@extend_schema_view(list=extend_schema(parameters=[FIELDS_PARAMETER]),
+                    retrieve=extend_schema(parameters=[FIELDS_PARAMETER]))
+class GenreViewSet(ReadOnlyApiViewSet):
+    queryset = Genre.objects.all()
+    serializer_class = GenreSerializer
+    pagination_class = NamePagination
+
+
+@extend_schema_view(list=extend_schema(parameters=[FIELDS_PARAMETER]),
+                    retrieve=extend_schema(parameters=[FIELDS_PARAMETER]))
+class HallViewSet(ReadOnlyApiViewSet):
+    queryset = Hall.objects.only('name', 'capacity', 'seats_per_row')
+    serializer_class = HallSerializer
+    pagination_class = NamePagination
+
+
+class SessionFilter(filters.FilterSet):
+    date = filters.DateFilter(field_name='session_date', help_text='Sessions of this day, upcoming ones otherwise')
+    movie = filters.CharFilter(field_name='movie__slug', help_text='Movie slug')
+    hall = filters.NumberFilter(field_name='hall_id', help_text='Hall id')
+
+    class Meta:
+        model = Session
+        fields = ('date', 'movie', 'hall')
+
+
+@extend_schema_view(list=extend_schema(parameters=[FIELDS_PARAMETER]),
+                    retrieve=extend_schema(parameters=[FIELDS_PARAMETER]))
+class SessionViewSet(ReadOnlyApiViewSet):
+    serializer_class = SessionSerializer
+    pagination_class = SessionPagination
+    filterset_class = SessionFilter
+    lookup_field = 'slug'
+
+    def get_queryset(self):
+        queryset = Session.objects.select_related('movie', 'hall', 'stats').only(
+            'slug', 'session_date', 'start_time', 'end_time', 'base_ticket_price',
+            'movie__slug', 'movie__title', 'movie__duration', 'movie__age_limit', 'hall__name', 'hall__capacity',
+            'hall__seats_per_row', 'hall__seat_categories', 'stats__capacity', 'stats__available',
+        )
+        if self.action == 'list':
+            queryset = queryset.filter(session_date__gte=date.today())
+        return queryset
+
+    def get_version(self):
+        selected_date = None
+        if self.action == 'list':
+            try:
+                selected_date = parse_date(self.request.query_params.get('date', ''))
+            except ValueError:
+                # Well formed but impossible, e.g. 2025-02-30; the filter answers it with a 400
+                pass
+        # Without a date the listing starts today, so it also changes at midnight
+        version = f'{get_schedule_version(selected_date)}-{date.today().isoformat()}'
+        fields = self.requested_fields()
+        if not fields or {'capacity', 'available'} & set(fields):
+            version = f'{version}-{get_availability_version(selected_date)}'
+        return version
+
+    @extend_schema(responses=SeatMapSerializer)
+    @action(detail=True)
+    def seats(self, request, slug=None):
+        """Seat grid of a session with the seats taken and the prices by category."""
+        session = self.get_object()
+        seat_map = get_cached_seat_map(session.slug)
+        # Demand pricing counts sold and reserved seats only, as on the purchase page
+        prices = session_category_prices(session, seat_map)
+        seat_map = apply_seat_holds(seat_map, get_seat_holds(session.slug, seat_map))
+        data = SeatMapSerializer({
+            **seat_grid_payload(session.hall, seat_map),
+            'available': seat_map.free_count,
+            'prices': prices,
+        }).data
+
+        etag = make_etag(json.dumps(data, sort_keys=True), request.accepted_renderer.format)
+        return conditional_response(request, etag, lambda: Response(data))
@@ -0,0 +1,100 @@
+"""
+Django cache backends that report hits and misses to cinema_app.instrumentation.
+Configured in CACHES in place of the stock locmem and Redis backends.
+
+Both also keep sets of members that expire one by one (a sorted set scored by
+expiry on Redis), e.g. the seat holds of a session: reading the live members
+is one lookup, however many other members the set had.
+"""
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache.backends import locmem, redis
+
+from .instrumentation import record_cache
+
+_MISSING = object()
+
+
+class InstrumentedCacheMixin:
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        if value is _MISSING:
+            record_cache(0, 1)
+            return default
+        record_cache(1, 0)
+        return value
+
+
+class ExpiringMembersMixin:
+    """
+    ``add_expiring_members(key, members, expires_at)``, ``remove_members(key,
+    members)`` and ``get_live_members(key)``, implemented by each backend.
+    """
+
+    async def aget_live_members(self, key, version=None):
+        return await sync_to_async(self.get_live_members, thread_sensitive=True)(key, version)
+
+
+class LocMemCache(ExpiringMembersMixin, InstrumentedCacheMixin, locmem.LocMemCache):
+    # No get_many: BaseCache.get_many calls get() for every key, which already counts
+    _members_lock = threading.Lock()
+
+    def _live_members(self, key, version):
+        now = time.time()
+        return {member: expires_at for member, expires_at in self.get(key, {}, version).items() if expires_at > now}
+
+    def add_expiring_members(self, key, members, expires_at, version=None):
+        """Add ``members`` (strings) to the set at ``key`` until the ``expires_at`` timestamp."""
+        with self._members_lock:
+            live = self._live_members(key, version)
+            live.update(dict.fromkeys(members, expires_at))
+            self._store_members(key, live, version)
+
+    def remove_members(self, key, members, version=None):
+        with self._members_lock:
+            live = self._live_members(key, version)
+            for member in members:
+                live.pop(member, None)
+            self._store_members(key, live, version)
+
+    def get_live_members(self, key, version=None):
+        return list(self._live_members(key, version))
+
+    def _store_members(self, key, live, version):
+        timeout = max(live.values(), default=0) - time.time()
+        if timeout > 0:
+            self.set(key, live, timeout, version)
+        else:
+            self.delete(key, version)
+
+
+class RedisCache(ExpiringMembersMixin, InstrumentedCacheMixin, redis.RedisCache):
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        record_cache(len(values), len(keys) - len(values))
+        return values
+
+    def add_expiring_members(self, key, members, expires_at, version=None):
+        # The key lives as long as the members added last: callers add them with one TTL
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        with self._cache.get_client(key, write=True).pipeline() as pipeline:
+            pipeline.zadd(key, dict.fromkeys(members, expires_at))
+            pipeline.zremrangebyscore(key, '-inf', now)
+            if expires_at > now:
+                pipeline.expireat(key, int(expires_at) + 1)
+            pipeline.execute()
+
+    def remove_members(self, key, members, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        if members:
+            self._cache.get_client(key, write=True).zrem(key, *members)
+
+    def get_live_members(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        members = self._cache.get_client(key).zrangebyscore(key, f'({time.time()}', '+inf')
+        record_cache(1 if members else 0, 0 if members else 1)
+        return [member.decode() for member in members]
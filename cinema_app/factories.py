@@ -0,0 +1,105 @@
+"""
+factory_boy factories for the cinema models, used by tests and by the
+``benchmark`` command to seed realistic data.
+
+``create()`` goes through Model.save() like the rest of the app. For volume
+seeding, ``build_batch()`` the objects and bulk_create them; Session and Movie
+then need their slug (and Session its end_time) set with ``prepare_session`` /
+``prepare_movie`` because save() is skipped.
+"""
+from datetime import date, time, timedelta
+from decimal import Decimal
+
+import factory
+from django.contrib.auth.models import User
+from django.utils.text import slugify
+from factory import fuzzy
+from factory.django import DjangoModelFactory
+
+from .models import Genre, Hall, Movie, Order, Session, Ticket
+from .timetable import prepare_session  # noqa: F401 (re-exported for seeding)
+
+# Start times a hall is scheduled with, from the first show at 10:00 to the last one at 22:00
+SESSION_TIMES = (time(10, 0), time(13, 0), time(16, 0), time(19, 0), time(22, 0))
+GENRE_NAMES = ('Драма', 'Комедія', 'Бойовик', 'Жахи', 'Фантастика', 'Мультфільм', 'Трилер')
+
+
+class UserFactory(DjangoModelFactory):
+    class Meta:
+        model = User
+        django_get_or_create = ('username',)
+
+    username = factory.Sequence(lambda n: f'viewer{n}')
+    first_name = factory.Faker('first_name', locale='uk_UA')
+    last_name = factory.Faker('last_name', locale='uk_UA')
+    email = factory.LazyAttribute(lambda user: f'{user.username}@example.com')
+
+
+class GenreFactory(DjangoModelFactory):
+    class Meta:
+        model = Genre
+        django_get_or_create = ('name',)
+
+    name = factory.Iterator(GENRE_NAMES)
+
+
+class HallFactory(DjangoModelFactory):
+    class Meta:
+        model = Hall
+
+    name = factory.Sequence(lambda n: f'Зал {n + 1}')
+    capacity = fuzzy.FuzzyChoice([60, 80, 100, 120, 150, 200, 250, 300])
+    seats_per_row = fuzzy.FuzzyChoice([10, 12, 15])
+
+
+class MovieFactory(DjangoModelFactory):
+    class Meta:
+        model = Movie
+
+    title = factory.Faker('catch_phrase', locale='uk_UA')
+    original_name = factory.Sequence(lambda n: f'Movie {n}')
+    description = factory.Faker('paragraph', nb_sentences=4, locale='uk_UA')
+    # Plus the cleaning break, the longest movie still fits between two of SESSION_TIMES
+    duration = fuzzy.FuzzyInteger(80, 160)
+    release_date = factory.Faker('date_between', start_date='-3y', end_date='today')
+    age_limit = fuzzy.FuzzyChoice([age for age, _ in Movie.AGE_CHOICES])
+
+
+class SessionFactory(DjangoModelFactory):
+    class Meta:
+        model = Session
+
+    hall = factory.SubFactory(HallFactory)
+    movie = factory.SubFactory(MovieFactory)
+    base_ticket_price = fuzzy.FuzzyChoice([Decimal('120.00'), Decimal('150.00'), Decimal('180.00'), Decimal('220.00')])
+    session_date = factory.LazyFunction(lambda: date.today() + timedelta(days=1))
+    start_time = factory.Iterator(SESSION_TIMES)
+
+
+class OrderFactory(DjangoModelFactory):
+    class Meta:
+        model = Order
+
+    user = factory.SubFactory(UserFactory)
+    session = factory.SubFactory(SessionFactory)
+    status = Order.PENDING
+    total_price = factory.LazyAttribute(lambda order: order.session.base_ticket_price)
+
+
+class TicketFactory(DjangoModelFactory):
+    class Meta:
+        model = Ticket
+
+    order = factory.SubFactory(OrderFactory)
+    session = factory.SelfAttribute('order.session')
+    user = factory.SelfAttribute('order.user')
+    # Cycles through the seats of the ticket's own hall, so any run of tickets stays within its capacity
+    seat_number = factory.LazyAttributeSequence(lambda ticket, n: n % ticket.session.hall.capacity + 1)
+    price = factory.SelfAttribute('session.base_ticket_price')
+    status = Ticket.RESERVED
+
+
+def prepare_movie(movie):
+    """What Movie.save() would set, for movies inserted with bulk_create."""
+    movie.slug = slugify(movie.original_name)
+    return movie
@@ -0,0 +1,144 @@
+"""
+Request-level performance metrics: wall time, database queries, cache hits
+and Stripe latency per view, exported in the Prometheus format.
+
+PerformanceMiddleware puts a RequestStats in a context variable for the
+duration of a request. Queries are counted by a wrapper installed on every
+database connection (see signals.install_query_instrumentation), cache reads
+by the backends in cinema_app.cache_backends and Stripe calls by
+``stripe_call`` in services. A sampled share of the requests also keeps the
+text of its slowest queries for the slow-request log.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+logger = logging.getLogger('cinema_app.performance')
+
+# Label of work done outside a request (Celery tasks, management commands)
+NO_VIEW = 'none'
+UNMATCHED_VIEW = 'unmatched'
+# Slow-request log entries keep the text of this many of the slowest queries
+SLOW_QUERIES_LOGGED = 5
+
+REQUESTS = Counter('cinema_http_requests_total', 'Requests by view, method and status code.',
+                   ['view', 'method', 'status'])
+REQUEST_DURATION = Histogram('cinema_http_request_duration_seconds', 'Wall time of a request until the response '
+                             'is returned (streamed bodies excluded).', ['view'],
+                             buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+DB_QUERIES = Histogram('cinema_db_queries_per_request', 'Database queries made by a request.', ['view'],
+                       buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+DB_QUERY_DURATION = Counter('cinema_db_query_duration_seconds', 'Time spent in database queries.', ['view'])
+CACHE_REQUESTS = Counter('cinema_cache_requests', 'Cache reads by result (hit or miss).', ['view', 'result'])
+STRIPE_DURATION = Histogram('cinema_stripe_request_duration_seconds', 'Latency of Stripe API calls.',
+                            ['view', 'operation'], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10))
+
+
+class RequestStats:
+    __slots__ = ('sampled', 'queries', 'query_time', 'slow_queries', 'cache_hits', 'cache_misses', 'stripe_calls')
+
+    def __init__(self, sampled=False):
+        self.sampled = sampled
+        self.queries = 0
+        self.query_time = 0.0
+        # (duration, sql) of the slowest queries, kept for sampled requests only
+        self.slow_queries = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # (operation, duration); labelled with the view once it is known, after the response
+        self.stripe_calls = []
+
+    @property
+    def stripe_time(self):
+        return sum(duration for _, duration in self.stripe_calls)
+
+
+current_stats = ContextVar('cinema_request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper: times the queries made inside a request."""
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        stats.queries += 1
+        stats.query_time += duration
+        if stats.sampled:
+            stats.slow_queries.append((duration, sql))
+            if len(stats.slow_queries) > SLOW_QUERIES_LOGGED:
+                stats.slow_queries.remove(min(stats.slow_queries))
+
+
+def record_cache(hits, misses):
+    stats = current_stats.get()
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+@contextmanager
+def stripe_call(operation):
+    """Time one Stripe API call, e.g. ``with stripe_call('checkout.create'): ...``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        stats = current_stats.get()
+        if stats is None:
+            STRIPE_DURATION.labels(NO_VIEW, operation).observe(duration)
+        else:
+            stats.stripe_calls.append((operation, duration))
+
+
+def start_request(sampled):
+    stats = RequestStats(sampled)
+    return stats, current_stats.set(stats)
+
+
+def finish_request(request, response, stats, token, duration, slow_threshold):
+    current_stats.reset(token)
+    match = request.resolver_match
+    view = match.view_name if match else UNMATCHED_VIEW
+
+    REQUESTS.labels(view, request.method, str(response.status_code)).inc()
+    REQUEST_DURATION.labels(view).observe(duration)
+    DB_QUERIES.labels(view).observe(stats.queries)
+    if stats.query_time:
+        DB_QUERY_DURATION.labels(view).inc(stats.query_time)
+    if stats.cache_hits:
+        CACHE_REQUESTS.labels(view, 'hit').inc(stats.cache_hits)
+    if stats.cache_misses:
+        CACHE_REQUESTS.labels(view, 'miss').inc(stats.cache_misses)
+    for operation, stripe_duration in stats.stripe_calls:
+        STRIPE_DURATION.labels(view, operation).observe(stripe_duration)
+
+    if stats.sampled and duration * 1000 >= slow_threshold:
+        slowest = sorted(stats.slow_queries, reverse=True)
+        logger.warning(
+            'Slow request %s %s (%s) %s: %.1fms, %s queries in %.1fms, cache %s hits / %s misses, '
+            'stripe %s calls in %.1fms; slowest queries: %s',
+            request.method, request.path, view, response.status_code, duration * 1000, stats.queries,
+            stats.query_time * 1000, stats.cache_hits, stats.cache_misses, len(stats.stripe_calls),
+            stats.stripe_time * 1000, '; '.join(f'{query_time * 1000:.1f}ms {sql}' for query_time, sql in slowest),
+        )
+
+
+def render_metrics():
+    """Metrics text and content type; merges the files of every worker in multiprocess mode."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,7 @@
+"""Helpers shared by the benchmark, bench_* and loadtest_* commands."""
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``, e.g. ``percentile(latencies, 0.99)`` for p99 and 0.5 for p50."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
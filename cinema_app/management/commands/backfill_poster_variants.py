@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cinema_app.models import Movie
+from cinema_app.posters import generate_poster_variants
+from cinema_app.tasks import generate_movie_poster_variants
+
+
+class Command(BaseCommand):
+    help = ('Generate the resized poster variants (cinema_app.posters) of movies whose poster has none yet or '
+            'changed since, e.g. the posters uploaded before the variants existed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild variants that look up to date as well')
+        parser.add_argument('--async', action='store_true', dest='run_async',
+                            help='Queue one Celery task per movie instead of resizing here')
+
+    def handle(self, *args, **options):
+        movies = (Movie.objects.exclude(poster='').exclude(poster__isnull=True)
+                  .only('slug', 'poster', 'poster_variants').order_by('id'))
+        started = time.perf_counter()
+        generated = skipped = failed = 0
+        for movie in movies.iterator(chunk_size=200):
+            if options['run_async']:
+                generate_movie_poster_variants.delay(movie.pk)
+                generated += 1
+                continue
+            try:
+                changed = generate_poster_variants(movie, force=options['force'])
+            except OSError as e:
+                # Missing or unreadable original (PIL's UnidentifiedImageError is an OSError)
+                self.stderr.write(f'{movie.slug}: {e}')
+                failed += 1
+                continue
+            if changed:
+                generated += 1
+            else:
+                skipped += 1
+
+        action = 'queued' if options['run_async'] else 'generated'
+        self.stdout.write(f'{generated} movies {action}, {skipped} up to date, {failed} failed '
+                          f'in {time.perf_counter() - started:.2f}s')
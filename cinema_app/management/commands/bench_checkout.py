@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from datetime import date, time as dt_time, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+from django.test import RequestFactory
+
+from cinema_app import services
+from cinema_app.management.benchmarking import percentile
+from cinema_app.models import Hall, Movie, Session
+
+
+class SlowStripe:
+    """Payment provider stub that answers every checkout after ``latency`` seconds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.checkout = SimpleNamespace(Session=SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        time.sleep(self.latency)
+        session_id = f"cs_bench_{params['client_reference_id']}"
+        return SimpleNamespace(id=session_id, url=f'https://checkout.stripe.test/{session_id}')
+
+
+def legacy_purchase(request, session, payment_client=None):
+    # Former purchase_ticket_process: the Stripe call happens inside the reservation transaction
+    seats = json.loads(request.POST['selected_seats'])
+    with transaction.atomic():
+        order, conflicts = services.reserve_seats(request.user, session, seats)
+        if conflicts:
+            return False, conflicts
+        redirect_url = services.process_payment(request, order, client=payment_client)
+    return redirect_url, order.id
+
+
+class Command(BaseCommand):
+    help = ('Measure how long checkout keeps the reservation transaction open with a slow stub payment provider, '
+            'for the former in-transaction flow and the two-phase purchase_ticket_process. '
+            'Run it against Postgres: SQLite serialises writers, so concurrent checkouts fail there. '
+            'The scratch data is deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, nargs='+', default=[0, 0.1, 0.5],
+                            help='Payment provider latencies to test, in seconds')
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--purchases', type=int, default=10, help='Checkouts per thread')
+        parser.add_argument('--seats-per-order', type=int, default=2)
+
+    def handle(self, *args, **options):
+        capacity = options['threads'] * options['purchases'] * options['seats_per_order']
+        hall = Hall.objects.create(name='bench-checkout', capacity=capacity)
+        movie = Movie.objects.create(title='Bench checkout', original_name='Bench checkout', description='-',
+                                     duration=90, release_date=date.today(), age_limit=0)
+        users = [User.objects.get_or_create(username=f'bench-checkout-{i}')[0] for i in range(options['threads'])]
+        try:
+            day = 0
+            for latency in options['latency']:
+                for name, purchase in (('in-transaction', legacy_purchase),
+                                       ('two-phase', services.purchase_ticket_process)):
+                    day += 1
+                    session = Session.objects.create(hall=hall, movie=movie, base_ticket_price=Decimal('100'),
+                                                     session_date=date.today() + timedelta(days=day),
+                                                     start_time=dt_time(20, 0))
+                    self.report(f'{name}, {latency * 1000:.0f}ms provider',
+                                *self.run(purchase, session, users, SlowStripe(latency), options))
+        finally:
+            hall.delete()
+            movie.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def run(self, purchase, session, users, payment_client, options):
+        hold_times, failed = [], 0
+        lock = threading.Lock()
+        reserve_seats = services.reserve_seats
+
+        def timed_reserve_seats(*args, **kwargs):
+            # Locks are taken from the first INSERT on and released at commit
+            started = time.perf_counter()
+            result = reserve_seats(*args, **kwargs)
+
+            def committed():
+                with lock:
+                    hold_times.append(time.perf_counter() - started)
+
+            transaction.on_commit(committed)
+            return result
+
+        host = next(host for host in settings.ALLOWED_HOSTS if host != '*') if settings.ALLOWED_HOSTS else 'localhost'
+        factory = RequestFactory(HTTP_HOST=host)
+        start = threading.Barrier(len(users))
+
+        def worker(index, user):
+            nonlocal failed
+            start.wait()
+            try:
+                for attempt in range(options['purchases']):
+                    first = (attempt * len(users) + index) * options['seats_per_order'] + 1
+                    seats = list(range(first, first + options['seats_per_order']))
+                    request = factory.post('/', {'selected_seats': json.dumps(seats)})
+                    request.user = user
+                    try:
+                        redirect_url, _ = purchase(request, session, payment_client=payment_client)
+                    except DatabaseError:
+                        redirect_url = None
+                    if not redirect_url:
+                        with lock:
+                            failed += 1
+            finally:
+                connection.close()
+
+        with mock.patch.object(services, 'reserve_seats', timed_reserve_seats), \
+                mock.patch.object(services, 'schedule_order_expiry'):
+            threads = [threading.Thread(target=worker, args=(i, user)) for i, user in enumerate(users)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        return hold_times, failed, elapsed
+
+    def report(self, name, hold_times, failed, elapsed):
+        if not hold_times:
+            self.stdout.write(f'{name}: no checkout committed, {failed} failed')
+            return
+        hold_ms = sorted(t * 1000 for t in hold_times)
+        self.stdout.write(
+            f'{name}: {len(hold_times)} checkouts in {elapsed:.2f}s, transaction held '
+            f'p50 {percentile(hold_ms, 0.5):.1f}ms / max {hold_ms[-1]:.1f}ms, {failed} failed'
+        )
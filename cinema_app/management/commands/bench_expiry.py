@@ -0,0 +1,99 @@
+import time
+from datetime import date, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from cinema_app.models import Hall, Movie, Order, Session, Ticket
+from cinema_app.tasks import ORDER_EXPIRATION, cancel_unpaid_orders
+
+SEATS_PER_SESSION = 1000
+
+
+def legacy_cancel_unpaid_orders():
+    # Former cancel_unpaid_orders: one UPDATE for the tickets and one for the order, per order
+    unpaid_orders = Order.objects.filter(
+        status=Order.PENDING,
+        created_at__lte=now() - ORDER_EXPIRATION
+    ).prefetch_related('tickets')
+
+    for order in unpaid_orders:
+        order.tickets.update(status=Ticket.CANCELLED)
+        order.status = Order.CANCELLED
+        order.save()
+
+
+class Command(BaseCommand):
+    help = ('Compare the former per-order expiry loop with the batched cancel_unpaid_orders on scratch data '
+            '(pending orders past the deadline). The scratch data is deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=100_000)
+        parser.add_argument('--tickets-per-order', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--skip-legacy', action='store_true')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Seeding {options['orders']} pending orders...")
+        hall, movie, user = self.seed(options['orders'], options['tickets_per_order'])
+        try:
+            if not options['skip_legacy']:
+                self.measure('legacy per-order loop', legacy_cancel_unpaid_orders)
+                self.reset(movie)
+            self.measure(f"batched, {options['batch_size']} per batch",
+                         lambda: cancel_unpaid_orders(batch_size=options['batch_size']))
+        finally:
+            hall.delete()
+            movie.delete()
+            user.delete()
+
+    def measure(self, name, expire):
+        query_count = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal query_count
+            query_count += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_queries):
+            started = time.perf_counter()
+            expire()
+            elapsed = time.perf_counter() - started
+        self.stdout.write(f'{name}: {elapsed:.2f}s, {query_count} queries')
+
+    def seed(self, orders, tickets_per_order):
+        hall = Hall.objects.create(name='bench-expiry', capacity=SEATS_PER_SESSION)
+        movie = Movie.objects.create(title='Bench expiry', original_name='Bench expiry', description='-',
+                                     duration=90, release_date=date.today(), age_limit=0)
+        user = User.objects.create(username='bench-expiry')
+
+        orders_per_session = SEATS_PER_SESSION // tickets_per_order
+        session_count = -(-orders // orders_per_session)
+        sessions = Session.objects.bulk_create([
+            Session(hall=hall, movie=movie, base_ticket_price=Decimal('100'), slug=f'bench-expiry-{i}',
+                    session_date=date.today() + timedelta(days=1 + i // 12), start_time=dt_time(10 + i % 12, 0))
+            for i in range(session_count)
+        ])
+
+        with transaction.atomic():
+            for offset in range(0, orders, 5000):
+                chunk = range(offset, min(offset + 5000, orders))
+                created = Order.objects.bulk_create([
+                    Order(user=user, session=sessions[i // orders_per_session], total_price=Decimal('200'))
+                    for i in chunk
+                ])
+                Ticket.objects.bulk_create([
+                    Ticket(session=order.session, user=user, order=order, price=Decimal('100'),
+                           seat_number=(i % orders_per_session) * tickets_per_order + seat)
+                    for i, order in zip(chunk, created)
+                    for seat in range(1, tickets_per_order + 1)
+                ])
+            Order.objects.filter(session__movie=movie).update(created_at=now() - 2 * ORDER_EXPIRATION)
+        return hall, movie, user
+
+    def reset(self, movie):
+        Ticket.objects.filter(session__movie=movie).update(status=Ticket.RESERVED)
+        Order.objects.filter(session__movie=movie).update(status=Order.PENDING)
@@ -0,0 +1,68 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from faker import Faker
+
+from cinema_app.management.benchmarking import percentile
+from cinema_app.models import Movie
+from cinema_app.search import get_search_index, search_movies, update_search_vector, uses_postgres_search
+
+QUERIES = ['lord', 'ring', 'повернення короля', 'кохання', 'the return', 'war', 'lrod']
+
+
+def legacy_search(queryset, query):
+    # Former MovieListView search: capitalize() and three ILIKE '%x%' filters
+    query = query.capitalize()
+    return queryset.filter(Q(title__icontains=query) | Q(description__icontains=query)
+                           | Q(original_name__icontains=query))
+
+
+class Command(BaseCommand):
+    help = ('Compare the former icontains search with the full-text search backend on scratch catalogs '
+            '(10k and 100k movies by default). The scratch movies are deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--catalogs', nargs='+', type=int, default=[10_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        backend = 'postgres full-text' if uses_postgres_search() else 'in-memory inverted index'
+        self.stdout.write(f'search backend: {backend}')
+        for size in options['catalogs']:
+            prefix = f'bench-search-{size}-'
+            self.seed(size, prefix)
+            try:
+                queryset = Movie.objects.filter(slug__startswith=prefix).order_by('id')
+                if not uses_postgres_search():
+                    started = time.perf_counter()
+                    get_search_index()
+                    self.stdout.write(f'{size} movies: index built in {time.perf_counter() - started:.2f}s')
+                for name, search in (('icontains', legacy_search), ('search_movies', search_movies)):
+                    timings = []
+                    for _ in range(options['repeat']):
+                        for query in QUERIES:
+                            started = time.perf_counter()
+                            list(search(queryset, query)[:20])
+                            timings.append(time.perf_counter() - started)
+                    self.stdout.write(f'{size} movies, {name}: {percentile(timings, 0.5) * 1000:.1f}ms p50, '
+                                      f'{max(timings) * 1000:.1f}ms max per query')
+            finally:
+                Movie.objects.filter(slug__startswith=prefix).delete()
+
+    def seed(self, size, prefix):
+        fake_uk, fake_en = Faker('uk_UA'), Faker('en_US')
+        Faker.seed(size)
+        movies = [
+            Movie(title=fake_uk.sentence(nb_words=3)[:100], original_name=fake_en.sentence(nb_words=3)[:100],
+                  description=fake_uk.paragraph(nb_sentences=5), duration=120, release_date=date(2024, 1, 1),
+                  age_limit=0, slug=f'{prefix}{i}')
+            for i in range(size)
+        ]
+        Movie.objects.bulk_create(movies, batch_size=2000)
+        if uses_postgres_search():
+            from cinema_app.search import movie_search_vector
+            Movie.objects.filter(slug__startswith=prefix).update(search_vector=movie_search_vector())
+        # Bumps the index version so the fallback index is rebuilt with the scratch movies
+        update_search_vector(movies[0])
@@ -0,0 +1,39 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from cinema_app.seats import SeatMap
+
+
+def legacy_available_seats(capacity, booked):
+    # Former Session.get_available_seats: membership test against the booked seat list for every seat
+    return [seat for seat in range(1, capacity + 1) if seat not in booked]
+
+
+def seat_map_available_seats(capacity, booked):
+    return SeatMap(capacity, booked).available()
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark of seat availability: legacy list scan vs SeatMap'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capacities', nargs='+', type=int, default=[100, 400, 1000])
+        parser.add_argument('--occupancy', type=float, default=0.5, help='Share of booked seats (0..1)')
+        parser.add_argument('--number', type=int, default=200, help='Iterations per measurement')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        number = options['number']
+
+        self.stdout.write(f"{'seats':>6} {'legacy, ms':>12} {'seat map, ms':>13} {'speedup':>8}")
+        for capacity in options['capacities']:
+            booked = rng.sample(range(1, capacity + 1), int(capacity * options['occupancy']))
+            assert legacy_available_seats(capacity, booked) == seat_map_available_seats(capacity, booked)
+
+            legacy = timeit.timeit(lambda: legacy_available_seats(capacity, booked), number=number) / number
+            seat_map = timeit.timeit(lambda: seat_map_available_seats(capacity, booked), number=number) / number
+            self.stdout.write(
+                f'{capacity:>6} {legacy * 1000:>12.3f} {seat_map * 1000:>13.3f} {legacy / seat_map:>7.1f}x'
+            )
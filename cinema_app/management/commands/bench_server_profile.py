@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.test import Client, override_settings
+
+from cinema_app.management.benchmarking import percentile
+
+# The setup before the production profile: a new connection per request and sessions in the database
+LEGACY_DATABASE = {'CONN_MAX_AGE': 0, 'OPTIONS': {}}
+LEGACY_SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
+
+class Command(BaseCommand):
+    help = ('Request latency through the full middleware stack with the configured database and session '
+            'settings (run with cinema.settings_prod for the pool and cached_db sessions) compared with a new '
+            'connection per request and database sessions. Requests are made as a logged-in user.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per path and profile')
+        parser.add_argument('--path', action='append', help='Paths to request (default: /readyz/ and /profile/)')
+
+    def handle(self, *args, **options):
+        paths = options['path'] or ['/readyz/', '/profile/']
+        host = next((host for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        user, _ = User.objects.get_or_create(username='bench-server-profile')
+        configured = {key: connection.settings_dict.get(key) for key in LEGACY_DATABASE}
+        try:
+            # Legacy first: a pool is only created on the first connection with the pool option set
+            connection.close()
+            connection.settings_dict.update(LEGACY_DATABASE)
+            with override_settings(SESSION_ENGINE=LEGACY_SESSION_ENGINE):
+                self.measure('per-request connection, db sessions', paths, user, host, options['requests'])
+            connection.close()
+            connection.settings_dict.update(configured)
+
+            pooled = bool(connection.settings_dict.get('OPTIONS', {}).get('pool'))
+            reuse = 'pool' if pooled else f"CONN_MAX_AGE={connection.settings_dict.get('CONN_MAX_AGE')}"
+            engine = settings.SESSION_ENGINE.rsplit('.', 1)[-1]
+            self.measure(f'configured: {reuse}, {engine} sessions', paths, user, host, options['requests'])
+        finally:
+            connection.settings_dict.update(configured)
+            user.delete()
+
+    def measure(self, name, paths, user, host, requests):
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+        for path in paths:
+            latencies = []
+            for _ in range(requests):
+                started = time.perf_counter()
+                response = client.get(path)
+                latencies.append((time.perf_counter() - started) * 1000)
+                # Outside a server the request_finished handler never closes connections; do what it would do
+                close_old_connections()
+            self.stdout.write(f'{name} {path} [{response.status_code}]: p50 {percentile(latencies, 0.5):.2f}ms, '
+                              f'p99 {percentile(latencies, 0.99):.2f}ms')
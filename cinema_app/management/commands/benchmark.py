@@ -0,0 +1,313 @@
+import json
+import random
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.test import Client, RequestFactory
+from django.utils.timezone import now
+from faker import Faker
+
+from cinema_app import services
+from cinema_app.factories import (GENRE_NAMES, SESSION_TIMES, GenreFactory, HallFactory, MovieFactory,
+                                  SessionFactory, UserFactory, prepare_movie, prepare_session)
+from cinema_app.management.benchmarking import percentile
+from cinema_app.management.commands.bench_checkout import SlowStripe
+from cinema_app.models import Hall, Movie, Order, Session, Ticket
+from cinema_app.pricing import price_vector
+from cinema_app.schedule import invalidate_schedule
+from cinema_app.search import SEARCH_INDEX_VERSION_KEY, movie_search_vector, uses_postgres_search
+from cinema_app.seats import get_hall_layout
+from cinema_app.session_stats import rebuild_session_stats
+from cinema_app.tasks import ORDER_EXPIRATION, expire_order
+
+FLOWS = ('movie_list', 'schedule', 'seat_polling', 'purchase', 'expiry')
+CHUNK_SIZE = 5000
+# Share of the seeded orders by outcome; pending orders past their deadline feed the expiry flow
+ORDER_MIX = {Order.COMPLETED: 0.7, Order.CANCELLED: 0.1, Order.PENDING: 0.2}
+TICKET_STATUS = {Order.COMPLETED: Ticket.BOOKED, Order.CANCELLED: Ticket.CANCELLED, Order.PENDING: Ticket.RESERVED}
+# Seeded tickets fill at most this share of a hall; the rest is left for the purchase flow
+MAX_OCCUPANCY = 0.8
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Seed a realistic catalog (halls, movies, sessions, users, orders and tickets) and drive the main '
+            'flows in-process with concurrent workers: movie listing, schedule, seat polling, purchase and '
+            'expiry. Prints throughput, latency percentiles and queries per operation as JSON, to compare '
+            'commits. Use Postgres for concurrency above 1: SQLite serialises writers. The seeded data is '
+            'deleted afterwards unless --keep is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--halls', type=int, default=1000)
+        parser.add_argument('--movies', type=int, default=2000)
+        parser.add_argument('--days', type=int, default=3, help='Days of sessions, five sessions per hall a day')
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--orders', type=int, default=1_000_000)
+        parser.add_argument('--tickets-per-order', type=int, default=2)
+        parser.add_argument('--flows', nargs='+', choices=FLOWS, default=list(FLOWS))
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--requests', type=int, default=500, help='Operations per flow')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data and traffic')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--keep', action='store_true', help='Leave the seeded data in the database')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be positive')
+        random.seed(options['seed'])
+        Faker.seed(options['seed'])
+        prefix = f'bench-{uuid.uuid4().hex[:8]}'
+
+        started = time.perf_counter()
+        try:
+            data = self.seed(prefix, options)
+            report = {
+                'commit': git_commit(),
+                'database': connection.vendor,
+                'concurrency': options['concurrency'],
+                'seed': {**data['counts'], 'seconds': round(time.perf_counter() - started, 2)},
+                'flows': {},
+            }
+            for flow in options['flows']:
+                self.stderr.write(f'Running {flow}...')
+                operations = getattr(self, f'{flow}_operations')(data, options['requests'])
+                report['flows'][flow] = self.run(operations, options['concurrency'])
+        finally:
+            if not options['keep']:
+                self.stderr.write('Deleting the seeded data...')
+                self.cleanup(prefix)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def seed(self, prefix, options):
+        fake = Faker('en_US')
+        genres = [GenreFactory(name=name) for name in GENRE_NAMES]
+
+        self.stderr.write(f"Seeding {options['halls']} halls, {options['movies']} movies, "
+                          f"{options['users']} users...")
+        halls = Hall.objects.bulk_create(
+            [HallFactory.build(name=f'{prefix} {i + 1}') for i in range(options['halls'])], batch_size=CHUNK_SIZE)
+        movies = Movie.objects.bulk_create([
+            prepare_movie(MovieFactory.build(original_name=f'{prefix} {i} {fake.catch_phrase()}'[:100]))
+            for i in range(options['movies'])
+        ], batch_size=CHUNK_SIZE)
+        Movie.genre.through.objects.bulk_create([
+            Movie.genre.through(movie_id=movie.id, genre_id=genre.id)
+            for movie in movies for genre in random.sample(genres, random.randint(1, 3))
+        ], batch_size=CHUNK_SIZE)
+        if uses_postgres_search():
+            Movie.objects.filter(slug__startswith=prefix).update(search_vector=movie_search_vector())
+        users = User.objects.bulk_create(
+            [UserFactory.build(username=f'{prefix}-{i}') for i in range(options['users'])], batch_size=CHUNK_SIZE)
+
+        # Session slugs are title-date-time, so the same movie at the same time in two halls needs a suffix
+        sessions, slugs = [], set()
+        first_day = date.today() + timedelta(days=1)
+        for day in range(options['days']):
+            for hall in halls:
+                for start_time in SESSION_TIMES:
+                    session = prepare_session(SessionFactory.build(
+                        hall=hall, movie=random.choice(movies), session_date=first_day + timedelta(days=day),
+                        start_time=start_time))
+                    if session.slug in slugs:
+                        session.slug = f'{session.slug}-{hall.id}'
+                    slugs.add(session.slug)
+                    sessions.append(session)
+        self.stderr.write(f'Seeding {len(sessions)} sessions...')
+        sessions = Session.objects.bulk_create(sessions, batch_size=CHUNK_SIZE)
+
+        self.stderr.write(f"Seeding {options['orders']} orders...")
+        filled, expired = self.seed_orders(sessions, users, options['orders'], options['tickets_per_order'])
+
+        # bulk_create sends no signals: fill the session counters and drop the cached schedule and search index
+        rebuild_session_stats(Session.objects.filter(hall__name__startswith=prefix).values('id'))
+        invalidate_schedule()
+        invalidate_schedule(*{session.session_date for session in sessions})
+        cache.set(SEARCH_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+
+        return {
+            'movies': movies, 'users': users, 'sessions': sessions, 'filled': filled, 'expired': expired,
+            'counts': {
+                'halls': len(halls), 'movies': len(movies), 'sessions': len(sessions), 'users': len(users),
+                'orders': sum(filled.values()) // options['tickets_per_order'], 'tickets': sum(filled.values()),
+            },
+        }
+
+    def seed_orders(self, sessions, users, orders, tickets_per_order):
+        """
+        Spread ``orders`` over the sessions with consecutive seats from seat 1
+        up. Returns the number of seats taken per session id and the ids of the
+        pending orders that are past their payment deadline.
+        """
+        free = [int(session.hall.capacity * MAX_OCCUPANCY) // tickets_per_order for session in sessions]
+        filled = dict.fromkeys((session.id for session in sessions), 0)
+        expired, created = [], 0
+        order_deadline = now() - 2 * ORDER_EXPIRATION
+        session_index = 0
+
+        while created < orders and any(free):
+            with transaction.atomic():
+                chunk = []
+                while len(chunk) < CHUNK_SIZE and created + len(chunk) < orders and any(free):
+                    session_index = (session_index + 1) % len(sessions)
+                    if free[session_index]:
+                        free[session_index] -= 1
+                        chunk.append(sessions[session_index])
+                statuses = random.choices(list(ORDER_MIX), weights=list(ORDER_MIX.values()), k=len(chunk))
+                new_orders = [Order(user=random.choice(users), session=session, status=status)
+                              for session, status in zip(chunk, statuses)]
+                tickets = []
+                for order in new_orders:
+                    vector = price_vector(get_hall_layout(order.session.hall), order.session.base_ticket_price)
+                    seats = range(filled[order.session.id] + 1, filled[order.session.id] + tickets_per_order + 1)
+                    filled[order.session.id] += tickets_per_order
+                    order.total_price = sum((vector[seat] for seat in seats), Decimal(0))
+                    tickets.extend(Ticket(session=order.session, user=order.user, order=order, seat_number=seat,
+                                          price=vector[seat], status=TICKET_STATUS[order.status]) for seat in seats)
+                Order.objects.bulk_create(new_orders)
+                Ticket.objects.bulk_create(tickets)
+                # Half of the pending orders were never paid and are due for expiry
+                overdue = [order.id for order in new_orders if order.status == Order.PENDING and order.id % 2]
+                Order.objects.filter(id__in=overdue).update(created_at=order_deadline)
+                expired.extend(overdue)
+                created += len(chunk)
+        return filled, expired
+
+    def movie_list_operations(self, data, requests):
+        pages = max(1, len(data['movies']) // 3)
+        return [('get', f'/movies/?page={random.randint(1, pages)}') for _ in range(requests)]
+
+    def schedule_operations(self, data, requests):
+        dates = sorted({session.session_date for session in data['sessions']})
+        return [('get', f'/sessions/?date={random.choice(dates).isoformat()}') for _ in range(requests)]
+
+    def seat_polling_operations(self, data, requests):
+        return [('get', f'/session/{random.choice(data["sessions"]).slug}/available_seats/')
+                for _ in range(requests)]
+
+    def purchase_operations(self, data, requests):
+        # Each purchase takes two seats from the free part of a hall, so purchases never conflict
+        operations, taken = [], dict(data['filled'])
+        sessions = [session for session in data['sessions'] if session.hall.capacity - taken[session.id] >= 2]
+        while sessions and len(operations) < requests:
+            session = random.choice(sessions)
+            seats = [taken[session.id] + 1, taken[session.id] + 2]
+            taken[session.id] += 2
+            if session.hall.capacity - taken[session.id] < 2:
+                sessions.remove(session)
+            operations.append(('purchase', (random.choice(data['users']), session, seats)))
+        return operations
+
+    def expiry_operations(self, data, requests):
+        return [('expire', order_id) for order_id in data['expired'][:requests]]
+
+    def run(self, operations, concurrency):
+        latencies, query_counts, errors = [], [], 0
+        lock = threading.Lock()
+        remaining = iter(operations)
+        host = next((host for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        payment_client = SlowStripe(0)
+
+        def worker():
+            nonlocal errors
+            client, factory = Client(HTTP_HOST=host), RequestFactory(HTTP_HOST=host)
+            query_count = 0
+
+            def count_queries(execute, sql, params, many, context):
+                nonlocal query_count
+                query_count += 1
+                return execute(sql, params, many, context)
+
+            try:
+                with connection.execute_wrapper(count_queries):
+                    while True:
+                        with lock:
+                            operation = next(remaining, None)
+                        if operation is None:
+                            break
+                        query_count = 0
+                        started = time.perf_counter()
+                        ok = self.perform(operation, client, factory, payment_client)
+                        elapsed = time.perf_counter() - started
+                        with lock:
+                            if ok:
+                                latencies.append(elapsed)
+                                query_counts.append(query_count)
+                            else:
+                                errors += 1
+            finally:
+                connection.close()
+
+        with mock.patch.object(services, 'schedule_order_expiry'):
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        return self.summarise(latencies, query_counts, errors, elapsed)
+
+    def perform(self, operation, client, factory, payment_client):
+        kind, argument = operation
+        try:
+            if kind == 'get':
+                return client.get(argument).status_code == 200
+            if kind == 'purchase':
+                user, session, seats = argument
+                request = factory.post('/', {'selected_seats': json.dumps(seats)})
+                request.user = user
+                redirect_url, _ = services.purchase_ticket_process(request, session, payment_client=payment_client)
+                return bool(redirect_url)
+            return expire_order(argument).endswith('canceled.')
+        except DatabaseError:
+            return False
+
+    def summarise(self, latencies, query_counts, errors, elapsed):
+        result = {'operations': len(latencies), 'errors': errors, 'seconds': round(elapsed, 3),
+                  'throughput': round(len(latencies) / elapsed, 1) if elapsed else None}
+        if latencies:
+            latencies_ms = sorted(latency * 1000 for latency in latencies)
+            result.update({
+                'p50_ms': round(percentile(latencies_ms, 0.5), 2),
+                'p95_ms': round(percentile(latencies_ms, 0.95), 2),
+                'p99_ms': round(percentile(latencies_ms, 0.99), 2),
+                'max_ms': round(latencies_ms[-1], 2),
+                'queries_per_op': round(statistics.mean(query_counts), 2),
+            })
+        return result
+
+    def cleanup(self, prefix):
+        # Tickets and orders go by session chunks with plain DELETEs; sessions, halls and movies send
+        # their post_delete signals so the schedule cache is dropped as well
+        session_ids = list(Session.objects.filter(hall__name__startswith=prefix).values_list('id', flat=True))
+        for offset in range(0, len(session_ids), 500):
+            chunk = session_ids[offset:offset + 500]
+            Ticket.objects.filter(session_id__in=chunk).delete()
+            Order.objects.filter(session_id__in=chunk).delete()
+        Hall.objects.filter(name__startswith=prefix).delete()
+        Movie.objects.filter(slug__startswith=prefix).delete()
+        User.objects.filter(username__startswith=prefix).delete()
@@ -0,0 +1,72 @@
+import time
+from datetime import date, time as day_time
+from decimal import Decimal
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from cinema_app.models import Hall, Movie
+from cinema_app.timetable import (prepare_session, read_timetable, recurring_sessions, schedule_sessions,
+                                  timetable_sessions, validate_sessions)
+
+
+class Command(BaseCommand):
+    help = ('Schedule many sessions at once from a CSV/JSON timetable (columns hall, movie, date, start_time, price; '
+            'hall is an id or a name, movie a slug) or from a recurrence rule (--movie, --hall, --from, --to, '
+            '--times). Every session is validated first, hall conflicts included, and either all are inserted or '
+            'none.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('timetable', nargs='?', help='CSV or JSON file, by its extension')
+        parser.add_argument('--movie', help='Movie slug of a recurring schedule')
+        parser.add_argument('--hall', action='append', dest='halls', type=int, default=[], help='Hall id, repeatable')
+        parser.add_argument('--from', dest='first_date', type=date.fromisoformat, help='First day, YYYY-MM-DD')
+        parser.add_argument('--to', dest='last_date', type=date.fromisoformat, help='Last day, YYYY-MM-DD')
+        parser.add_argument('--times', nargs='+', type=day_time.fromisoformat, default=[],
+                            help='Start times, HH:MM')
+        parser.add_argument('--weekdays', nargs='+', type=int, choices=range(7),
+                            help='Only these days of the week, 0 is Monday (every day by default)')
+        parser.add_argument('--price', type=Decimal, help='Base ticket price of a recurring schedule')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, insert nothing')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            sessions = self.timetable(options) if options['timetable'] else self.recurrence(options)
+            if options['dry_run']:
+                validate_sessions([prepare_session(session) for session in sessions])
+                created = sessions
+            else:
+                created = schedule_sessions(sessions)
+        except ValidationError as e:
+            raise CommandError('\n'.join(e.messages))
+
+        action = 'valid' if options['dry_run'] else 'scheduled'
+        self.stdout.write(f'{len(created)} sessions {action} in {time.perf_counter() - started:.2f}s')
+
+    def timetable(self, options):
+        path = Path(options['timetable'])
+        try:
+            with path.open(newline='', encoding='utf-8') as file:
+                return timetable_sessions(read_timetable(file, path.suffix.lstrip('.').lower()))
+        except OSError as e:
+            raise CommandError(str(e))
+        except ValueError as e:
+            # json.JSONDecodeError
+            raise CommandError(f'{path}: {e}')
+
+    def recurrence(self, options):
+        required = ('movie', 'halls', 'first_date', 'last_date', 'times', 'price')
+        missing = [name for name in required if not options[name]]
+        if missing:
+            raise CommandError(f'Give a timetable file, or a recurrence rule with {", ".join(missing)} as well')
+        try:
+            movie = Movie.objects.only('slug', 'title', 'original_name', 'duration').get(slug=options['movie'])
+        except Movie.DoesNotExist:
+            raise CommandError(f'Unknown movie {options["movie"]}')
+        halls = list(Hall.objects.filter(pk__in=options['halls']))
+        if len(halls) != len(set(options['halls'])):
+            raise CommandError(f'Unknown hall in {options["halls"]}')
+        return recurring_sessions(movie, halls, options['first_date'], options['last_date'], options['times'],
+                                  options['price'], options['weekdays'])
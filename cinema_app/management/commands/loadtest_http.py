@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+from cinema_app.management.benchmarking import percentile
+
+
+class Command(BaseCommand):
+    help = ('HTTP load test of running servers: sends the same requests to every --target (e.g. the ASGI '
+            'and the WSGI build) with a fixed number of concurrent clients and reports p50/p99 latency and '
+            'requests per second.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to request, e.g. /session/<slug>/available_seats/')
+        parser.add_argument('--target', action='append', metavar='NAME=URL',
+                            help='Server to test, repeatable (default: asgi=http://localhost:8000 '
+                                 'wsgi=http://localhost:8001)')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--cookie', action='append', default=[], metavar='NAME=VALUE',
+                            help='Cookie to send, e.g. sessionid=... for login-protected pages')
+
+    def handle(self, *args, **options):
+        if options['path'].rstrip('/').endswith('/seat_events'):
+            # Never ends on ASGI and is a bare 204 on WSGI: there is nothing comparable to time
+            raise CommandError('seat_events is a stream, load test it with loadtest_seat_events')
+        targets = options['target'] or ['asgi=http://localhost:8000', 'wsgi=http://localhost:8001']
+        try:
+            targets = [target.split('=', 1) for target in targets]
+            cookies = dict(cookie.split('=', 1) for cookie in options['cookie'])
+        except ValueError:
+            raise CommandError('Targets and cookies must be given as NAME=VALUE')
+
+        for name, base_url in targets:
+            result = asyncio.run(self.run(base_url.rstrip('/') + options['path'], cookies,
+                                          options['requests'], options['concurrency']))
+            self.report(name, *result)
+
+    async def run(self, url, cookies, total, concurrency):
+        latencies, errors = [], 0
+        remaining = total
+
+        async def client(http):
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    response = await http.get(url)
+                    ok = response.status_code < 500
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(cookies=cookies, limits=limits, timeout=30, follow_redirects=False) as http:
+            started = time.perf_counter()
+            await asyncio.gather(*(client(http) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+        return latencies, errors, elapsed
+
+    def report(self, name, latencies, errors, elapsed):
+        if not latencies:
+            self.stdout.write(f'{name}: no successful requests, {errors} errors')
+            return
+        latencies_ms = sorted(latency * 1000 for latency in latencies)
+        self.stdout.write(
+            f'{name}: {len(latencies) / elapsed:.0f} req/s, p50 {percentile(latencies_ms, 0.5):.1f}ms, '
+            f'p99 {percentile(latencies_ms, 0.99):.1f}ms, max {latencies_ms[-1]:.1f}ms, '
+            f'{len(latencies)} ok / {errors} errors in {elapsed:.2f}s'
+        )
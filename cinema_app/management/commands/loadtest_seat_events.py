@@ -0,0 +1,135 @@
+import asyncio
+import random
+import statistics
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from django.urls import reverse
+
+from cinema_app.management.benchmarking import percentile
+from cinema_app.seats import get_cached_seat_map, seat_map_cache_key
+
+POLL_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = ('In-process load test of the seat picker updates through the real views: the HTTP requests and cache '
+            'lookups of clients polling available_seats every 5 seconds compared with clients on the seat_events '
+            'stream, and the time for a reservation to reach every open stream')
+
+    def add_arguments(self, parser):
+        parser.add_argument('session_slug')
+        parser.add_argument('--clients', type=int, default=200, help='Open seat pickers')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds each way of updating is measured')
+        parser.add_argument('--reservations', type=int, default=5)
+
+    def handle(self, *args, **options):
+        session_slug = options['session_slug']
+        seat_map = get_cached_seat_map(session_slug)
+        if seat_map is None:
+            raise CommandError(f'Session "{session_slug}" does not exist')
+        if seat_map.free_count < options['reservations']:
+            raise CommandError('Not enough free seats for the requested reservations')
+
+        host = next((host for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        clients, duration = options['clients'], options['duration']
+        key = seat_map_cache_key(session_slug)
+        original = cache.get(key)
+        try:
+            polling = self.measure(self.poll(session_slug, host, clients, duration))
+            streaming = self.measure(self.stream(session_slug, seat_map, host, clients, duration,
+                                                 options['reservations']))
+        finally:
+            # Reservations are simulated in the cache only, put the real seat map back
+            cache.set(key, original, settings.SEAT_MAP_CACHE_TIMEOUT)
+
+        self.stdout.write(f'clients: {clients}, measured for {duration:.0f}s each')
+        for name, (requests, lookups, _) in ((f'polling every {POLL_INTERVAL}s', polling),
+                                             ('seat_events', streaming)):
+            self.stdout.write(f'{name}: {requests} requests ({requests * 60 / duration:.0f}/min), '
+                              f'{lookups} cache lookups ({lookups * 60 / duration:.0f}/min)')
+        latencies = streaming[2]
+        self.stdout.write(f'reservation visible, polling: ~{POLL_INTERVAL / 2:.2f}s mean, {POLL_INTERVAL:.2f}s worst')
+        if latencies:
+            self.stdout.write(f'reservation visible, seat_events: {statistics.mean(latencies):.3f}s mean, '
+                              f'{percentile(latencies, 0.5):.3f}s p50, {max(latencies):.3f}s worst '
+                              f'({len(latencies)} deliveries)')
+
+    @staticmethod
+    def measure(run):
+        """Run a load coroutine, counting the keys it reads from the cache (see cache_backends)."""
+        lookups = 0
+
+        def count(hits, misses):
+            nonlocal lookups
+            lookups += hits + misses
+
+        with mock.patch('cinema_app.cache_backends.record_cache', count):
+            requests, latencies = asyncio.run(run)
+        return requests, lookups, latencies
+
+    async def poll(self, session_slug, host, clients, duration):
+        url = reverse('available_seats', args=[session_slug])
+        deadline = time.monotonic() + duration
+        requests = 0
+
+        async def poller():
+            nonlocal requests
+            client = AsyncClient(headers={'host': host})
+            await asyncio.sleep(random.uniform(0, POLL_INTERVAL))
+            while time.monotonic() < deadline:
+                await client.get(url)
+                requests += 1
+                await asyncio.sleep(POLL_INTERVAL)
+
+        await asyncio.gather(*(poller() for _ in range(clients)))
+        return requests, []
+
+    async def stream(self, session_slug, seat_map, host, clients, duration, reservations):
+        url = reverse('seat_events', args=[session_slug])
+        key = seat_map_cache_key(session_slug)
+        deadline = time.monotonic() + duration
+        requests = 0
+        latencies = []
+        changed_at = 0.0
+        delivered = 0
+        all_delivered = asyncio.Event()
+
+        async def subscriber():
+            nonlocal requests, delivered
+            client = AsyncClient(headers={'host': host})
+            # The browser's EventSource reconnects when the server closes the stream
+            while time.monotonic() < deadline:
+                response = await client.get(url)
+                requests += 1
+                async for chunk in response.streaming_content:
+                    if chunk.startswith(b'event: seats'):
+                        latencies.append(time.monotonic() - changed_at)
+                        delivered += 1
+                        if delivered == clients:
+                            all_delivered.set()
+
+        tasks = [asyncio.create_task(subscriber()) for _ in range(clients)]
+        await asyncio.sleep(settings.SEAT_EVENTS_POLL_INTERVAL)
+
+        current = seat_map.copy()
+        for seat in current.available()[:reservations]:
+            delivered = 0
+            all_delivered.clear()
+            current.take((seat,))
+            changed_at = time.monotonic()
+            await cache.aset(key, current.to_bytes(), settings.SEAT_MAP_CACHE_TIMEOUT)
+            try:
+                await asyncio.wait_for(all_delivered.wait(), max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                break
+
+        await asyncio.sleep(max(deadline - time.monotonic(), 0))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return requests, latencies
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from cinema_app.models import Session
+from cinema_app.session_stats import rebuild_session_stats
+
+
+class Command(BaseCommand):
+    help = ('Recompute the seat counters and revenue of sessions (SessionStats) from their tickets and fix the '
+            'rows that drifted, e.g. after tickets were edited in the admin or sessions were bulk inserted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--upcoming', action='store_true', help='Only sessions from today on')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        session_ids = None
+        if options['upcoming']:
+            session_ids = Session.objects.filter(session_date__gte=now().date()).values('id')
+        checked, corrected = rebuild_session_stats(session_ids)
+        self.stdout.write(f'{checked} sessions checked, {corrected} corrected in {time.perf_counter() - started:.2f}s')
@@ -0,0 +1,12 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from cinema_app.seats import seat_hold_metrics
+
+
+class Command(BaseCommand):
+    help = 'Print seat hold counters: holds created, holds converted into orders and the conversion rate'
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(seat_hold_metrics()))
@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+from datetime import date, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count
+
+from cinema_app.models import Hall, Movie, Order, Session, Ticket
+from cinema_app.services import reserve_seats
+
+
+def legacy_reserve_seats(user, session, seats):
+    # Former purchase_ticket_process: read occupied seats into a set, then one INSERT (plus clean()) per ticket
+    with transaction.atomic():
+        existing_tickets = set(
+            Ticket.objects.filter(session=session).exclude(status=Ticket.CANCELLED).values_list('seat_number', flat=True)
+        )
+        conflicts = [seat for seat in seats if seat in existing_tickets]
+        if conflicts:
+            return None, conflicts
+        price = session.base_ticket_price
+        order = Order.objects.create(user=user, session=session, total_price=price * len(seats), status=Order.PENDING)
+        for seat in seats:
+            Ticket.objects.create(session=session, user=user, seat_number=seat, status=Ticket.RESERVED, price=price,
+                                  order=order)
+    return order, []
+
+
+class Command(BaseCommand):
+    help = ('Concurrency stress test of seat reservation: N threads contend for the same seats of a scratch '
+            'session, then double bookings and throughput are reported. The scratch data is deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--attempts', type=int, default=50, help='Reservation attempts per thread')
+        parser.add_argument('--capacity', type=int, default=100)
+        parser.add_argument('--seats-per-order', type=int, default=3)
+        parser.add_argument('--legacy', action='store_true', help='Also run the former create() loop for comparison')
+
+    def handle(self, *args, **options):
+        hall = Hall.objects.create(name='stress-test', capacity=options['capacity'])
+        movie = Movie.objects.create(title='Stress test', original_name='Stress test reservations', description='-',
+                                     duration=90, release_date=date.today(), age_limit=0)
+        users = [User.objects.get_or_create(username=f'stress-test-{i}')[0] for i in range(options['threads'])]
+        try:
+            implementations = [('bulk_create + constraint', reserve_seats)]
+            if options['legacy']:
+                implementations.append(('legacy create loop', legacy_reserve_seats))
+            for day, (name, reserve) in enumerate(implementations, start=1):
+                session = Session.objects.create(hall=hall, movie=movie, base_ticket_price=Decimal('100'),
+                                                 session_date=date.today() + timedelta(days=day),
+                                                 start_time=dt_time(20, 0))
+                self.report(name, session, *self.contend(reserve, session, users, options))
+        finally:
+            hall.delete()
+            movie.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def contend(self, reserve, session, users, options):
+        counters = {'reserved': 0, 'conflicts': 0, 'errors': 0}
+        lock = threading.Lock()
+        start = threading.Barrier(len(users))
+
+        def worker(user):
+            rng = random.Random(user.id)
+            start.wait()
+            try:
+                for _ in range(options['attempts']):
+                    # Draw from a narrow band so that threads keep colliding on the same seats
+                    seats = rng.sample(range(1, min(options['capacity'], 20) + 1), options['seats_per_order'])
+                    try:
+                        order, conflicts = reserve(user, session, seats)
+                    except DatabaseError:
+                        order, outcome = None, 'errors'
+                    else:
+                        outcome = 'conflicts' if conflicts else 'reserved'
+                    with lock:
+                        counters[outcome] += 1
+                    if order:
+                        # Give the seats back so the band never fills up
+                        order.tickets.update(status=Ticket.CANCELLED)
+                        Order.objects.filter(pk=order.pk).update(status=Order.CANCELLED)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counters, time.perf_counter() - started
+
+    def report(self, name, session, counters, elapsed):
+        double_booked = (Ticket.objects.filter(session=session)
+                         .exclude(status=Ticket.CANCELLED)
+                         .values('seat_number')
+                         .annotate(count=Count('id'))
+                         .filter(count__gt=1)
+                         .count())
+        attempts = sum(counters.values())
+        self.stdout.write(
+            f'{name}: {attempts} attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s), '
+            f'{counters["reserved"]} reserved, {counters["conflicts"]} conflicts, {counters["errors"]} db errors, '
+            f'{double_booked} double-booked seats'
+        )
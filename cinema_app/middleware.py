@@ -0,0 +1,46 @@
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .instrumentation import finish_request, start_request
+
+
+class PerformanceMiddleware:
+    """
+    Records wall time, queries, cache reads and Stripe calls of every request
+    (cinema_app.instrumentation). Works in both sync and async mode so async
+    views are not pushed to a thread. Put it first in MIDDLEWARE to time the
+    whole stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.SLOW_REQUEST_SAMPLE_RATE
+        self.slow_threshold = settings.SLOW_REQUEST_THRESHOLD_MS
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        # No random draw at all while the slow-request log is off
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, token = start_request(self.sampled())
+        started = time.perf_counter()
+        response = self.get_response(request)
+        finish_request(request, response, stats, token, time.perf_counter() - started, self.slow_threshold)
+        return response
+
+    async def __acall__(self, request):
+        stats, token = start_request(self.sampled())
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        finish_request(request, response, stats, token, time.perf_counter() - started, self.slow_threshold)
+        return response
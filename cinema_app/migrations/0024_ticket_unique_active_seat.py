@@ -0,0 +1,41 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:10
+
+import logging
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def cancel_duplicate_tickets(apps, schema_editor):
+    """Keep the earliest active ticket of each seat sold twice, cancel the others, so the constraint can be added."""
+    Ticket = apps.get_model('cinema_app', 'Ticket')
+    active = Ticket.objects.exclude(status='cancelled')
+    duplicated = (active.values('session_id', 'seat_number').annotate(tickets=Count('id'))
+                  .filter(tickets__gt=1).order_by())
+    cancelled = 0
+    for seat in duplicated.iterator():
+        later = (active.filter(session_id=seat['session_id'], seat_number=seat['seat_number'])
+                 .order_by('created_at', 'id').values_list('id', flat=True)[1:])
+        cancelled += Ticket.objects.filter(id__in=list(later)).update(status='cancelled', updated_at=timezone.now())
+    if cancelled:
+        logger.warning('Cancelled %d tickets for seats that already had an earlier active ticket', cancelled)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_app', '0023_remove_order_stripe_session_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicate_tickets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ticket',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'cancelled'), _negated=True), fields=('session', 'seat_number'), name='unique_active_seat_per_session'),
+        ),
+    ]
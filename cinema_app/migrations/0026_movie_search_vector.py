@@ -0,0 +1,63 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:17
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# The search indexes only exist on Postgres; other backends search through an in-memory index
+CREATE_SEARCH_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS cinema_app_movie_search_vector_gin '
+    'ON cinema_app_movie USING GIN (search_vector)',
+    'CREATE INDEX IF NOT EXISTS cinema_app_movie_title_trgm '
+    'ON cinema_app_movie USING GIN (title gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS cinema_app_movie_original_name_trgm '
+    'ON cinema_app_movie USING GIN (original_name gin_trgm_ops)',
+    # Same document as cinema_app.search.movie_search_vector()
+    "UPDATE cinema_app_movie SET search_vector = "
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(original_name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(original_name, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'C')",
+]
+
+DROP_SEARCH_INDEXES = [
+    'DROP INDEX IF EXISTS cinema_app_movie_original_name_trgm',
+    'DROP INDEX IF EXISTS cinema_app_movie_title_trgm',
+    'DROP INDEX IF EXISTS cinema_app_movie_search_vector_gin',
+]
+
+
+class PostgresTrigramExtension(TrigramExtension):
+    # CreateExtension skips other backends going forwards but queries pg_extension when reversed
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for statement in CREATE_SEARCH_INDEXES:
+            schema_editor.execute(statement)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for statement in DROP_SEARCH_INDEXES:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_app', '0025_order_status_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        PostgresTrigramExtension(),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_app', '0026_movie_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hall',
+            name='seat_categories',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Категорії місць'),
+        ),
+        migrations.AddField(
+            model_name='hall',
+            name='seats_per_row',
+            field=models.PositiveIntegerField(default=10, verbose_name='Місць у ряду'),
+        ),
+    ]
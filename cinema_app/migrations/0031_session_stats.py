@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_session_stats(apps, schema_editor):
+    # Same counts as session_stats.rebuild_session_stats, for the sessions that exist already
+    Session = apps.get_model('cinema_app', 'Session')
+    SessionStats = apps.get_model('cinema_app', 'SessionStats')
+    rows = Session.objects.annotate(
+        capacity=F('hall__capacity'),
+        booked=Count('ticket', filter=Q(ticket__status='booked')),
+        reserved=Count('ticket', filter=Q(ticket__status='reserved')),
+        revenue=Coalesce(Sum('ticket__price', filter=Q(ticket__status='booked')), 0,
+                         output_field=DecimalField(max_digits=12, decimal_places=2)),
+    ).values_list('id', 'capacity', 'booked', 'reserved', 'revenue')
+    SessionStats.objects.bulk_create([
+        SessionStats(session_id=session_id, capacity=capacity, booked=booked, reserved=reserved,
+                     available=capacity - booked - reserved, revenue=revenue)
+        for session_id, capacity, booked, reserved, revenue in rows.iterator(chunk_size=2000)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema_app', '0030_movie_poster_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionStats',
+            fields=[
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='cinema_app.session')),
+                ('capacity', models.PositiveIntegerField(verbose_name='Кількість місць')),
+                ('booked', models.IntegerField(default=0, verbose_name='Продано')),
+                ('reserved', models.IntegerField(default=0, verbose_name='Заброньовано')),
+                ('available', models.IntegerField(verbose_name='Вільно')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Виручка')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['available'], name='cinema_app__availab_e70eb5_idx')],
+            },
+        ),
+        migrations.RunPython(fill_session_stats, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,13 @@
 from datetime import time, timedelta, datetime, date
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
 from django.utils.text import slugify
+from .scheduling import session_interval, validate_schedule
+from .search import update_search_vector
+from .seats import HallLayout, SeatMap, get_hall_layout
 from .utils import poster_upload_to, generate_session_slug
 import re
 
@@ -11,10 +15,27 @@ import re
 class Hall(models.Model):
     name = models.CharField(max_length=100, db_index=True, verbose_name="Зал")
     capacity = models.PositiveIntegerField(verbose_name='Кількість місць')
+    seats_per_row = models.PositiveIntegerField(default=10, verbose_name='Місць у ряду')
+    # {"vip": [seat, ...], "comfort": [...]}; unlisted seats are standard, empty means the default centre layout
+    seat_categories = models.JSONField(default=dict, blank=True, verbose_name='Категорії місць')
 
     def clean(self, *args, **kwargs):
         if self.capacity is None or self.capacity <= 0:
             raise ValidationError("The capacity must be greater than zero.")
+        if not self.seats_per_row:
+            raise ValidationError("The number of seats per row must be greater than zero.")
+        if not isinstance(self.seat_categories, dict):
+            raise ValidationError("Seat categories must map a category to a list of seats.")
+        for category, seats in self.seat_categories.items():
+            if category not in HallLayout.CATEGORIES:
+                raise ValidationError(f"Unknown seat category: {category}.")
+            if not isinstance(seats, list) or any(not isinstance(seat, int) or not 1 <= seat <= self.capacity
+                                                  for seat in seats):
+                raise ValidationError(f"Seats of category {category} must be seat numbers of this hall.")
+
+    @property
+    def layout(self):
+        return get_hall_layout(self)
 
     def __str__(self):
         return self.name
@@ -44,7 +65,11 @@ class Movie(models.Model):
     release_date = models.DateField(verbose_name='Дата випуску')
     age_limit = models.PositiveIntegerField(choices=AGE_CHOICES, verbose_name='Вікове обмеження')
     poster = models.ImageField(upload_to=poster_upload_to, blank=True, null=True)
+    # Resized copies of the poster for srcset, maintained by cinema_app.posters
+    poster_variants = models.JSONField(default=dict, blank=True, editable=False)
     slug = models.SlugField(max_length=100, unique=True, blank=True)
+    # Full-text search document, maintained by save() on Postgres (GIN index created in migration 0026)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         indexes = [
@@ -68,6 +93,7 @@ class Movie(models.Model):
     def save(self, *args, **kwargs):
         self.slug = slugify(self.original_name)
         super().save(*args, **kwargs)
+        update_search_vector(self)
 
     def __str__(self):
         return self.title
@@ -90,19 +116,27 @@ class Session(models.Model):
             models.Index(fields=['movie']),
         ]
 
+    def get_seat_map(self):
+        return SeatMap.for_session(self)
+
+    async def aget_seat_map(self):
+        return await SeatMap.afor_session(self)
+
     def get_available_seats(self):
-        booked_tickets = (Ticket.objects.filter(session=self)
-                          .exclude(status='cancelled')
-                          .values_list('seat_number',
-                                       flat=True))
-        total_seats = self.hall.capacity
-        available_seats = [seat for seat in range(1, total_seats + 1) if seat not in booked_tickets]
-        return available_seats
+        return self.get_seat_map().available()
 
     def get_absolute_url(self):
         return reverse('session_detail', kwargs={'slug': self.slug})
 
     def clean(self):
+        self.clean_values()
+
+        # The hall must be free for the whole screening, including past midnight
+        if self.hall_id and self.movie_id:
+            validate_schedule([self])
+
+    def clean_values(self):
+        """The checks of clean() that need no query, also run by cinema_app.timetable on bulk imports."""
         # Ensure the base ticket price is a positive number
         if self.base_ticket_price is None or self.base_ticket_price <= 0:
             raise ValidationError("The ticket price must be greater than zero.")
@@ -125,18 +159,44 @@ class Session(models.Model):
 
     def save(self, *args, **kwargs):
         if self.start_time and self.movie:
-            duration = timedelta(minutes=self.movie.duration + 15)
-            datetime_start = timedelta(hours=self.start_time.hour, minutes=self.start_time.minute)
-            datetime_end = datetime_start + duration
-            self.end_time = (datetime.min + datetime_end).time()
+            # Wraps around for sessions that end after midnight; overlap checks use the full interval
+            self.end_time = session_interval(self).end.time()
         self.slug = generate_session_slug(self)
-        self.clean()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Serialises saves of sessions in the same hall between the overlap check and the write
+            # (a no-op on SQLite, which allows a single writer anyway)
+            list(Hall.objects.select_for_update().filter(pk=self.hall_id).values_list('pk', flat=True))
+            self.clean()
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f'{self.hall} | {self.session_date} | {self.start_time}'
 
 
+class SessionStats(models.Model):
+    """
+    Seat counters and revenue of a session, kept up to date by
+    cinema_app.session_stats as tickets change state so listings can show and
+    sort by availability without counting tickets.
+    """
+    session = models.OneToOneField(Session, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    capacity = models.PositiveIntegerField(verbose_name='Кількість місць')
+    # Plain integers: drift is corrected by rebuild_session_stats rather than failing a purchase on a CHECK
+    booked = models.IntegerField(default=0, verbose_name='Продано')
+    reserved = models.IntegerField(default=0, verbose_name='Заброньовано')
+    available = models.IntegerField(verbose_name='Вільно')
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Виручка')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available']),
+        ]
+
+    def __str__(self):
+        return f'{self.session}: {self.available}/{self.capacity}'
+
+
 class Order(models.Model):
     PENDING = 'pending'
     COMPLETED = 'completed'
@@ -152,9 +212,19 @@ class Order(models.Model):
     session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='orders')
     status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default=PENDING)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Checkout session of the last payment attempt, reused by retries while it is still open
+    stripe_session_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Expiry of unpaid orders scans pending orders by creation time
+            models.Index(fields=['status', 'created_at']),
+            # Order history of a user, keyset paginated on (created_at, id) in either direction
+            models.Index(fields=['user', '-created_at', '-id']),
+        ]
+
     def get_seat_numbers(self):
         return ', '.join(str(ticket.seat_number) for ticket in self.tickets.all())
 
@@ -199,6 +269,14 @@ class Ticket(models.Model):
             models.Index(fields=['session', 'seat_number']),
             models.Index(fields=['user']),
         ]
+        constraints = [
+            # A seat can be held by one active (reserved or booked) ticket per session
+            models.UniqueConstraint(
+                fields=['session', 'seat_number'],
+                condition=~models.Q(status='cancelled'),
+                name='unique_active_seat_per_session',
+            ),
+        ]
 
     def clean(self):
         hall_capacity = self.session.hall.capacity
@@ -214,3 +292,24 @@ class Ticket(models.Model):
     def __str__(self):
         return (f'{self.user.first_name} {self.user.last_name} | '
                 f' {self.session.movie} | {self.session}')
+
+
+class StripeEvent(models.Model):
+    """
+    Stripe webhook event, stored once per event id (Stripe retries deliveries)
+    and applied to its order by tasks.process_stripe_events.
+    """
+    CHECKOUT_COMPLETED = 'checkout.session.completed'
+    CHECKOUT_ASYNC_PAYMENT_SUCCEEDED = 'checkout.session.async_payment_succeeded'
+    CHECKOUT_EXPIRED = 'checkout.session.expired'
+    HANDLED_TYPES = (CHECKOUT_COMPLETED, CHECKOUT_ASYNC_PAYMENT_SUCCEEDED, CHECKOUT_EXPIRED)
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    order_id = models.PositiveIntegerField(null=True, blank=True)
+    payment_status = models.CharField(max_length=20, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.type} {self.event_id}'
@@ -0,0 +1,91 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Pagination over an ascending ``key`` (e.g. ``('created_at', 'id')``)
+    instead of OFFSET, so every page is a range scan on the key however deep
+    it is. Pages are addressed by opaque cursors passed as ``?after=`` and
+    ``?before=``; a malformed cursor gives the first page.
+    """
+
+    def __init__(self, queryset, per_page, key=('created_at', 'id')):
+        self.queryset = queryset.order_by(*key)
+        self.per_page = per_page
+        self.key = key
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, name) for name in self.key]
+        data = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            model = self.queryset.model
+            return [model._meta.get_field(name).to_python(value) for name, value in zip(self.key, values, strict=True)]
+        except (TypeError, ValueError, ValidationError):
+            return None
+
+    def _beyond(self, values, lookup):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y), generalised to any key length
+        condition = Q()
+        for i, name in enumerate(self.key):
+            step = Q(**{f'{name}__{lookup}': values[i]})
+            for previous_name, value in zip(self.key[:i], values):
+                step &= Q(**{previous_name: value})
+            condition |= step
+        return condition
+
+    def page(self, after=None, before=None):
+        before_values = self.decode_cursor(before) if before else None
+        after_values = self.decode_cursor(after) if after and not before_values else None
+
+        if before_values:
+            queryset = self.queryset.filter(self._beyond(before_values, 'lt')).reverse()
+            rows = list(queryset[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(
+                rows,
+                next_cursor=self.encode_cursor(rows[-1]) if rows else None,
+                previous_cursor=self.encode_cursor(rows[0]) if has_more else None,
+            )
+
+        queryset = self.queryset
+        if after_values:
+            queryset = queryset.filter(self._beyond(after_values, 'gt'))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1]) if has_more else None,
+            previous_cursor=self.encode_cursor(rows[0]) if after_values and rows else None,
+        )
@@ -0,0 +1,126 @@
+"""
+Resized poster variants for the listing pages.
+
+Every uploaded poster is resized to POSTER_WIDTHS in each format of
+POSTER_FORMATS that the installed Pillow can encode. File names carry a hash
+of the original's content, so they can be cached forever and a new upload
+never collides with what browsers already hold. The result is stored on
+``Movie.poster_variants``:
+
+    {"source": "posters/x.jpg", "digest": "3f2a...", "width": 600, "height": 900,
+     "formats": {"webp": {"160": "posters/variants/x-3f2a...-160w.webp", ...}, "jpeg": {...}}}
+"""
+import hashlib
+import io
+import logging
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from kombu.exceptions import OperationalError
+from PIL import Image, ImageOps, features
+
+from .schedule import invalidate_schedule
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'posters/variants'
+# Card widths on the listings are 150-300px; 480 and 640 cover 2x screens
+POSTER_WIDTHS = (160, 320, 480, 640)
+# Most compact first, the order of the <source> elements; JPEG is the <img> fallback.
+# (format, Pillow codec module or None when always built in, save options). AVIF needs Pillow 11.3+.
+POSTER_FORMATS = (
+    ('avif', 'avif', {'quality': 50}),
+    ('webp', 'webp', {'quality': 80, 'method': 6}),
+    ('jpeg', None, {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+DIGEST_LENGTH = 12
+
+
+def supported_formats():
+    return [(name, options) for name, module, options in POSTER_FORMATS
+            if module is None or (module in features.modules and features.check_module(module))]
+
+
+def variant_widths(width):
+    # No upscaling; a poster narrower than every size gets one variant at its own width
+    return [size for size in POSTER_WIDTHS if size <= width] or [width]
+
+
+def build_poster_variants(poster, stem):
+    """Write the variants of an image file to storage and return the poster_variants dict."""
+    poster.open('rb')
+    try:
+        content = poster.read()
+    finally:
+        poster.close()
+    digest = hashlib.sha256(content).hexdigest()[:DIGEST_LENGTH]
+
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(content))).convert('RGB')
+    variants = {'source': poster.name, 'digest': digest, 'width': image.width, 'height': image.height,
+                'formats': {}}
+    for width in variant_widths(image.width):
+        resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        for name, options in supported_formats():
+            path = f'{VARIANTS_DIR}/{stem}-{digest}-{width}w.{name}'
+            # The same content always gives the same files: a re-run only fills in what is missing
+            if not default_storage.exists(path):
+                buffer = io.BytesIO()
+                resized.save(buffer, format=name.upper(), **options)
+                default_storage.save(path, ContentFile(buffer.getvalue()))
+            variants['formats'].setdefault(name, {})[str(width)] = path
+    return variants
+
+
+def variant_paths(variants):
+    return {path for sizes in variants.get('formats', {}).values() for path in sizes.values()}
+
+
+def generate_poster_variants(movie, force=False):
+    """
+    Bring ``movie.poster_variants`` in line with its poster: build the variants
+    of a new poster, clear them when the poster was removed, and delete the
+    files of the previous poster. Returns True when anything changed; ``force``
+    rebuilds variants that look current (e.g. after POSTER_WIDTHS changed).
+    """
+    previous = movie.poster_variants or {}
+    if not movie.poster:
+        variants = {}
+    elif previous.get('source') == movie.poster.name and not force:
+        return False
+    else:
+        variants = build_poster_variants(movie.poster, movie.slug)
+
+    type(movie).objects.filter(pk=movie.pk).update(poster_variants=variants)
+    movie.poster_variants = variants
+    for path in variant_paths(previous) - variant_paths(variants):
+        default_storage.delete(path)
+    # Schedule fragments embed the poster markup; update() sends no post_save
+    invalidate_schedule()
+    return True
+
+
+def schedule_poster_variants(movie):
+    """Build the variants in Celery after the save commits; inline when the broker is unreachable."""
+    from .tasks import generate_movie_poster_variants
+
+    def enqueue():
+        try:
+            generate_movie_poster_variants.delay(movie.pk)
+        except OperationalError:
+            logger.warning('Could not enqueue poster variants of movie %s, building them inline', movie.pk,
+                           exc_info=True)
+            generate_poster_variants(movie)
+
+    transaction.on_commit(enqueue)
+
+
+def poster_srcset(variants, name):
+    sizes = sorted(variants.get('formats', {}).get(name, {}).items(), key=lambda size: int(size[0]))
+    return ', '.join(f'{default_storage.url(path)} {width}w' for width, path in sizes)
+
+
+def poster_sources(variants):
+    """``[(format, srcset)]`` of the stored variants, most compact first (jsonb does not keep key order)."""
+    formats = variants.get('formats', {})
+    return [(name, poster_srcset(variants, name)) for name, _, _ in POSTER_FORMATS if name in formats]
@@ -0,0 +1,66 @@
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+
+from .seats import HallLayout, get_hall_layout
+
+CENT = Decimal('0.01')
+
+# Price multiplier per seat category, in the order of HallLayout.CATEGORIES
+CATEGORY_MULTIPLIERS = {
+    HallLayout.STANDARD: Decimal('1'),
+    HallLayout.COMFORT: Decimal('1.2'),
+    HallLayout.VIP: Decimal('1.5'),
+}
+
+# (occupancy ratio, multiplier), highest threshold first: the first tier the occupancy reaches applies
+SURGE_TIERS = (
+    (Decimal('0.9'), Decimal('1.25')),
+    (Decimal('0.7'), Decimal('1.1')),
+)
+
+
+def surge_multiplier(seat_map):
+    """Demand multiplier from the share of taken seats of a session."""
+    if not seat_map.capacity:
+        return Decimal('1')
+    occupancy = Decimal(seat_map.capacity - seat_map.free_count) / seat_map.capacity
+    for threshold, multiplier in SURGE_TIERS:
+        if occupancy >= threshold:
+            return multiplier
+    return Decimal('1')
+
+
+@lru_cache(maxsize=1024)
+def category_prices(base_price, surge=Decimal('1')):
+    """Price of a seat of each category, aligned with HallLayout.CATEGORIES and rounded to kopiyky."""
+    return tuple((base_price * CATEGORY_MULTIPLIERS[category] * surge).quantize(CENT, rounding=ROUND_HALF_UP)
+                 for category in HallLayout.CATEGORIES)
+
+
+@lru_cache(maxsize=256)
+def price_vector(layout, base_price, surge=Decimal('1')):
+    """
+    Prices of every seat of a hall, indexed by seat number like SeatMap.
+
+    Built in one pass over the layout's category vector and cached per
+    (layout, base price, surge); layouts are themselves cached per hall
+    configuration, so sessions in the same hall share their vectors.
+    """
+    prices = category_prices(base_price, surge)
+    return (None,) + tuple(prices[code] for code in layout.category_codes())
+
+
+def session_surge(session, seat_map=None):
+    return surge_multiplier(seat_map if seat_map is not None else session.get_seat_map())
+
+
+def seat_prices(session, seats, seat_map=None):
+    """``{seat: price}`` for seats of a session at its current demand."""
+    vector = price_vector(get_hall_layout(session.hall), session.base_ticket_price, session_surge(session, seat_map))
+    return {seat: vector[seat] for seat in seats}
+
+
+def session_category_prices(session, seat_map=None):
+    """``{category: price}`` of a session at its current demand, for the seat map."""
+    prices = category_prices(session.base_ticket_price, session_surge(session, seat_map))
+    return dict(zip(HallLayout.CATEGORIES, prices))
@@ -0,0 +1,63 @@
+import uuid
+
+from django.core.cache import cache
+
+# Rendered schedule fragments are keyed by versions that change whenever what they show changes:
+#   schedule-version:global       movies, genres and halls (titles, posters, hall names)
+#   schedule-version:<date>       sessions on that date
+#   schedule-version:all          any session, for the listing without a date filter
+# Seat counters change with every ticket sold and have versions of their own, so that sales leave the schedule
+# fragments and ETags alone:
+#   schedule-version:availability:global, :<date> and :all
+GLOBAL = 'global'
+ALL_DATES = 'all'
+AVAILABILITY = 'availability'
+
+
+def schedule_version_key(part):
+    return f'schedule-version:{part}'
+
+
+def get_schedule_version(selected_date=None):
+    """Version string of the schedule fragment for a date (or for all upcoming dates)."""
+    return _get_versions([GLOBAL, selected_date.isoformat() if selected_date else ALL_DATES])
+
+
+def get_availability_version(selected_date=None):
+    """Version string of the seat counters of the sessions on a date (or on all upcoming dates)."""
+    return _get_versions([f'{AVAILABILITY}:{GLOBAL}',
+                          f'{AVAILABILITY}:{selected_date.isoformat() if selected_date else ALL_DATES}'])
+
+
+def get_catalog_version():
+    """Version of movies, genres and halls alone, whatever the sessions."""
+    return _get_versions([GLOBAL])
+
+
+def _get_versions(parts):
+    keys = [schedule_version_key(part) for part in parts]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Never set or evicted: start a fresh version rather than reuse an old one
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return '-'.join(versions[key] for key in keys)
+
+
+def invalidate_schedule(*session_dates):
+    """Drop cached fragments for the given session dates, or for every date when none are given."""
+    if session_dates:
+        parts = [session_date.isoformat() for session_date in session_dates if session_date] + [ALL_DATES]
+    else:
+        parts = [GLOBAL]
+    cache.set_many({schedule_version_key(part): uuid.uuid4().hex for part in parts}, None)
+
+
+def invalidate_availability(*session_dates):
+    """Seat counters of the given session dates changed, or of every date when none are given."""
+    if session_dates:
+        parts = [session_date.isoformat() for session_date in session_dates if session_date] + [ALL_DATES]
+    else:
+        parts = [GLOBAL]
+    cache.set_many({schedule_version_key(f'{AVAILABILITY}:{part}'): uuid.uuid4().hex for part in parts}, None)
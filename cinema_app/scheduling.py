@@ -0,0 +1,91 @@
+"""
+Hall scheduling conflicts.
+
+A session occupies its hall from its start for the movie's duration plus
+CLEANING_BREAK, and that interval may run past midnight into the next day
+(``Session.end_time`` alone wraps around and cannot tell). Conflicts are found
+with a sweep over the intervals of each hall sorted by start: O(n log n) for a
+whole batch, with one query for the sessions already scheduled around it.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from django.core.exceptions import ValidationError
+
+# Time between two screenings in a hall to let the audience out and clean up
+CLEANING_BREAK = timedelta(minutes=15)
+# How far back a session can start and still occupy the hall on a given day; sessions start at 10:00 or later,
+# so one day covers any movie shorter than 14 hours
+LOOKBACK = timedelta(days=1)
+
+
+class Interval(NamedTuple):
+    start: datetime
+    end: datetime
+    session: object
+
+
+def session_interval(session):
+    start = datetime.combine(session.session_date, session.start_time)
+    return Interval(start, start + timedelta(minutes=session.movie.duration) + CLEANING_BREAK, session)
+
+
+def scheduled_sessions(sessions):
+    """Saved sessions in the halls and around the dates of ``sessions``, except the ones being changed."""
+    session_model = type(sessions[0])
+    dates = [session.session_date for session in sessions]
+    return (session_model.objects
+            .filter(hall_id__in={session.hall_id for session in sessions},
+                    session_date__range=(min(dates) - LOOKBACK, max(dates) + LOOKBACK))
+            .exclude(pk__in=[session.pk for session in sessions if session.pk])
+            .select_related('hall', 'movie')
+            .only('hall__name', 'movie__duration', 'movie__title', 'session_date', 'start_time'))
+
+
+def find_conflicts(sessions, scheduled=None):
+    """
+    ``[(session, other)]`` for every session of ``sessions`` whose interval
+    overlaps another one in the same hall, either another of ``sessions`` or
+    one of ``scheduled`` (the saved ones by default). Every conflicting
+    session appears at least once, paired with an overlapping one.
+    """
+    sessions = list(sessions)
+    if not sessions:
+        return []
+    if scheduled is None:
+        scheduled = scheduled_sessions(sessions)
+
+    candidates = {id(session) for session in sessions}
+    by_hall = defaultdict(list)
+    for session in [*sessions, *scheduled]:
+        by_hall[session.hall_id].append(session_interval(session))
+
+    conflicts = []
+    for intervals in by_hall.values():
+        intervals.sort(key=lambda interval: (interval.start, interval.end))
+        furthest = None
+        for interval in intervals:
+            if furthest is not None and interval.start < furthest.end:
+                # Saved sessions that already overlap each other are not the new batch's problem
+                if id(interval.session) in candidates or id(furthest.session) in candidates:
+                    first, second = ((interval, furthest) if id(interval.session) in candidates
+                                     else (furthest, interval))
+                    conflicts.append((first.session, second.session))
+            if furthest is None or interval.end > furthest.end:
+                furthest = interval
+    return conflicts
+
+
+def describe_conflict(session, other):
+    interval = session_interval(other)
+    return (f'{other.hall} is taken from {interval.start:%d.%m %H:%M} to {interval.end:%d.%m %H:%M} '
+            f'by {other.movie.title}; {session.movie.title} at {session.session_date:%d.%m} '
+            f'{session.start_time:%H:%M} overlaps it.')
+
+
+def validate_schedule(sessions, scheduled=None):
+    """Raise a ValidationError listing every conflict of ``sessions``, or do nothing."""
+    conflicts = find_conflicts(sessions, scheduled)
+    if conflicts:
+        raise ValidationError([describe_conflict(session, other) for session, other in conflicts])
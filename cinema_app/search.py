@@ -0,0 +1,165 @@
+import re
+import threading
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, When
+from django.db.models.functions import Greatest
+
+# Postgres has no Ukrainian text search configuration, so titles and descriptions
+# go through 'simple' (no stemming) and the English original name through 'english' too.
+SEARCH_CONFIGS = ('simple', 'english')
+SEARCH_INDEX_VERSION_KEY = 'movie-search-version'
+# The in-memory fallback returns at most this many of the best matches
+FALLBACK_RESULTS_LIMIT = 500
+
+TOKEN_RE = re.compile(r'\w+')
+# Words of a raw tsquery: to_tsquery parses anything else (operators, quotes, '_') as syntax or separators
+TSQUERY_WORD_RE = re.compile(r'[^\W_]+')
+
+
+def movie_search_vector():
+    return (
+        SearchVector('title', weight='A', config='simple')
+        + SearchVector('original_name', weight='A', config='simple')
+        + SearchVector('original_name', weight='B', config='english')
+        + SearchVector('description', weight='C', config='simple')
+    )
+
+
+def uses_postgres_search():
+    return connection.vendor == 'postgresql'
+
+
+def update_search_vector(movie):
+    """Keep the stored search vector of a movie current; called from Movie.save."""
+    if uses_postgres_search():
+        type(movie).objects.filter(pk=movie.pk).update(search_vector=movie_search_vector())
+    cache.set(SEARCH_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def search_movies(queryset, query):
+    """
+    Filter a movie queryset by a free-text query and order it by relevance.
+
+    On Postgres this is a full-text match on the GIN-indexed ``search_vector``
+    plus trigram similarity on the titles for typos. Other backends use an
+    in-memory inverted index over the movie table.
+    """
+    if uses_postgres_search():
+        return _postgres_search(queryset, query)
+    return _inverted_index_search(queryset, query)
+
+
+def prefix_tsquery(query):
+    """Raw tsquery matching every word of ``query`` as a prefix, e.g. ``'lord:* & ring:*'``; empty without words."""
+    return ' & '.join(f'{word}:*' for word in TSQUERY_WORD_RE.findall(query.lower()))
+
+
+def _postgres_search(queryset, query):
+    # websearch keeps quoted phrases and -exclusions; the raw prefix query finds 'інтер' as you type
+    prefix_query = prefix_tsquery(query)
+    search_query = None
+    for config in SEARCH_CONFIGS:
+        config_query = SearchQuery(query, config=config, search_type='websearch')
+        if prefix_query:
+            config_query |= SearchQuery(prefix_query, config=config, search_type='raw')
+        search_query = config_query if search_query is None else search_query | config_query
+
+    return (queryset
+            .annotate(rank=SearchRank(F('search_vector'), search_query),
+                      similarity=Greatest(TrigramSimilarity('title', query),
+                                          TrigramSimilarity('original_name', query)))
+            .filter(Q(search_vector=search_query)
+                    | Q(title__trigram_similar=query)
+                    | Q(original_name__trigram_similar=query))
+            .order_by('-rank', '-similarity', 'id'))
+
+
+def _inverted_index_search(queryset, query):
+    ranked_ids = get_search_index().search(query)[:FALLBACK_RESULTS_LIMIT]
+    if not ranked_ids:
+        return queryset.none()
+    ordering = Case(*[When(id=movie_id, then=position) for position, movie_id in enumerate(ranked_ids)],
+                    output_field=IntegerField())
+    return queryset.filter(id__in=ranked_ids).order_by(ordering)
+
+
+class MovieSearchIndex:
+    """
+    Inverted index of movie titles and descriptions: token -> {movie id: weight}.
+
+    Every query token must match (as a whole token or as a prefix of one);
+    movies are ranked by the summed weights of the matching fields.
+    """
+    FIELD_WEIGHTS = {'title': 4, 'original_name': 4, 'description': 1}
+
+    def __init__(self, rows):
+        postings = defaultdict(lambda: defaultdict(int))
+        for row in rows:
+            for field, weight in self.FIELD_WEIGHTS.items():
+                for token in tokenize(row[field]):
+                    postings[token][row['id']] += weight
+        self.postings = {token: dict(movies) for token, movies in postings.items()}
+        self.tokens = sorted(self.postings)
+
+    @classmethod
+    def build(cls):
+        from .models import Movie
+
+        return cls(Movie.objects.values('id', *cls.FIELD_WEIGHTS).iterator(chunk_size=5000))
+
+    def _matches(self, query_token):
+        scores = defaultdict(int)
+        position = bisect_left(self.tokens, query_token)
+        while position < len(self.tokens) and self.tokens[position].startswith(query_token):
+            for movie_id, weight in self.postings[self.tokens[position]].items():
+                scores[movie_id] = max(scores[movie_id], weight)
+            position += 1
+        return scores
+
+    def search(self, query):
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return []
+
+        scores = None
+        for query_token in query_tokens:
+            matches = self._matches(query_token)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {movie_id: score + matches[movie_id]
+                          for movie_id, score in scores.items() if movie_id in matches}
+            if not scores:
+                return []
+        return sorted(scores, key=lambda movie_id: (-scores[movie_id], movie_id))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+_index_lock = threading.Lock()
+_index = None
+_index_version = None
+
+
+def get_search_index():
+    """Process-wide MovieSearchIndex, rebuilt when any movie was saved since it was built."""
+    global _index, _index_version
+
+    version = cache.get(SEARCH_INDEX_VERSION_KEY)
+    if version is None:
+        # Lost from the cache (eviction, flush): start a new version so stale indexes are rebuilt
+        cache.add(SEARCH_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(SEARCH_INDEX_VERSION_KEY)
+    with _index_lock:
+        if _index is None or _index_version != version:
+            _index = MovieSearchIndex.build()
+            _index_version = version
+        return _index
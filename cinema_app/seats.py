@@ -0,0 +1,553 @@
+import asyncio
+import base64
+import json
+import time
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .instrumentation import current_stats
+
+
+class SeatMap:
+    """
+    Occupancy of a single session packed into a bytearray, one byte per seat.
+
+    Seats are numbered from 1 to ``capacity``; index 0 of the buffer is unused
+    so a seat number can be used as an index directly.
+    """
+    FREE = 0
+    TAKEN = 1
+
+    __slots__ = ('capacity', '_seats')
+
+    def __init__(self, capacity, taken=()):
+        self.capacity = capacity
+        self._seats = bytearray(capacity + 1)
+        for seat in taken:
+            if 1 <= seat <= capacity:
+                self._seats[seat] = self.TAKEN
+
+    @classmethod
+    def for_session(cls, session):
+        # One query for the occupied seats; capacity comes from the already joined hall
+        from .models import Ticket
+
+        taken = (Ticket.objects.filter(session=session)
+                 .exclude(status=Ticket.CANCELLED)
+                 .values_list('seat_number', flat=True))
+        return cls(session.hall.capacity, taken)
+
+    @classmethod
+    async def afor_session(cls, session):
+        from .models import Ticket
+
+        taken = (Ticket.objects.filter(session=session)
+                 .exclude(status=Ticket.CANCELLED)
+                 .values_list('seat_number', flat=True))
+        return cls(session.hall.capacity, [seat async for seat in taken])
+
+    def __len__(self):
+        return self.capacity
+
+    def __eq__(self, other):
+        return isinstance(other, SeatMap) and self._seats == other._seats
+
+    def is_valid(self, seat):
+        return 1 <= seat <= self.capacity
+
+    def is_free(self, seat):
+        return self.is_valid(seat) and self._seats[seat] == self.FREE
+
+    def is_taken(self, seat):
+        return self.is_valid(seat) and self._seats[seat] == self.TAKEN
+
+    def take(self, seats):
+        for seat in seats:
+            if self.is_valid(seat):
+                self._seats[seat] = self.TAKEN
+
+    def release(self, seats):
+        for seat in seats:
+            if self.is_valid(seat):
+                self._seats[seat] = self.FREE
+
+    def conflicts(self, seats):
+        """Return the requested seats that are taken or outside the hall."""
+        return [seat for seat in seats if not self.is_free(seat)]
+
+    def available(self):
+        return [seat for seat, state in enumerate(self._seats) if state == self.FREE and seat]
+
+    def taken(self):
+        return [seat for seat, state in enumerate(self._seats) if state == self.TAKEN]
+
+    @property
+    def free_count(self):
+        return self.capacity - self._seats.count(self.TAKEN)
+
+    def diff(self, other):
+        """Seats that became taken and seats that became free in ``other`` compared to this map."""
+        taken, freed = [], []
+        for seat, (before, after) in enumerate(zip(self._seats, other._seats)):
+            if before != after:
+                (taken if after == self.TAKEN else freed).append(seat)
+        return taken, freed
+
+    def union(self, other):
+        result = self.copy()
+        result.take(other.taken())
+        return result
+
+    def copy(self):
+        clone = SeatMap(self.capacity)
+        clone._seats[:] = self._seats
+        return clone
+
+    def to_bytes(self):
+        return bytes(self._seats)
+
+    def to_bitmask(self):
+        """Taken seats packed one bit per seat: seat ``n`` is bit ``(n - 1) % 8`` of byte ``(n - 1) // 8``."""
+        mask = bytearray((self.capacity + 7) // 8)
+        for seat in self.taken():
+            mask[(seat - 1) // 8] |= 1 << ((seat - 1) % 8)
+        return bytes(mask)
+
+    @classmethod
+    def from_bytes(cls, data):
+        seat_map = cls(len(data) - 1)
+        seat_map._seats[:] = data
+        return seat_map
+
+
+class HallLayout:
+    """
+    Rows and seat categories of a hall, computed once per hall configuration.
+
+    Seats are numbered row by row, ``seats_per_row`` to a row; the last row is
+    shorter when the capacity is not a multiple of it. Categories not given
+    explicitly follow the centre rule of ``calculate_dynamic_price``: the two
+    middle rows are comfort and their middle seats are VIP.
+    """
+    STANDARD = 'standard'
+    COMFORT = 'comfort'
+    VIP = 'vip'
+    CATEGORIES = (STANDARD, COMFORT, VIP)
+
+    __slots__ = ('capacity', 'seats_per_row', '_categories')
+
+    def __init__(self, capacity, seats_per_row, seat_categories=None):
+        self.capacity = capacity
+        self.seats_per_row = seats_per_row
+        # One category index per seat, index 0 unused as in SeatMap
+        self._categories = bytearray(capacity + 1)
+        if seat_categories:
+            for category, seats in seat_categories.items():
+                code = self.CATEGORIES.index(category)
+                for seat in seats:
+                    if 1 <= seat <= capacity:
+                        self._categories[seat] = code
+        else:
+            self._apply_centre_categories()
+
+    def _apply_centre_categories(self):
+        rows = self.rows
+        centre_rows = range(max(rows // 2 - 1, 1), rows // 2 + 1)
+        centre_seats = range(self.seats_per_row // 2 - 3, self.seats_per_row // 2 + 4)
+        comfort, vip = self.CATEGORIES.index(self.COMFORT), self.CATEGORIES.index(self.VIP)
+        for row in centre_rows:
+            first = (row - 1) * self.seats_per_row + 1
+            for seat in range(first, min(first + self.seats_per_row, self.capacity + 1)):
+                self._categories[seat] = vip if seat - first + 1 in centre_seats else comfort
+
+    @property
+    def rows(self):
+        return -(-self.capacity // self.seats_per_row)
+
+    def row_lengths(self):
+        return [min(self.seats_per_row, self.capacity - start) for start in range(0, self.capacity, self.seats_per_row)]
+
+    def row_of(self, seat):
+        return (seat - 1) // self.seats_per_row + 1
+
+    def category(self, seat):
+        return self.CATEGORIES[self._categories[seat]]
+
+    def category_codes(self):
+        """Index into CATEGORIES of every seat, in seat order."""
+        return bytes(self._categories[1:])
+
+    def grid(self, seat_map):
+        """Rows of ``(seat, category, is_free)``, merged with the occupancy in one pass over the hall."""
+        grid, seat = [], 1
+        for length in self.row_lengths():
+            grid.append([(number, self.category(number), seat_map.is_free(number))
+                         for number in range(seat, seat + length)])
+            seat += length
+        return grid
+
+    def to_payload(self):
+        """Compact description for the client: row lengths plus one category digit per seat."""
+        return {
+            'rows': self.row_lengths(),
+            'categories': list(self.CATEGORIES),
+            'seat_categories': ''.join(map(str, self.category_codes())),
+        }
+
+
+@lru_cache(maxsize=256)
+def cached_hall_layout(capacity, seats_per_row, seat_categories='{}'):
+    """Shared HallLayout for a configuration; ``seat_categories`` is JSON so that it can be a cache key."""
+    return HallLayout(capacity, seats_per_row, json.loads(seat_categories))
+
+
+def get_hall_layout(hall):
+    """Layout of a hall, cached per process and rebuilt only when the hall configuration changes."""
+    return cached_hall_layout(hall.capacity, hall.seats_per_row, json.dumps(hall.seat_categories or {}, sort_keys=True))
+
+
+def seat_grid_payload(hall, seat_map):
+    """Layout and occupancy of a session for client-side rendering of the seat grid."""
+    return {
+        **get_hall_layout(hall).to_payload(),
+        'taken': base64.b64encode(seat_map.to_bitmask()).decode(),
+    }
+
+
+def seat_map_cache_key(session_slug):
+    return f'seat-map:{session_slug}'
+
+
+def get_cached_seat_map(session_slug):
+    """
+    Seat map of a session served from the cache. Falls back to the database
+    (and fills the cache) on a miss; returns None for an unknown session.
+    """
+    data = cache.get(seat_map_cache_key(session_slug))
+    if data is not None:
+        return SeatMap.from_bytes(data)
+
+    from .models import Session
+
+    session = Session.objects.select_related('hall').filter(slug=session_slug).first()
+    if session is None:
+        return None
+    return refresh_seat_map(session)
+
+
+async def aget_cached_seat_map(session_slug):
+    data = await cache.aget(seat_map_cache_key(session_slug))
+    if data is not None:
+        return SeatMap.from_bytes(data)
+
+    from .models import Session
+
+    session = await Session.objects.select_related('hall').filter(slug=session_slug).afirst()
+    if session is None:
+        return None
+    return await arefresh_seat_map(session)
+
+
+def refresh_seat_map(session):
+    """Rebuild the seat map of a session from the database and write it to the cache."""
+    seat_map = SeatMap.for_session(session)
+    cache.set(seat_map_cache_key(session.slug), seat_map.to_bytes(), settings.SEAT_MAP_CACHE_TIMEOUT)
+    return seat_map
+
+
+async def arefresh_seat_map(session):
+    seat_map = await SeatMap.afor_session(session)
+    await cache.aset(seat_map_cache_key(session.slug), seat_map.to_bytes(), settings.SEAT_MAP_CACHE_TIMEOUT)
+    return seat_map
+
+
+def refresh_seat_maps(session_ids):
+    """Same as refresh_seat_map for many sessions at once: two queries and one cache write."""
+    from .models import Session, Ticket
+
+    sessions = Session.objects.filter(id__in=session_ids).select_related('hall').only('slug', 'hall__capacity')
+    seat_maps = {session.id: SeatMap(session.hall.capacity) for session in sessions}
+    taken = (Ticket.objects.filter(session_id__in=seat_maps)
+             .exclude(status=Ticket.CANCELLED)
+             .values_list('session_id', 'seat_number'))
+    for session_id, seat_number in taken:
+        seat_maps[session_id].take((seat_number,))
+
+    cache.set_many(
+        {seat_map_cache_key(session.slug): seat_maps[session.id].to_bytes() for session in sessions},
+        settings.SEAT_MAP_CACHE_TIMEOUT,
+    )
+    return len(seat_maps)
+
+
+def refresh_seat_map_on_commit(session):
+    transaction.on_commit(lambda: refresh_seat_map(session))
+
+
+def seat_hold_key(session_slug, seat):
+    return f'seat-hold:{session_slug}:{seat}'
+
+
+def seat_holds_index_key(session_slug):
+    # Live holds of a session for reading them; each seat is claimed on its seat_hold_key
+    return f'seat-holds:{session_slug}'
+
+
+def seat_holds_version_key(session_slug):
+    return f'seat-holds-version:{session_slug}'
+
+
+def seat_hold_metric_key(name):
+    return f'seat-holds-metric:{name}'
+
+
+def _increment(key, delta=1):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # The key was evicted between add() and incr()
+        cache.add(key, delta, None)
+
+
+def _holds_on_free_seats(members, seat_map):
+    """``{seat: user_id}`` of the ``'seat:user_id'`` members of a hold index, on the free seats of ``seat_map``."""
+    holds = {}
+    for member in members:
+        seat, user_id = map(int, member.split(':'))
+        if seat_map.is_free(seat):
+            holds[seat] = user_id
+    return holds
+
+
+def get_seat_holds(session_slug, seat_map):
+    """
+    Holds on the free seats of a session as a ``{seat: user_id}`` dict. They
+    are read from the session's hold index, one lookup of the live holds only
+    whatever the size of the hall.
+    """
+    return _holds_on_free_seats(cache.get_live_members(seat_holds_index_key(session_slug)), seat_map)
+
+
+async def aget_seat_holds(session_slug, seat_map):
+    return _holds_on_free_seats(await cache.aget_live_members(seat_holds_index_key(session_slug)), seat_map)
+
+
+def apply_seat_holds(seat_map, holds, user_id=None):
+    """Copy of the seat map with the seats held by other users marked as taken."""
+    result = seat_map.copy()
+    result.take(seat for seat, holder in holds.items() if holder != user_id)
+    return result
+
+
+def acquire_seat_holds(session_slug, user_id, seats, seat_map):
+    """
+    Hold free seats for a user for SEAT_HOLD_TTL seconds without touching the
+    database. Each seat is claimed with an atomic cache ``add`` (SET NX on
+    Redis); holds the user already owns are extended. The holds are then
+    listed in the session's hold index for get_seat_holds. All or nothing: returns
+    the unavailable seats and keeps no new holds if there are any.
+    """
+    conflicts = seat_map.conflicts(seats)
+    if conflicts:
+        return conflicts
+
+    ttl = settings.SEAT_HOLD_TTL
+    expires_at = time.time() + ttl
+    acquired = []
+    for seat in seats:
+        key = seat_hold_key(session_slug, seat)
+        if cache.add(key, user_id, ttl):
+            acquired.append(seat)
+        elif cache.get(key) == user_id:
+            cache.touch(key, ttl)
+        else:
+            conflicts.append(seat)
+
+    if conflicts:
+        release_seat_holds(session_slug, user_id, acquired)
+        return conflicts
+    cache.add_expiring_members(seat_holds_index_key(session_slug), [f'{seat}:{user_id}' for seat in seats],
+                               expires_at)
+    if acquired:
+        _increment(seat_hold_metric_key('created'), len(acquired))
+        _increment(seat_holds_version_key(session_slug))
+    return conflicts
+
+
+def release_seat_holds(session_slug, user_id, seats):
+    """Drop the user's holds on the given seats and return how many were released."""
+    keys = {seat_hold_key(session_slug, seat): seat for seat in seats}
+    # Read-then-delete is not atomic: a hold that expires and is re-taken by
+    # someone else in between is dropped too. With holds living for minutes
+    # this window is negligible and the database constraint still applies.
+    owned = [key for key, holder in cache.get_many(keys).items() if holder == user_id]
+    if owned:
+        cache.delete_many(owned)
+        cache.remove_members(seat_holds_index_key(session_slug), [f'{keys[key]}:{user_id}' for key in owned])
+        _increment(seat_holds_version_key(session_slug))
+    return len(owned)
+
+
+def convert_seat_holds(session_slug, user_id, seats):
+    """Release holds that became reserved tickets and count them as converted."""
+    converted = release_seat_holds(session_slug, user_id, seats)
+    if converted:
+        _increment(seat_hold_metric_key('converted'), converted)
+    return converted
+
+
+def seat_hold_metrics():
+    values = cache.get_many([seat_hold_metric_key('created'), seat_hold_metric_key('converted')])
+    created = values.get(seat_hold_metric_key('created'), 0)
+    converted = values.get(seat_hold_metric_key('converted'), 0)
+    return {
+        'created': created,
+        'converted': converted,
+        'conversion_rate': round(converted / created, 4) if created else None,
+    }
+
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+class SeatWatcher:
+    """
+    Polls the cached seat map and seat holds of one session for all its
+    seat_events streams in this process and its event loop, so the cache is
+    read once per SEAT_EVENTS_POLL_INTERVAL however many browsers watch the
+    session. Streams wait on ``changed`` for ``generation`` to move on; the
+    watcher stops with its last stream.
+    """
+
+    def __init__(self, session_slug, seat_map):
+        self.session_slug = session_slug
+        self.seat_map = seat_map
+        self.holds = {}
+        self.generation = 0
+        # The session left the cache and the database: streams end
+        self.closed = False
+        self.streams = 0
+        self.ready = asyncio.Event()
+        self.changed = asyncio.Condition()
+        self.task = None
+
+    async def publish(self, seat_map, holds):
+        async with self.changed:
+            self.seat_map, self.holds = seat_map, holds
+            self.generation += 1
+            self.changed.notify_all()
+
+    async def close(self):
+        async with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    async def poll(self):
+        # Reads made for the streams of many requests are counted in none of them
+        current_stats.set(None)
+        key = seat_map_cache_key(self.session_slug)
+        version_key = seat_holds_version_key(self.session_slug)
+        try:
+            self.holds = await aget_seat_holds(self.session_slug, self.seat_map)
+            holds_version = await cache.aget(version_key)
+            holds_read = time.monotonic()
+            self.ready.set()
+
+            while True:
+                await asyncio.sleep(settings.SEAT_EVENTS_POLL_INTERVAL)
+
+                values = await cache.aget_many([key, version_key])
+                if key not in values:
+                    current = await sync_to_async(get_cached_seat_map)(self.session_slug)
+                    if current is None:
+                        return
+                else:
+                    current = SeatMap.from_bytes(values[key])
+
+                holds = self.holds
+                # Holds expire silently, so they are also re-read every SEAT_HOLD_RESYNC seconds
+                if (current != self.seat_map or values.get(version_key) != holds_version
+                        or time.monotonic() - holds_read >= settings.SEAT_HOLD_RESYNC):
+                    holds = await aget_seat_holds(self.session_slug, current)
+                    holds_version = values.get(version_key)
+                    holds_read = time.monotonic()
+                if current != self.seat_map or holds != self.holds:
+                    await self.publish(current, holds)
+        finally:
+            # Also when the cache fails: the streams end and the browsers reconnect
+            self.ready.set()
+            await self.close()
+
+
+_seat_watchers = {}
+
+
+def _watch_seats(session_slug, seat_map):
+    # One watcher per event loop: the tasks and conditions of a watcher belong to the loop that created them
+    key = (asyncio.get_running_loop(), session_slug)
+    watcher = _seat_watchers.get(key)
+    if watcher is None or watcher.closed:
+        watcher = _seat_watchers[key] = SeatWatcher(session_slug, seat_map)
+        watcher.task = asyncio.create_task(watcher.poll())
+    watcher.streams += 1
+    return watcher
+
+
+def _unwatch_seats(watcher):
+    watcher.streams -= 1
+    if not watcher.streams:
+        watcher.task.cancel()
+        key = (asyncio.get_running_loop(), watcher.session_slug)
+        if _seat_watchers.get(key) is watcher:
+            del _seat_watchers[key]
+
+
+async def stream_seat_events(session_slug, seat_map, user_id=None):
+    """
+    Server-Sent Events stream of seat changes for a session.
+
+    Sends a ``snapshot`` event with the free seats first and then a ``seats``
+    event with ``taken``/``freed`` deltas whenever the cached seat map or the
+    seat holds of other users change, as seen by the session's SeatWatcher;
+    ``seat_map`` starts the watcher when the stream is the first one. The
+    stream closes after SEAT_EVENTS_MAX_AGE seconds and the browser's
+    EventSource reconnects.
+    """
+    watcher = _watch_seats(session_slug, seat_map)
+    try:
+        started = last_sent = time.monotonic()
+        await watcher.ready.wait()
+        generation = watcher.generation
+        shown = apply_seat_holds(watcher.seat_map, watcher.holds, user_id)
+
+        yield f'retry: {settings.SEAT_EVENTS_RETRY_MS}\n'
+        yield _sse('snapshot', {'available_seats': shown.available()})
+
+        while not watcher.closed and time.monotonic() - started < settings.SEAT_EVENTS_MAX_AGE:
+            timeout = min(settings.SEAT_EVENTS_KEEPALIVE - (time.monotonic() - last_sent),
+                          settings.SEAT_EVENTS_MAX_AGE - (time.monotonic() - started))
+            async with watcher.changed:
+                try:
+                    await asyncio.wait_for(watcher.changed.wait_for(
+                        lambda: watcher.generation != generation or watcher.closed), max(timeout, 0))
+                except TimeoutError:
+                    pass
+                generation = watcher.generation
+                current_shown = apply_seat_holds(watcher.seat_map, watcher.holds, user_id)
+
+            taken, freed = shown.diff(current_shown)
+            if taken or freed:
+                shown = current_shown
+                last_sent = time.monotonic()
+                yield _sse('seats', {'taken': taken, 'freed': freed})
+            elif time.monotonic() - last_sent >= settings.SEAT_EVENTS_KEEPALIVE:
+                last_sent = time.monotonic()
+                yield ': keepalive\n\n'
+    finally:
+        _unwatch_seats(watcher)
@@ -0,0 +1,91 @@
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
+from rest_framework import serializers
+
+from .models import Genre, Hall, Movie, Session
+from .posters import poster_sources
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer that keeps only the fields named in its ``fields`` argument
+    (the API's ``?fields=slug,title``); all of them when it is empty.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise serializers.ValidationError({'fields': f'Unknown fields: {", ".join(sorted(unknown))}'})
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class GenreSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Genre
+        fields = ('id', 'name')
+
+
+class HallSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Hall
+        fields = ('id', 'name', 'capacity', 'seats_per_row')
+
+
+class MovieSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    genres = serializers.SlugRelatedField(source='genre', slug_field='name', many=True, read_only=True)
+    poster = serializers.SerializerMethodField()
+    poster_srcset = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Movie
+        fields = ('slug', 'title', 'original_name', 'description', 'duration', 'release_date', 'age_limit', 'genres',
+                  'poster', 'poster_srcset')
+
+    @extend_schema_field(OpenApiTypes.URI)
+    def get_poster(self, movie):
+        return movie.poster.url if movie.poster else None
+
+    @extend_schema_field({'type': 'object', 'additionalProperties': {'type': 'string'}})
+    def get_poster_srcset(self, movie):
+        """``srcset`` of the resized poster variants by image format, e.g. ``{"webp": "... 160w, ..."}``."""
+        return dict(poster_sources(movie.poster_variants or {}))
+
+
+class SessionMovieSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Movie
+        fields = ('slug', 'title', 'duration', 'age_limit')
+
+
+class SessionHallSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Hall
+        fields = ('id', 'name')
+
+
+class SessionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    movie = SessionMovieSerializer(read_only=True)
+    hall = SessionHallSerializer(read_only=True)
+    # From SessionStats; null until the counters of a bulk inserted session are rebuilt
+    capacity = serializers.IntegerField(source='stats.capacity', read_only=True, allow_null=True)
+    available = serializers.IntegerField(source='stats.available', read_only=True, allow_null=True)
+
+    class Meta:
+        model = Session
+        fields = ('slug', 'movie', 'hall', 'session_date', 'start_time', 'end_time', 'base_ticket_price', 'capacity',
+                  'available')
+
+
+class SeatMapSerializer(serializers.Serializer):
+    """Seat grid of a session, in the format the purchase page draws it from (see HallLayout.to_payload)."""
+    rows = serializers.ListField(child=serializers.IntegerField(), help_text='Number of seats in each row')
+    categories = serializers.ListField(child=serializers.CharField())
+    seat_categories = serializers.CharField(help_text='One digit per seat: its index in categories')
+    taken = serializers.CharField(help_text='Base64 bitmask of the seats sold, reserved or held: seat n is bit '
+                                  '(n - 1) % 8 of byte (n - 1) // 8')
+    available = serializers.IntegerField()
+    prices = serializers.DictField(child=serializers.DecimalField(max_digits=10, decimal_places=2),
+                                   help_text='Seat price by category at the current demand')
@@ -1,102 +1,335 @@
 import json
+import logging
+from functools import lru_cache
 
 import stripe
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db import transaction
+from django.db import IntegrityError, transaction
 
+from .instrumentation import stripe_call
 from .models import *
+from .pricing import seat_prices
+from .session_stats import record_reservation
+from .tasks import cancel_order, enqueue_stripe_events, finalise_orders, schedule_order_expiry
+from .seats import (acquire_seat_holds, convert_seat_holds, get_cached_seat_map, refresh_seat_map_on_commit,
+                    refresh_seat_maps, release_seat_holds)
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 stripe.api_version = settings.STRIPE_API_VERSION
+# httpx lets the async views await Stripe (the *_async methods) instead of blocking the event loop
+stripe.default_http_client = stripe.HTTPXClient(allow_sync_methods=True)
 
+logger = logging.getLogger(__name__)
 
-def process_payment(request, order):
+
+# Reversed once per URL name with a placeholder id that is substituted for every checkout
+ORDER_ID_PLACEHOLDER = 987654321
+
+
+@lru_cache(maxsize=None)
+def order_url_template(name):
+    return reverse(name, kwargs={'order_id': ORDER_ID_PLACEHOLDER}).replace(str(ORDER_ID_PLACEHOLDER), '{order_id}')
+
+
+def order_url(request, name, order_id):
+    return request.build_absolute_uri(order_url_template(name).format(order_id=order_id))
+
+
+def order_tickets(order):
+    """Tickets of an order with their session and movie, for line items in a single query."""
+    return (Ticket.objects.filter(order_id=order.id)
+            .select_related('session__movie')
+            .only('seat_number', 'price', 'session__session_date', 'session__start_time', 'session__movie__title')
+            .order_by('price', 'seat_number'))
+
+
+def line_items(tickets):
+    """Stripe line items for tickets of one order: one per ticket price, with the seats as quantity."""
+    seats_by_price = {}
+    for ticket in tickets:
+        seats_by_price.setdefault(ticket.price, []).append(ticket.seat_number)
+    if not seats_by_price:
+        return []
+
+    session = ticket.session
+    return [{
+        'price_data': {
+            'currency': 'UAH',
+            'product_data': {
+                'name': f'Квиток на "{session.movie.title}"',
+                'description': f'Сеанс: {session.start_time} {session.session_date}, '
+                               f'Місця: {", ".join(map(str, seats))}',
+            },
+            'unit_amount': int(price * 100),
+        },
+        'quantity': len(seats),
+    } for price, seats in seats_by_price.items()]
+
+
+def build_line_items(order):
+    return line_items(order_tickets(order))
+
+
+async def abuild_line_items(order):
+    return line_items([ticket async for ticket in order_tickets(order)])
+
+
+def checkout_params(request, order, items):
+    return {
+        'mode': 'payment',
+        'client_reference_id': order.id,
+        'success_url': order_url(request, 'success_purchase_url', order.id),
+        'cancel_url': order_url(request, 'cancel_purchase_url', order.id),
+        'line_items': items,
+    }
+
+
+def get_open_checkout_url(client, order):
+    """URL of the order's Stripe session if it can still be paid, so retries do not create new sessions."""
+    if not order.stripe_session_id:
+        return None
     try:
-        """
-        Emulation payment process
-        return True if payment succeeded, False if payment failed.
-        """
-        success_url = request.build_absolute_uri(reverse('success_purchase_url', kwargs={
-            'order_id': order.id
-        }))
-        cancel_url = request.build_absolute_uri(reverse('cancel_purchase_url', kwargs={
-            'order_id': order.id
-        }))
-
-        session_data = {
-            'mode': 'payment',
-            'client_reference_id': order.id,
-            'success_url': success_url,
-            'cancel_url': cancel_url,
-            'line_items': [],
-        }
-
-        for ticket in Ticket.objects.filter(order_id=order.id):
-            session_data['line_items'].append({
-                'price_data': {
-                    'currency': 'UAH',
-                    'product_data': {
-                        'name': f'Квиток на "{ticket.session.movie.title}"',
-                        'description': f'Сеанс: {ticket.session.start_time} {ticket.session.session_date}, '
-                                       f'Місце: {ticket.seat_number}',
-                    },
-                    'unit_amount': int(ticket.session.base_ticket_price * 100),
-                },
-                'quantity': 1,
-            })
-
-        session = stripe.checkout.Session.create(**session_data)
+        with stripe_call('checkout.retrieve'):
+            session = client.checkout.Session.retrieve(order.stripe_session_id)
+    except stripe.error.StripeError:
+        return None
+    return session.url if session.status == 'open' else None
+
+
+async def aget_open_checkout_url(client, order):
+    if not order.stripe_session_id:
+        return None
+    try:
+        with stripe_call('checkout.retrieve'):
+            session = await client.checkout.Session.retrieve_async(order.stripe_session_id)
+    except stripe.error.StripeError:
+        return None
+    return session.url if session.status == 'open' else None
+
+
+def process_payment(request, order, client=None):
+    """
+    Start (or resume) Stripe checkout of an order.
+
+    Returns the URL to redirect the buyer to, or None when Stripe fails.
+    ``client`` is the Stripe API to call, the ``stripe`` module by default.
+    """
+    client = client or stripe
+    try:
+        checkout_url = get_open_checkout_url(client, order)
+        if checkout_url:
+            return checkout_url
+
+        params = checkout_params(request, order, build_line_items(order))
+        with stripe_call('checkout.create'):
+            session = client.checkout.Session.create(**params)
 
         order.stripe_session_id = session.id
-        order.save()
+        order.save(update_fields=['stripe_session_id', 'updated_at'])
 
         # return redirect_url in purchase_ticket_process
         return session.url
 
-    except stripe.error.StripeError as e:
-        print(f"Stripe error: {str(e)}")
+    except stripe.error.StripeError:
+        logger.warning('Stripe checkout of order %s failed', order.id, exc_info=True)
+        return None
+
+
+async def aprocess_payment(request, order, client=None):
+    """process_payment for async views: the Stripe calls and queries are awaited."""
+    client = client or stripe
+    try:
+        checkout_url = await aget_open_checkout_url(client, order)
+        if checkout_url:
+            return checkout_url
+
+        items = await abuild_line_items(order)
+        with stripe_call('checkout.create'):
+            session = await client.checkout.Session.create_async(**checkout_params(request, order, items))
+
+        order.stripe_session_id = session.id
+        await order.asave(update_fields=['stripe_session_id', 'updated_at'])
+        return session.url
+
+    except stripe.error.StripeError:
+        logger.warning('Stripe checkout of order %s failed', order.id, exc_info=True)
         return None
 
 
-def purchase_ticket_process(request, session):
+def check_order_payment(order, client=None):
+    """
+    Complete a pending order whose Stripe session is already paid, for buyers
+    that return to the site before the webhook was processed.
+    """
+    client = client or stripe
+    if order.status != Order.PENDING or not order.stripe_session_id:
+        return
+    try:
+        with stripe_call('checkout.retrieve'):
+            session = client.checkout.Session.retrieve(order.stripe_session_id)
+    except stripe.error.StripeError:
+        logger.warning('Could not check the Stripe payment of order %s', order.id, exc_info=True)
+        return
+    if session.payment_status == 'paid':
+        complete_paid_order(order)
+
+
+async def acheck_order_payment(order, client=None):
+    client = client or stripe
+    if order.status != Order.PENDING or not order.stripe_session_id:
+        return
+    try:
+        with stripe_call('checkout.retrieve'):
+            session = await client.checkout.Session.retrieve_async(order.stripe_session_id)
+    except stripe.error.StripeError:
+        logger.warning('Could not check the Stripe payment of order %s', order.id, exc_info=True)
+        return
+    if session.payment_status == 'paid':
+        await sync_to_async(complete_paid_order)(order)
+
+
+def complete_paid_order(order):
+    refresh_seat_maps(finalise_orders([order.id], Order.COMPLETED))
+    order.refresh_from_db(fields=['status'])
+
+
+def record_stripe_event(event):
+    """Store a verified webhook event once per event id and hand it to the Celery consumer."""
+    checkout_session = event['data']['object']
+    reference = checkout_session.get('client_reference_id') or ''
+    StripeEvent.objects.bulk_create([StripeEvent(
+        event_id=event['id'],
+        type=event['type'],
+        order_id=int(reference) if reference.isdigit() else None,
+        payment_status=checkout_session.get('payment_status') or '',
+    )], ignore_conflicts=True)
+    transaction.on_commit(enqueue_stripe_events)
+
+
+def reserve_seats(user, session, seats):
+    """
+    Create a pending order with reserved tickets for the given seats.
+
+    Returns ``(order, [])`` on success and ``(None, conflicts)`` when some of
+    the seats are taken or do not exist in the hall. The partial unique
+    constraint on active tickets guarantees that two concurrent checkouts
+    cannot both reserve the same seat.
+    """
+    seat_map = session.get_seat_map()
+    conflicts = seat_map.conflicts(seats)
+    if conflicts:
+        return None, conflicts
+
+    prices = seat_prices(session, seats, seat_map)
+    try:
+        with transaction.atomic():
+            order = Order.objects.create(user=user, session=session, total_price=sum(prices.values()),
+                                         status=Order.PENDING)
+            # Seat numbers are already validated against the seat map, so Ticket.save()/clean() is skipped
+            Ticket.objects.bulk_create([
+                Ticket(session=session, user=user, seat_number=seat, status=Ticket.RESERVED, price=prices[seat],
+                       order=order)
+                for seat in seats
+            ])
+            record_reservation(session, len(seats))
+    except IntegrityError:
+        # Another checkout reserved some of the seats after our occupancy check
+        return None, session.get_seat_map().conflicts(seats) or list(seats)
+
+    return order, []
+
+
+def parse_selected_seats(raw):
+    """Seat numbers from the JSON list posted by the seat map, deduplicated in order."""
+    return list(dict.fromkeys(int(seat) for seat in json.loads(raw)))
+
+
+def reserve_checkout(user, session, seats):
+    """
+    Phase 1 of checkout: hold and reserve the seats and commit, so no locks
+    or connection are held while Stripe is called. Returns ``(order, None)``
+    or ``(None, error message)``.
+    """
+    # Seats picked on the seat map are already held by this user; holding them again only extends the hold
+    conflicts = acquire_seat_holds(session.slug, user.id, seats, get_cached_seat_map(session.slug))
+    if conflicts:
+        return None, f"Місця недоступні: {', '.join(map(str, conflicts))}"
+
+    with transaction.atomic():
+        order, conflicts = reserve_seats(user, session, seats)
+        if conflicts:
+            release_seat_holds(session.slug, user.id, seats)
+            return None, f"Місця недоступні: {', '.join(map(str, conflicts))}"
+        refresh_seat_map_on_commit(session)
+        # Holds are dropped only after the refreshed seat map shows the new tickets
+        transaction.on_commit(lambda: convert_seat_holds(session.slug, user.id, seats))
+        transaction.on_commit(lambda: schedule_order_expiry(order))
+    return order, None
+
+
+def purchase_ticket_process(request, session, payment_client=None):
     selected_seats = request.POST.get('selected_seats')
     if not selected_seats:
         return False, "Не вибрано місце"
 
     try:
-        selected_seats = json.loads(selected_seats)
-        price = session.base_ticket_price
-        total_price = price * len(selected_seats)
+        selected_seats = parse_selected_seats(selected_seats)
+        if not selected_seats:
+            return False, "Не вибрано місце"
 
-        with transaction.atomic():
-            order = Order.objects.create(user=request.user, session=session, total_price=total_price,
-                                         status=Order.PENDING)
-            tickets = []
+        order, error = reserve_checkout(request.user, session, selected_seats)
+        if error:
+            return False, error
 
-            existing_tickets = set(
-                Ticket.objects.filter(session=session).values_list('seat_number', flat=True)
-            )
+        # Phase 2: open the payment session; a reservation that cannot be paid is cancelled right away
+        redirect_url = None
+        try:
+            redirect_url = process_payment(request, order, client=payment_client)
+        finally:
+            if not redirect_url:
+                cancel_order(order.id)
 
-            for seat in selected_seats:
-                seat = int(seat)
-                if seat in existing_tickets:
-                    return False, f"Місце {seat} вже зайняте"
+        if not redirect_url:
+            return False, "Оплата не прошла. Спробуйте ще раз"
 
-                ticket = Ticket.objects.create(
-                    session=session, user=request.user, seat_number=seat, status=Ticket.RESERVED, price=price,
-                    order=order
-                )
-                tickets.append(ticket)
+        # return redirect_url in main function purchase_ticket
+        return redirect_url, order.id
+
+    except (TypeError, ValueError):
+        return False, "Неправильний номер місця"
+    except Exception as e:
+        return False, f"Сталася помилка: {str(e)}"
+
+
+async def apurchase_ticket_process(request, user, session, payment_client=None):
+    """purchase_ticket_process for async views; ``user`` is the already resolved ``request.auser()``."""
+    selected_seats = request.POST.get('selected_seats')
+    if not selected_seats:
+        return False, "Не вибрано місце"
+
+    try:
+        selected_seats = parse_selected_seats(selected_seats)
+        if not selected_seats:
+            return False, "Не вибрано місце"
 
-            redirect_url = process_payment(request, order)
+        # The reservation transaction runs in a worker thread; Stripe is then awaited on the event loop
+        order, error = await sync_to_async(reserve_checkout)(user, session, selected_seats)
+        if error:
+            return False, error
 
+        redirect_url = None
+        try:
+            redirect_url = await aprocess_payment(request, order, client=payment_client)
+        finally:
             if not redirect_url:
-                return False, "Оплата не прошла. Спробуйте ще раз", order.id
+                await sync_to_async(cancel_order)(order.id)
 
-            # return redirect_url in main function purchase_ticket
-            return redirect_url, order.id
+        if not redirect_url:
+            return False, "Оплата не прошла. Спробуйте ще раз"
+        return redirect_url, order.id
 
-    except ValueError:
+    except (TypeError, ValueError):
         return False, "Неправильний номер місця"
     except Exception as e:
         return False, f"Сталася помилка: {str(e)}"
@@ -0,0 +1,118 @@
+"""
+Incremental maintenance of SessionStats.
+
+Tickets change state in two places only: reserve_seats inserts reserved
+tickets, and tasks.set_orders_status moves the reserved tickets of pending
+orders to booked or cancelled (payment, webhook, expiry). Both call in here
+inside their transaction, so the counters commit or roll back with the
+tickets. Anything else (admin edits, deleted orders) is drift that
+rebuild_session_stats corrects.
+"""
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+
+from .models import Session, SessionStats, Ticket
+from .schedule import invalidate_availability
+
+
+def invalidate_availability_on_commit(*session_dates):
+    # Listings show the counters: those of these days are stale once they commit, the rest of the schedule is not
+    transaction.on_commit(lambda: invalidate_availability(*session_dates))
+
+
+def create_session_stats(session):
+    """Counters of a saved session; a changed hall keeps the sold seats and recomputes the free ones."""
+    capacity = session.hall.capacity
+    updated = SessionStats.objects.filter(session=session).update(
+        capacity=capacity, available=capacity - F('booked') - F('reserved'), updated_at=now())
+    if not updated:
+        SessionStats.objects.get_or_create(session=session, defaults={'capacity': capacity, 'available': capacity})
+
+
+def update_hall_capacity(hall):
+    SessionStats.objects.filter(session__hall=hall).update(
+        capacity=hall.capacity, available=hall.capacity - F('booked') - F('reserved'), updated_at=now())
+    invalidate_availability_on_commit()
+
+
+def record_reservation(session, count):
+    """``count`` new reserved tickets of a session."""
+    updated = SessionStats.objects.filter(session_id=session.id).update(
+        reserved=F('reserved') + count, available=F('available') - count, updated_at=now())
+    if not updated:
+        # Sessions inserted with bulk_create have no counters yet
+        rebuild_session_stats([session.id])
+    invalidate_availability_on_commit(session.session_date)
+
+
+def record_ticket_transition(order_ids, ticket_status):
+    """
+    Move the reserved tickets of ``order_ids`` to ``ticket_status`` in the
+    counters. Call it before the tickets themselves are updated: it reads
+    which of them are still reserved.
+    """
+    moved = (Ticket.objects.filter(order_id__in=order_ids, status=Ticket.RESERVED)
+             .values('session_id', 'session__session_date')
+             .annotate(count=Count('id'), amount=Sum('price'))
+             .order_by('session_id'))
+    missing, session_dates = [], set()
+    for row in moved:
+        count = row['count']
+        if ticket_status == Ticket.BOOKED:
+            changes = {'booked': F('booked') + count, 'revenue': F('revenue') + row['amount']}
+        else:
+            changes = {'available': F('available') + count}
+        updated = SessionStats.objects.filter(session_id=row['session_id']).update(
+            reserved=F('reserved') - count, updated_at=now(), **changes)
+        if not updated:
+            missing.append(row['session_id'])
+        session_dates.add(row['session__session_date'])
+    if missing:
+        # Rebuilt after the tickets change, from their final state
+        transaction.on_commit(lambda: rebuild_session_stats(missing))
+    if session_dates:
+        invalidate_availability_on_commit(*session_dates)
+
+
+def rebuild_session_stats(session_ids=None):
+    """
+    Recompute the counters of the given sessions (all when None) from their
+    tickets and store the ones that differ. Returns ``(checked, corrected)``.
+    """
+    sessions = Session.objects.all() if session_ids is None else Session.objects.filter(id__in=session_ids)
+    actual = (sessions.annotate(
+        capacity=F('hall__capacity'),
+        booked=Count('ticket', filter=Q(ticket__status=Ticket.BOOKED)),
+        reserved=Count('ticket', filter=Q(ticket__status=Ticket.RESERVED)),
+        revenue=Coalesce(Sum('ticket__price', filter=Q(ticket__status=Ticket.BOOKED)), 0,
+                         output_field=DecimalField(max_digits=12, decimal_places=2)),
+    ).values_list('id', 'capacity', 'booked', 'reserved', 'revenue'))
+    stored = {stats.session_id: stats for stats in SessionStats.objects.filter(session__in=sessions)}
+
+    corrected, checked = [], 0
+    for session_id, capacity, booked, reserved, revenue in actual.iterator(chunk_size=2000):
+        checked += 1
+        stats = SessionStats(session_id=session_id, capacity=capacity, booked=booked, reserved=reserved,
+                             available=capacity - booked - reserved, revenue=revenue)
+        current = stored.get(session_id)
+        if current is None or any(getattr(current, field) != getattr(stats, field)
+                                  for field in ('capacity', 'booked', 'reserved', 'available', 'revenue')):
+            corrected.append(stats)
+    SessionStats.objects.bulk_create(
+        corrected, batch_size=1000, update_conflicts=True, unique_fields=['session'],
+        update_fields=['capacity', 'booked', 'reserved', 'available', 'revenue', 'updated_at'],
+    )
+    if corrected:
+        invalidate_availability()
+    return checked, len(corrected)
+
+
+def create_bulk_session_stats(sessions):
+    """Empty counters of new sessions inserted with bulk_create, which sends no post_save."""
+    SessionStats.objects.bulk_create(
+        [SessionStats(session=session, capacity=session.hall.capacity, available=session.hall.capacity)
+         for session in sessions],
+        batch_size=1000,
+    )
@@ -0,0 +1,69 @@
+from datetime import date
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .instrumentation import record_query
+from .models import Genre, Hall, Movie, Session
+from .posters import schedule_poster_variants
+from .seats import refresh_seat_maps
+from .session_stats import create_session_stats, update_hall_capacity
+from .schedule import invalidate_schedule
+
+
+@receiver(pre_save, sender=Session)
+def invalidate_previous_session_date(sender, instance, raw=False, **kwargs):
+    # A session moved to another day also disappears from the schedule of its old day
+    if instance.pk and not raw:
+        previous_date = Session.objects.filter(pk=instance.pk).values_list('session_date', flat=True).first()
+        if previous_date and previous_date != instance.session_date:
+            invalidate_schedule(previous_date)
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+def invalidate_session_date(sender, instance, **kwargs):
+    invalidate_schedule(instance.session_date)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+@receiver(post_save, sender=Hall)
+@receiver(post_delete, sender=Hall)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+@receiver(m2m_changed, sender=Movie.genre.through)
+def invalidate_whole_schedule(sender, **kwargs):
+    invalidate_schedule()
+
+
+@receiver(post_save, sender=Session)
+def update_session_stats(sender, instance, raw=False, **kwargs):
+    if not raw:
+        create_session_stats(instance)
+
+
+@receiver(post_save, sender=Hall)
+def update_session_capacities(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        update_hall_capacity(instance)
+        # Cached seat maps are sized by the hall capacity; past sessions' ones just expire
+        upcoming = Session.objects.filter(hall=instance, session_date__gte=date.today()).values('id')
+        transaction.on_commit(lambda: refresh_seat_maps(upcoming))
+
+
+@receiver(post_save, sender=Movie)
+def update_poster_variants(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if (instance.poster.name or None) != (instance.poster_variants or {}).get('source'):
+        schedule_poster_variants(instance)
+
+
+@receiver(connection_created)
+def install_query_instrumentation(sender, connection, **kwargs):
+    # Connections are reopened on the same wrapper object; install the wrapper once
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
@@ -1,26 +1,220 @@
+import logging
+import time
 from datetime import timedelta
+
+from celery import shared_task
+from django.db import transaction
 from django.utils.timezone import now
-from cinema_app.models import Order, Ticket
+from kombu.exceptions import OperationalError
+from cinema_app.models import Movie, Order, Session, StripeEvent, Ticket
+from cinema_app.posters import generate_poster_variants
+from cinema_app.seats import refresh_seat_maps
+from cinema_app.session_stats import record_ticket_transition
 # from background_task import background
 
 # @background(schedule=timedelta(minutes=1)) # background_tasks
 
+logger = logging.getLogger(__name__)
+
+ORDER_EXPIRATION = timedelta(minutes=15)
+EXPIRY_BATCH_SIZE = 1000
+STRIPE_EVENT_BATCH_SIZE = 500
+
+
+def set_orders_status(order_ids, order_status, ticket_status):
+    # Two UPDATEs for any number of orders (plus the session counters); callers lock the orders and check
+    # their current status
+    record_ticket_transition(order_ids, ticket_status)
+    updated_at = now()
+    Ticket.objects.filter(order_id__in=order_ids).update(status=ticket_status, updated_at=updated_at)
+    Order.objects.filter(id__in=order_ids).update(status=order_status, updated_at=updated_at)
+
+
+def expire_orders_batch(deadline, batch_size):
+    """
+    Cancel one batch of pending orders created before ``deadline`` together
+    with their tickets. Rows locked by another worker are skipped, so several
+    workers can drain the same backlog. Returns the ``(order_id, session_id)``
+    pairs that were cancelled.
+    """
+    with transaction.atomic():
+        batch = list(
+            Order.objects.filter(status=Order.PENDING, created_at__lte=deadline)
+            .order_by('created_at')
+            .select_for_update(skip_locked=True)
+            .values_list('id', 'session_id')[:batch_size]
+        )
+        if batch:
+            set_orders_status([order_id for order_id, _ in batch], Order.CANCELLED, Ticket.CANCELLED)
+    return batch
+
+
+@shared_task
+def expire_order(order_id):
+    """
+    Cancel a single unpaid order at its payment deadline. Scheduled for every
+    new order by schedule_order_expiry; paid or already cancelled orders are
+    left alone, and an order that is not due yet is rescheduled.
+    """
+    with transaction.atomic():
+        order = (Order.objects.select_for_update()
+                 .filter(id=order_id, status=Order.PENDING)
+                 .only('id', 'session_id', 'created_at')
+                 .first())
+        if order is None:
+            return f"Order {order_id} is not pending."
+
+        deadline = order.created_at + ORDER_EXPIRATION
+        if deadline > now():
+            schedule_expiry(order_id, deadline)
+            return f"Order {order_id} is not due yet."
+
+    if not cancel_order(order_id):
+        return f"Order {order_id} is not pending."
+    return f"Order {order_id} canceled."
+
+
+def cancel_order(order_id):
+    """
+    Cancel a pending order and free its seats. Returns False when the order
+    is no longer pending (paid or already cancelled).
+    """
+    session_ids = finalise_orders([order_id], Order.CANCELLED)
+    if not session_ids:
+        return False
+    refresh_seat_maps(session_ids)
+    return True
+
+
+def finalise_orders(order_ids, status):
+    """
+    Move the pending ones of ``order_ids`` to ``status`` (completed or
+    cancelled) together with their tickets. Returns the ids of the affected
+    sessions so the caller can refresh their seat maps.
+    """
+    ticket_status = Ticket.BOOKED if status == Order.COMPLETED else Ticket.CANCELLED
+    with transaction.atomic():
+        pending = list(Order.objects.filter(id__in=order_ids, status=Order.PENDING)
+                       .select_for_update()
+                       .values_list('id', 'session_id'))
+        if pending:
+            set_orders_status([order_id for order_id, _ in pending], status, ticket_status)
+    return {session_id for _, session_id in pending}
+
+
+def schedule_order_expiry(order):
+    try:
+        schedule_expiry(order.id, order.created_at + ORDER_EXPIRATION)
+    except OperationalError:
+        # The broker is unreachable; the periodic cancel_unpaid_orders sweep will expire the order
+        logger.warning('Could not schedule expiry of order %s', order.id, exc_info=True)
+
+
+def schedule_expiry(order_id, deadline):
+    # Eager tasks (development without a broker) ignore the eta: expire_order would run at once and reschedule
+    # itself forever. Unpaid orders are then left to cancel_unpaid_orders.
+    if not expire_order.app.conf.task_always_eager:
+        expire_order.apply_async(args=[order_id], eta=deadline)
 
-def cancel_unpaid_orders():
-    expiration_time = timedelta(minutes=15)
-    current_time = now()
 
-    unpaid_orders = Order.objects.filter(
-        status=Order.PENDING,
-        created_at__lte=current_time - expiration_time
-    ).prefetch_related('tickets')
+@shared_task
+def cancel_unpaid_orders(batch_size=EXPIRY_BATCH_SIZE):
+    """Safety sweep for orders whose expire_order task was lost or never scheduled."""
+    started = time.monotonic()
+    deadline = now() - ORDER_EXPIRATION
 
     canceled_count = 0
+    batch_count = 0
+    session_ids = set()
+
+    while batch := expire_orders_batch(deadline, batch_size):
+        canceled_count += len(batch)
+        batch_count += 1
+        session_ids.update(session_id for _, session_id in batch)
+
+    if session_ids:
+        refresh_seat_maps(session_ids)
+
+    duration = time.monotonic() - started
+    logger.info('Expired %s unpaid orders in %s batches, %.3fs', canceled_count, batch_count, duration)
+    return f"{canceled_count} orders canceled in {batch_count} batches ({duration:.3f}s)."
+
+
+def process_stripe_events_batch(batch_size):
+    """
+    Apply one batch of stored webhook events: paid checkouts complete their
+    orders and expired ones cancel them, each with one pair of UPDATEs.
+    Events locked by another worker are skipped. Returns the number of
+    events in the batch and the ids of the affected sessions.
+    """
+    with transaction.atomic():
+        events = list(StripeEvent.objects.filter(processed_at__isnull=True)
+                      .order_by('id')
+                      .select_for_update(skip_locked=True)
+                      .values_list('id', 'type', 'order_id', 'payment_status')[:batch_size])
+        if not events:
+            return 0, set()
+
+        paid, expired = set(), set()
+        for _, event_type, order_id, payment_status in events:
+            if order_id is None:
+                continue
+            if event_type == StripeEvent.CHECKOUT_EXPIRED:
+                expired.add(order_id)
+            elif payment_status == 'paid':
+                paid.add(order_id)
+
+        session_ids = finalise_orders(paid, Order.COMPLETED)
+        session_ids |= finalise_orders(expired - paid, Order.CANCELLED)
+
+        late_payments = Order.objects.filter(id__in=paid).exclude(status=Order.COMPLETED).values_list('id', flat=True)
+        for order_id in late_payments:
+            logger.warning('Order %s was paid after it had been cancelled; it needs a refund', order_id)
+
+        StripeEvent.objects.filter(id__in=[event_id for event_id, *_ in events]).update(processed_at=now())
+    return len(events), session_ids
+
+
+@shared_task
+def process_stripe_events(batch_size=STRIPE_EVENT_BATCH_SIZE):
+    """Drain the stored webhook events; enqueued by the webhook and run periodically as a sweep."""
+    processed_count = 0
+    session_ids = set()
+
+    while True:
+        count, batch_session_ids = process_stripe_events_batch(batch_size)
+        if not count:
+            break
+        processed_count += count
+        session_ids |= batch_session_ids
+
+    if session_ids:
+        refresh_seat_maps(session_ids)
+    return f"{processed_count} Stripe events processed."
+
+
+def enqueue_stripe_events():
+    try:
+        process_stripe_events.delay()
+    except OperationalError:
+        # The broker is unreachable; the periodic process_stripe_events run will pick the events up
+        logger.warning('Could not enqueue Stripe event processing', exc_info=True)
+
+
+@shared_task
+def reconcile_seat_maps():
+    # Rewrite cached seat maps of upcoming sessions from the database to fix any drift
+    session_ids = Session.objects.filter(session_date__gte=now().date()).values_list('id', flat=True)
+    refreshed_count = refresh_seat_maps(list(session_ids))
+
+    return f"{refreshed_count} seat maps reconciled."
 
-    for order in unpaid_orders:
-        order.tickets.update(status=Ticket.CANCELLED)
-        order.status = Order.CANCELLED
-        order.save()
-        canceled_count += 1
 
-    return f"{canceled_count} orders canceled."
+@shared_task
+def generate_movie_poster_variants(movie_id):
+    movie = Movie.objects.filter(pk=movie_id).only('slug', 'poster', 'poster_variants').first()
+    if movie is None:
+        return f"Movie {movie_id} does not exist."
+    if not generate_poster_variants(movie):
+        return f"Poster variants of movie {movie_id} are up to date."
+    return f"Poster variants of movie {movie_id} generated."
@@ -0,0 +1,40 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from ..posters import poster_sources, poster_srcset as variants_srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def poster_srcset(movie, image_format='webp'):
+    """``srcset`` value of a movie's poster variants in one format, e.g. ``{% poster_srcset movie 'jpeg' %}``."""
+    return variants_srcset(movie.poster_variants or {}, image_format)
+
+
+@register.simple_tag
+def poster_picture(movie, sizes, css_class='', style='', alt=''):
+    """
+    Responsive ``<picture>`` of a movie poster: AVIF/WebP sources with
+    ``srcset`` and ``sizes`` and a JPEG ``<img>`` fallback, lazy-loaded.
+    Falls back to the original upload until the variants are generated.
+
+        {% poster_picture movie sizes="150px" css_class="img-fluid rounded" %}
+    """
+    alt = alt or f'{movie.title} poster'
+    variants = movie.poster_variants or {}
+    sources = poster_sources(variants)
+    if not sources:
+        return format_html('<img src="{}" alt="{}" class="{}" style="{}" loading="lazy" decoding="async">',
+                           movie.poster.url, alt, css_class, style)
+
+    fallback_name, fallback_srcset = sources[-1]
+    smallest = min(variants['formats'][fallback_name].items(), key=lambda size: int(size[0]))[1]
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}" style="{}" '
+        'loading="lazy" decoding="async"></picture>',
+        format_html_join('', '<source type="image/{}" srcset="{}" sizes="{}">',
+                         ((name, srcset, sizes) for name, srcset in sources[:-1])),
+        movie.poster.storage.url(smallest), fallback_srcset, sizes, variants['width'], variants['height'],
+        alt, css_class, style,
+    )
@@ -1,3 +1,1511 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import io
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import time as time_module
+from datetime import date, time, timedelta
+from decimal import Decimal
+from pathlib import Path
 
-# Create your tests here.
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+import stripe
+from asgiref.sync import async_to_sync
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+from kombu.exceptions import OperationalError as KombuOperationalError
+
+from .factories import SessionFactory, TicketFactory, prepare_session
+from .instrumentation import REGISTRY, stripe_call
+from .models import Genre, Hall, Movie, Order, Session, SessionStats, StripeEvent, Ticket
+from .pagination import KeysetPaginator
+from .pricing import category_prices, price_vector, seat_prices, surge_multiplier
+from .search import MovieSearchIndex, prefix_tsquery, search_movies
+from .seats import (_seat_watchers, HallLayout, SeatMap, acquire_seat_holds, get_hall_layout, get_cached_seat_map, get_seat_holds, refresh_seat_map,
+                    seat_hold_metrics, seat_map_cache_key, stream_seat_events)
+from .services import complete_paid_order, process_payment, purchase_ticket_process, reserve_seats
+from .utils import calculate_dynamic_price, format_day_label, generate_session_slug
+from .scheduling import find_conflicts, validate_schedule
+from .session_stats import rebuild_session_stats
+from .timetable import read_timetable, recurring_sessions, schedule_sessions, timetable_sessions
+from .tasks import (ORDER_EXPIRATION, cancel_unpaid_orders, expire_order, process_stripe_events,
+                    process_stripe_events_batch, reconcile_seat_maps, schedule_order_expiry)
+
+
+class CinemaTestMixin:
+    @classmethod
+    def create_session(cls, capacity=40, days_ahead=1, start_time=time(18, 0), **kwargs):
+        hall = Hall.objects.create(name=f'Hall {capacity}', capacity=capacity)
+        movie = Movie.objects.create(
+            title='Фільм', original_name=kwargs.pop('original_name', 'Movie'), description='Опис',
+            duration=120, release_date=date(2024, 1, 1), age_limit=12,
+        )
+        return Session.objects.create(
+            hall=hall, movie=movie, base_ticket_price=Decimal('150.00'),
+            session_date=date.today() + timedelta(days=days_ahead), start_time=start_time, **kwargs,
+        )
+
+    @staticmethod
+    def create_order(user, session, seats, status=Ticket.RESERVED):
+        order = Order.objects.create(user=user, session=session, total_price=session.base_ticket_price * len(seats))
+        for seat in seats:
+            Ticket.objects.create(session=session, user=user, order=order, seat_number=seat,
+                                  price=session.base_ticket_price, status=status)
+        return order
+
+
+class StubStripe:
+    """Local stand-in for the Stripe API: records created checkout sessions and serves them back."""
+
+    def __init__(self):
+        self.sessions = {}
+        self.created = []
+        self.checkout = SimpleNamespace(Session=SimpleNamespace(
+            create=self.create, retrieve=self.retrieve, create_async=self.create_async,
+            retrieve_async=self.retrieve_async,
+        ))
+
+    def create(self, **params):
+        session_id = f'cs_test_{len(self.created) + 1}'
+        session = SimpleNamespace(id=session_id, url=f'https://checkout.stripe.test/{session_id}', status='open')
+        self.sessions[session_id] = session
+        self.created.append(params)
+        return session
+
+    def retrieve(self, session_id):
+        return self.sessions[session_id]
+
+    async def create_async(self, **params):
+        return self.create(**params)
+
+    async def retrieve_async(self, session_id):
+        return self.retrieve(session_id)
+
+
+# What cinema/settings_prod.py reads from the environment on top of the variables the tests run with
+PRODUCTION_ENV = {
+    'DATABASE_NAME': 'cinema', 'DATABASE_USER': 'cinema', 'DATABASE_PASSWORD': 'cinema', 'DATABASE_HOST': 'db',
+    'DATABASE_PORT': '5432', 'REDIS_URL': 'redis://redis:6379/0', 'METRICS_TOKEN': 'token',
+}
+
+
+def load_production_settings(**env):
+    """Names defined by the production settings module, evaluated under ``env``."""
+    with mock.patch.dict(os.environ, {**PRODUCTION_ENV, **env}):
+        return runpy.run_path(str(settings.BASE_DIR / 'cinema' / 'settings_prod.py'))
+
+
+class ProductionSettingsTests(SimpleTestCase):
+    def test_middleware_is_async_capable(self):
+        # A sync-only middleware makes Django adapt the whole handler, async views included, into a thread
+        production = load_production_settings(DEBUG='True')
+        for path in production['MIDDLEWARE']:
+            with self.subTest(path):
+                self.assertTrue(getattr(import_string(path), 'async_capable', False))
+        self.assertNotIn('debug_toolbar', production['INSTALLED_APPS'])
+
+    def test_metrics_token_is_required(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, 'METRICS_TOKEN'):
+            load_production_settings(METRICS_TOKEN='')
+
+    def test_gunicorn_runs_one_worker_with_a_process_local_cache(self):
+        # The test settings use LocMemCache, like development without REDIS_URL
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}), mock.patch('sys.stderr', io.StringIO()):
+            config = runpy.run_path(str(settings.BASE_DIR / 'gunicorn.conf.py'))
+        self.assertEqual(config['workers'], 1)
+
+
+class HealthCheckTests(TestCase):
+    def test_liveness_and_readiness(self):
+        self.assertEqual(self.client.get(reverse('healthz')).json(), {'status': 'ok'})
+        self.assertEqual(self.client.get(reverse('readyz')).json(),
+                         {'status': 'ok', 'database': 'ok', 'cache': 'ok'})
+
+    def test_not_ready_when_cache_fails(self):
+        with mock.patch('cinema_app.views.cache.set', side_effect=ConnectionError):
+            response = self.client.get(reverse('readyz'))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['cache'], 'error')
+
+
+@mock.patch('cinema_app.services.schedule_order_expiry')
+class InstrumentationTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = self.create_session(capacity=10)
+        self.seats_url = reverse('available_seats', args=[self.session.slug])
+
+    @staticmethod
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_records_queries_and_cache_reads_per_view(self, schedule_order_expiry):
+        view = {'view': 'available_seats'}
+        requests = self.sample('cinema_http_requests_total', method='GET', status='200', **view)
+        queries = self.sample('cinema_db_queries_per_request_sum', **view)
+        hits = self.sample('cinema_cache_requests_total', result='hit', **view)
+
+        self.client.get(self.seats_url)
+        self.client.get(self.seats_url)
+
+        self.assertEqual(self.sample('cinema_http_requests_total', method='GET', status='200', **view), requests + 2)
+        self.assertGreater(self.sample('cinema_db_queries_per_request_sum', **view), queries)
+        self.assertGreater(self.sample('cinema_cache_requests_total', result='hit', **view), hits)
+        self.assertContains(self.client.get(reverse('metrics')), 'cinema_http_requests_total{')
+
+    def test_stripe_latency_is_labelled_with_the_view(self, schedule_order_expiry):
+        labels = {'view': 'purchase_ticket', 'operation': 'checkout.create'}
+        calls = self.sample('cinema_stripe_request_duration_seconds_count', **labels)
+        self.client.force_login(User.objects.create_user('buyer'))
+
+        with mock.patch('cinema_app.services.stripe.checkout', StubStripe().checkout):
+            self.client.post(reverse('purchase_ticket', args=[self.session.slug]), {'selected_seats': '[1]'})
+
+        self.assertEqual(self.sample('cinema_stripe_request_duration_seconds_count', **labels), calls + 1)
+
+        outside = {'view': 'none', 'operation': 'checkout.retrieve'}
+        calls = self.sample('cinema_stripe_request_duration_seconds_count', **outside)
+        with stripe_call('checkout.retrieve'):
+            pass
+        self.assertEqual(self.sample('cinema_stripe_request_duration_seconds_count', **outside), calls + 1)
+
+    @override_settings(SLOW_REQUEST_SAMPLE_RATE=1, SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_sampled_slow_request_log(self, schedule_order_expiry):
+        with self.assertLogs('cinema_app.performance', 'WARNING') as logs:
+            self.client.get(self.seats_url)
+
+        self.assertIn('(available_seats) 200', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(SLOW_REQUEST_SAMPLE_RATE=0, SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_no_log_when_sampling_is_off(self, schedule_order_expiry):
+        with self.assertNoLogs('cinema_app.performance'):
+            self.client.get(self.seats_url)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self, schedule_order_expiry):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class SeatMapTests(TestCase):
+    def test_occupancy(self):
+        seat_map = SeatMap(10, [1, 5, 10, 11])
+
+        self.assertTrue(seat_map.is_taken(5))
+        self.assertTrue(seat_map.is_free(2))
+        self.assertFalse(seat_map.is_free(11))
+        self.assertEqual(seat_map.available(), [2, 3, 4, 6, 7, 8, 9])
+        self.assertEqual(seat_map.free_count, 7)
+        self.assertEqual(seat_map.conflicts([2, 5, 0, 12]), [5, 0, 12])
+        # Whether a seat exists or is free must be asked explicitly
+        self.assertTrue(seat_map.is_valid(5))
+        with self.assertRaises(TypeError):
+            5 in seat_map
+
+    def test_set_operations_and_serialisation(self):
+        seat_map = SeatMap(6, [1]).union(SeatMap(6, [2, 3]))
+        seat_map.release([3])
+
+        self.assertEqual(seat_map.taken(), [1, 2])
+        self.assertEqual(SeatMap.from_bytes(seat_map.to_bytes()).taken(), [1, 2])
+        self.assertEqual(SeatMap(10, [1, 9]).to_bitmask(), bytes([0b00000001, 0b00000001]))
+
+
+class SessionSeatsTests(CinemaTestMixin, TestCase):
+    def test_available_seats_ignore_cancelled_tickets(self):
+        session = self.create_session(capacity=10)
+        user = User.objects.create_user('viewer')
+        self.create_order(user, session, [1, 2])
+        self.create_order(user, session, [3], status=Ticket.CANCELLED)
+
+        with self.assertNumQueries(2):
+            available = Session.objects.select_related('hall').get(pk=session.pk).get_available_seats()
+
+        self.assertEqual(available, [3, 4, 5, 6, 7, 8, 9, 10])
+
+
+class HallLayoutTests(CinemaTestMixin, TestCase):
+    def test_partial_last_row_is_kept(self):
+        layout = HallLayout(25, 10)
+        grid = layout.grid(SeatMap(25, [21]))
+
+        self.assertEqual(layout.row_lengths(), [10, 10, 5])
+        self.assertEqual([seat for seat, _, _ in grid[-1]], [21, 22, 23, 24, 25])
+        self.assertFalse(grid[-1][0][2])
+
+    def test_default_and_explicit_categories(self):
+        layout = HallLayout(100, 10)
+
+        self.assertEqual(layout.category(41), HallLayout.COMFORT)
+        self.assertEqual(layout.category(45), HallLayout.VIP)
+        self.assertEqual(layout.category(1), HallLayout.STANDARD)
+        self.assertEqual(HallLayout(20, 10, {'vip': [3]}).to_payload()['seat_categories'], '00200000000000000000')
+
+    def test_layout_cached_per_hall_configuration(self):
+        hall = Hall(name='Зал', capacity=30, seats_per_row=12)
+
+        self.assertIs(get_hall_layout(hall), get_hall_layout(Hall(name='Інший', capacity=30, seats_per_row=12)))
+        hall.seat_categories = {'vip': [1]}
+        self.assertEqual(get_hall_layout(hall).category(1), HallLayout.VIP)
+
+    def test_hall_edit_refreshes_seat_maps_and_layout(self):
+        session = self.create_session(capacity=12)
+        self.create_order(User.objects.create_user('viewer'), session, [2])
+        refresh_seat_map(session)
+        hall = session.hall
+
+        with self.captureOnCommitCallbacks(execute=True):
+            hall.capacity, hall.seats_per_row = 20, 5
+            hall.save()
+
+        seat_map = get_cached_seat_map(session.slug)
+        self.assertEqual((seat_map.capacity, seat_map.taken()), (20, [2]))
+        self.assertEqual(get_hall_layout(Hall.objects.get(pk=hall.pk)).row_lengths(), [5, 5, 5, 5])
+
+    def test_purchase_page_sends_grid_payload(self):
+        session = self.create_session(capacity=12)
+        user = User.objects.create_user('viewer')
+        self.create_order(user, session, [2])
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('purchase_ticket', args=[session.slug]))
+
+        self.assertEqual(response.context['seat_grid']['rows'], [10, 2])
+        self.assertEqual(response.context['seat_grid']['taken'], 'AgA=')
+        self.assertNotContains(response, 'data-seat-number="1"')
+
+
+class PricingTests(CinemaTestMixin, TestCase):
+    def test_price_vector_follows_categories(self):
+        vector = price_vector(get_hall_layout(Hall(capacity=100)), Decimal('150.00'))
+
+        self.assertEqual((vector[1], vector[41], vector[45]), (Decimal('150.00'), Decimal('180.00'), Decimal('225.00')))
+        self.assertIs(vector, price_vector(get_hall_layout(Hall(capacity=100)), Decimal('150')))
+        self.assertEqual(calculate_dynamic_price(45, Decimal('150.00'), 100), Decimal('225.00'))
+
+    def test_dynamic_price_rejects_seats_outside_the_hall(self):
+        for seat_number in (0, -1, 101):
+            with self.subTest(seat_number=seat_number), self.assertRaises(ValueError):
+                calculate_dynamic_price(seat_number, Decimal('150.00'), 100)
+        self.assertEqual(calculate_dynamic_price(100, Decimal('150.00'), 100), Decimal('150.00'))
+
+    def test_surge_tiers(self):
+        self.assertEqual(surge_multiplier(SeatMap(10, range(1, 7))), Decimal('1'))
+        self.assertEqual(surge_multiplier(SeatMap(10, range(1, 8))), Decimal('1.1'))
+        self.assertEqual(surge_multiplier(SeatMap(10, range(1, 10))), Decimal('1.25'))
+        self.assertEqual(category_prices(Decimal('99.99'), Decimal('1.1'))[0], Decimal('109.99'))
+
+    def test_reserved_tickets_are_priced_per_seat(self):
+        session = self.create_session(capacity=100)
+        user = User.objects.create_user('buyer')
+
+        order, _ = reserve_seats(user, session, [1, 45])
+
+        self.assertEqual(order.total_price, Decimal('375.00'))
+        self.assertEqual(dict(order.tickets.values_list('seat_number', 'price')),
+                         {1: Decimal('150.00'), 45: Decimal('225.00')})
+        self.assertEqual(seat_prices(session, [2]), {2: Decimal('150.00')})
+
+
+class SeatMapCacheTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = self.create_session(capacity=10)
+        self.user = User.objects.create_user('buyer')
+        self.url = reverse('available_seats', args=[self.session.slug])
+
+    def test_endpoint_served_from_cache(self):
+        self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.json()['available_seats'], list(range(1, 11)))
+
+    def test_unknown_session(self):
+        response = self.client.get(reverse('available_seats', args=['missing']))
+
+        self.assertEqual(response.status_code, 404)
+
+    @mock.patch('cinema_app.services.schedule_order_expiry')
+    @mock.patch('cinema_app.services.process_payment', return_value='https://checkout.stripe.test/pay')
+    def test_purchase_writes_through(self, process_payment, schedule_order_expiry):
+        refresh_seat_map(self.session)
+        request = RequestFactory().post('/', {'selected_seats': '[2, 3]'})
+        request.user = self.user
+
+        with self.captureOnCommitCallbacks(execute=True):
+            purchase_ticket_process(request, self.session)
+
+        self.assertEqual(get_cached_seat_map(self.session.slug).taken(), [2, 3])
+
+    def test_cancel_unpaid_orders_writes_through(self):
+        order = self.create_order(self.user, self.session, [4])
+        Order.objects.filter(pk=order.pk).update(created_at=now() - timedelta(minutes=30))
+        refresh_seat_map(self.session)
+
+        cancel_unpaid_orders()
+
+        self.assertTrue(get_cached_seat_map(self.session.slug).is_free(4))
+
+    def test_reconcile_fixes_drift(self):
+        refresh_seat_map(self.session)
+        self.create_order(self.user, self.session, [7])
+
+        reconcile_seat_maps()
+
+        self.assertEqual(get_cached_seat_map(self.session.slug).taken(), [7])
+
+
+@override_settings(SEAT_EVENTS_POLL_INTERVAL=0.01, SEAT_EVENTS_MAX_AGE=1)
+class SeatEventsTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = self.create_session(capacity=10)
+
+    def test_stream_pushes_seat_deltas(self):
+        seat_map = refresh_seat_map(self.session)
+
+        async def consume():
+            stream = stream_seat_events(self.session.slug, seat_map.copy())
+            events = [await anext(stream), await anext(stream)]
+
+            changed = seat_map.copy()
+            changed.take([3, 4])
+            await cache.aset(seat_map_cache_key(self.session.slug), changed.to_bytes())
+            events.append(await anext(stream))
+
+            changed.release([4])
+            await cache.aset(seat_map_cache_key(self.session.slug), changed.to_bytes())
+            events.append(await anext(stream))
+            await stream.aclose()
+            return events
+
+        retry, snapshot, reserved, cancelled = async_to_sync(consume)()
+
+        self.assertTrue(retry.startswith('retry: '))
+        self.assertIn('event: snapshot', snapshot)
+        self.assertEqual(reserved, 'event: seats\ndata: {"taken": [3, 4], "freed": []}\n\n')
+        self.assertEqual(cancelled, 'event: seats\ndata: {"taken": [], "freed": [4]}\n\n')
+
+    def test_streams_share_one_poller(self):
+        seat_map = refresh_seat_map(self.session)
+
+        async def consume():
+            streams = [stream_seat_events(self.session.slug, seat_map.copy(), user_id) for user_id in (1, 2, 3)]
+            for stream in streams:
+                await anext(stream), await anext(stream)
+            watched = [watcher.streams for watcher in _seat_watchers.values()]
+
+            changed = seat_map.copy()
+            changed.take([5])
+            with mock.patch.object(cache, 'aget_many', wraps=cache.aget_many) as aget_many:
+                await cache.aset(seat_map_cache_key(self.session.slug), changed.to_bytes())
+                events = [await anext(stream) for stream in streams]
+            for stream in streams:
+                await stream.aclose()
+            return watched, aget_many.call_count, events
+
+        watched, polls, events = async_to_sync(consume)()
+
+        self.assertEqual(watched, [3])
+        self.assertEqual(polls, 1)
+        self.assertEqual(events, ['event: seats\ndata: {"taken": [5], "freed": []}\n\n'] * 3)
+        self.assertEqual(_seat_watchers, {})
+
+    def test_endpoint(self):
+        response = async_to_sync(self.async_client.get)(reverse('seat_events', args=[self.session.slug]))
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(self.client.get(reverse('seat_events', args=['missing'])).status_code, 404)
+
+    def test_wsgi_gets_no_stream(self):
+        started = time_module.monotonic()
+        response = self.client.get(reverse('seat_events', args=[self.session.slug]))
+
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(response.streaming)
+        self.assertLess(time_module.monotonic() - started, settings.SEAT_EVENTS_POLL_INTERVAL)
+
+
+class ReserveSeatsTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        self.session = self.create_session(capacity=10)
+        self.user = User.objects.create_user('buyer')
+
+    def test_reserves_seats_in_one_order(self):
+        with self.assertNumQueries(6):  # occupancy, savepoint, order, tickets, session counters, release
+            order, conflicts = reserve_seats(self.user, self.session, [1, 2, 3])
+
+        self.assertEqual(conflicts, [])
+        self.assertEqual(order.total_price, Decimal('450.00'))
+        self.assertEqual(sorted(order.tickets.values_list('seat_number', flat=True)), [1, 2, 3])
+
+    def test_reports_conflicts_per_seat(self):
+        self.create_order(self.user, self.session, [2, 3])
+
+        order, conflicts = reserve_seats(self.user, self.session, [1, 2, 3, 11])
+
+        self.assertIsNone(order)
+        self.assertEqual(conflicts, [2, 3, 11])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_cancelled_seat_can_be_reserved_again(self):
+        self.create_order(self.user, self.session, [5], status=Ticket.CANCELLED)
+
+        order, conflicts = reserve_seats(self.user, self.session, [5])
+
+        self.assertEqual(conflicts, [])
+
+    def test_constraint_rejects_second_active_ticket(self):
+        order = self.create_order(self.user, self.session, [4])
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Ticket.objects.create(session=self.session, user=self.user, order=order, seat_number=4,
+                                  price=Decimal('150.00'))
+
+    def test_lost_race_is_reported_as_conflict(self):
+        # The occupancy check passes, but a concurrent checkout inserts seat 6 before our INSERT
+        stale = SeatMap(10)
+        self.create_order(self.user, self.session, [6])
+
+        with mock.patch.object(Session, 'get_seat_map', side_effect=[stale, SeatMap(10, [6])]):
+            order, conflicts = reserve_seats(self.user, self.session, [6, 7])
+
+        self.assertIsNone(order)
+        self.assertEqual(conflicts, [6])
+
+
+class DuplicateSeatMigrationTests(TransactionTestCase):
+    before = [('cinema_app', '0023_remove_order_stripe_session_id')]
+    after = [('cinema_app', '0024_ticket_unique_active_seat')]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_keeps_the_earliest_active_ticket_of_a_seat(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        hall = apps.get_model('cinema_app', 'Hall').objects.create(name='Hall', capacity=10)
+        movie = apps.get_model('cinema_app', 'Movie').objects.create(
+            title='Фільм', slug='film', description='Опис', duration=120, release_date=date(2024, 1, 1), age_limit=12,
+        )
+        session = apps.get_model('cinema_app', 'Session').objects.create(
+            hall=hall, movie=movie, slug='film-session', base_ticket_price=Decimal('150.00'),
+            session_date=date.today(), start_time=time(18, 0), end_time=time(20, 0),
+        )
+        user = apps.get_model('auth', 'User').objects.create(username='buyer')
+        order = apps.get_model('cinema_app', 'Order').objects.create(user=user, session=session, total_price=0)
+        HistoricalTicket = apps.get_model('cinema_app', 'Ticket')
+        first, second, third = (HistoricalTicket.objects.create(session=session, user=user, order=order, seat_number=3,
+                                                                price=Decimal('150.00'), status=status)
+                                for status in (Ticket.BOOKED, Ticket.RESERVED, Ticket.RESERVED))
+
+        executor = MigrationExecutor(connection)
+        with self.assertLogs('cinema_app.migrations', 'WARNING') as logs:
+            executor.migrate(self.after)
+
+        statuses = dict(HistoricalTicket.objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {first.id: Ticket.BOOKED, second.id: Ticket.CANCELLED, third.id: Ticket.CANCELLED})
+        self.assertIn('Cancelled 2 tickets', logs.output[0])
+
+
+class CheckoutTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        self.session = self.create_session(capacity=100)
+        self.user = User.objects.create_user('buyer')
+        self.order, _ = reserve_seats(self.user, self.session, [1, 2, 45])
+        self.request = RequestFactory().get('/')
+        self.stripe = StubStripe()
+
+    def test_line_items_grouped_by_price(self):
+        with self.assertNumQueries(2):  # tickets with session and movie, then the order update
+            url = process_payment(self.request, self.order, client=self.stripe)
+
+        params = self.stripe.created[0]
+        self.assertEqual(url, 'https://checkout.stripe.test/cs_test_1')
+        self.assertEqual([(item['price_data']['unit_amount'], item['quantity']) for item in params['line_items']],
+                         [(15000, 2), (22500, 1)])
+        self.assertEqual(params['success_url'], f'http://testserver/purchase_success/{self.order.id}/')
+        self.assertEqual(Order.objects.get(pk=self.order.pk).stripe_session_id, 'cs_test_1')
+
+    def test_stripe_errors_are_logged(self):
+        error = stripe.error.APIConnectionError('Network down')
+        with mock.patch.object(self.stripe.checkout.Session, 'create', side_effect=error), \
+                self.assertLogs('cinema_app.services', 'WARNING') as logs:
+            url = process_payment(self.request, self.order, client=self.stripe)
+
+        self.assertIsNone(url)
+        self.assertIn(f'Stripe checkout of order {self.order.id} failed', logs.output[0])
+        self.assertIn('Network down', logs.output[0])
+
+    def test_retry_reuses_open_session(self):
+        process_payment(self.request, self.order, client=self.stripe)
+
+        with self.assertNumQueries(0):
+            url = process_payment(self.request, self.order, client=self.stripe)
+
+        self.assertEqual(url, 'https://checkout.stripe.test/cs_test_1')
+        self.assertEqual(len(self.stripe.created), 1)
+
+        self.stripe.sessions['cs_test_1'].status = 'expired'
+        self.assertEqual(process_payment(self.request, self.order, client=self.stripe),
+                         'https://checkout.stripe.test/cs_test_2')
+
+    def test_retry_view_only_for_own_pending_orders(self):
+        other = User.objects.create_user('other')
+        self.client.force_login(other)
+
+        self.assertEqual(self.client.get(reverse('retry_payment', args=[self.order.id])).status_code, 404)
+
+        self.client.force_login(self.user)
+        with mock.patch('cinema_app.services.stripe.checkout', self.stripe.checkout):
+            response = self.client.get(reverse('retry_payment', args=[self.order.id]))
+        self.assertRedirects(response, 'https://checkout.stripe.test/cs_test_1', fetch_redirect_response=False)
+
+
+@mock.patch('cinema_app.services.schedule_order_expiry')
+class AsyncCheckoutViewTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = self.create_session(capacity=10)
+        self.user = User.objects.create_user('buyer')
+        self.client.force_login(self.user)
+        self.stripe = StubStripe()
+
+    def test_purchase_post_awaits_stripe(self, schedule_order_expiry):
+        with mock.patch('cinema_app.services.stripe.checkout', self.stripe.checkout):
+            response = self.client.post(reverse('purchase_ticket', args=[self.session.slug]),
+                                        {'selected_seats': '[5, 6]'})
+
+        self.assertRedirects(response, 'https://checkout.stripe.test/cs_test_1', fetch_redirect_response=False)
+        order = Order.objects.get()
+        self.assertEqual((order.status, order.stripe_session_id), (Order.PENDING, 'cs_test_1'))
+        self.assertEqual(self.stripe.created[0]['line_items'][0]['quantity'], 2)
+
+    def test_purchase_post_reports_conflicts(self, schedule_order_expiry):
+        self.create_order(self.user, self.session, [5])
+
+        response = self.client.post(reverse('purchase_ticket', args=[self.session.slug]),
+                                    {'selected_seats': '[5]'}, follow=True)
+
+        self.assertContains(response, 'Місця недоступні: 5')
+        self.assertEqual(self.stripe.created, [])
+
+
+@mock.patch('cinema_app.services.schedule_order_expiry')
+class TwoPhaseCheckoutTests(CinemaTestMixin, TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = self.create_session(capacity=10)
+        self.user = User.objects.create_user('buyer')
+        self.request = RequestFactory().post('/', {'selected_seats': '[3, 4]'})
+        self.request.user = self.user
+
+    def test_payment_session_created_after_commit(self, schedule_order_expiry):
+        stripe_client = StubStripe()
+        observed = {}
+
+        def create(**params):
+            # The reservation is visible and no transaction is open while Stripe is called
+            observed['in_atomic_block'] = connection.in_atomic_block
+            observed['reserved'] = get_cached_seat_map(self.session.slug).taken()
+            return StubStripe.create(stripe_client, **params)
+
+        stripe_client.checkout.Session.create = create
+        redirect_url, order_id = purchase_ticket_process(self.request, self.session, payment_client=stripe_client)
+
+        self.assertEqual(redirect_url, 'https://checkout.stripe.test/cs_test_1')
+        self.assertEqual(observed, {'in_atomic_block': False, 'reserved': [3, 4]})
+        self.assertEqual(Order.objects.get(pk=order_id).stripe_session_id, 'cs_test_1')
+
+    def test_failed_payment_cancels_reservation(self, schedule_order_expiry):
+        with mock.patch('cinema_app.services.process_payment', return_value=None):
+            result = purchase_ticket_process(self.request, self.session)
+
+        self.assertEqual(result, (False, 'Оплата не прошла. Спробуйте ще раз'))
+        self.assertEqual(Order.objects.get().status, Order.CANCELLED)
+        self.assertEqual(get_cached_seat_map(self.session.slug).taken(), [])
+
+
+@override_settings(SEAT_HOLD_TTL=60)
+class SeatHoldTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = self.create_session(capacity=10)
+        self.seat_map = refresh_seat_map(self.session)
+        self.user = User.objects.create_user('holder')
+        self.other = User.objects.create_user('other')
+        self.url = reverse('hold_seats', args=[self.session.slug])
+
+    def hold(self, user, body):
+        self.client.force_login(user)
+        return self.client.post(self.url, body, content_type='application/json')
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')  # as in settings_prod
+    def test_hold_does_not_write_to_database(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('available_seats', args=[self.session.slug]))
+
+        with self.assertNumQueries(1):  # user lookup only; the cached_db session comes from the cache
+            response = self.client.post(self.url, {'hold': [1, 2]}, content_type='application/json')
+
+        self.assertEqual(response.json()['held'], [1, 2])
+        self.assertEqual(get_seat_holds(self.session.slug, self.seat_map), {1: self.user.id, 2: self.user.id})
+
+    def test_held_seats_are_unavailable_to_others(self):
+        self.hold(self.user, {'hold': [3]})
+
+        response = self.hold(self.other, {'hold': [3, 4]})
+        available = self.client.get(reverse('available_seats', args=[self.session.slug])).json()['available_seats']
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['conflicts'], [3])
+        self.assertNotIn(3, available)
+        self.assertIn(4, available)
+        self.assertEqual(get_seat_holds(self.session.slug, self.seat_map), {3: self.user.id})
+
+    def test_release(self):
+        self.hold(self.user, {'hold': [5]})
+        self.hold(self.other, {'release': [5]})
+        self.assertEqual(get_seat_holds(self.session.slug, self.seat_map), {5: self.user.id})
+
+        self.hold(self.user, {'release': [5]})
+        self.assertEqual(get_seat_holds(self.session.slug, self.seat_map), {})
+
+    def test_hold_expires(self):
+        with override_settings(SEAT_HOLD_TTL=-1):
+            acquire_seat_holds(self.session.slug, self.user.id, [6], self.seat_map)
+
+        self.assertEqual(acquire_seat_holds(self.session.slug, self.other.id, [6], self.seat_map), [])
+
+    def test_holds_are_read_in_one_lookup(self):
+        acquire_seat_holds(self.session.slug, self.user.id, [2, 4], self.seat_map)
+        with override_settings(SEAT_HOLD_TTL=-1):
+            acquire_seat_holds(self.session.slug, self.other.id, [6], self.seat_map)
+
+        with mock.patch.object(cache, 'get_many') as get_many, mock.patch.object(cache, 'get', wraps=cache.get) as get:
+            holds = get_seat_holds(self.session.slug, self.seat_map)
+
+        self.assertEqual(holds, {2: self.user.id, 4: self.user.id})
+        get_many.assert_not_called()
+        self.assertEqual(get.call_count, 1)
+
+    @mock.patch('cinema_app.services.schedule_order_expiry')
+    @mock.patch('cinema_app.services.process_payment', return_value='https://checkout.stripe.test/pay')
+    def test_purchase_converts_holds(self, process_payment, schedule_order_expiry):
+        acquire_seat_holds(self.session.slug, self.user.id, [7, 8], self.seat_map)
+        acquire_seat_holds(self.session.slug, self.user.id, [9], self.seat_map)
+        request = RequestFactory().post('/', {'selected_seats': '[7, 8]'})
+        request.user = self.user
+
+        with self.captureOnCommitCallbacks(execute=True):
+            redirect_url, order_id = purchase_ticket_process(request, self.session)
+
+        self.assertEqual(redirect_url, 'https://checkout.stripe.test/pay')
+        self.assertEqual(get_seat_holds(self.session.slug, SeatMap(10)), {9: self.user.id})
+        self.assertEqual(seat_hold_metrics(), {'created': 3, 'converted': 2, 'conversion_rate': 0.6667})
+
+    def test_purchase_rejects_seats_held_by_others(self):
+        acquire_seat_holds(self.session.slug, self.other.id, [7], self.seat_map)
+        request = RequestFactory().post('/', {'selected_seats': '[7]'})
+        request.user = self.user
+
+        self.assertEqual(purchase_ticket_process(request, self.session), (False, 'Місця недоступні: 7'))
+        self.assertFalse(Order.objects.exists())
+
+
+class CancelUnpaidOrdersTests(CinemaTestMixin, TestCase):
+    def test_expires_stale_orders_in_batches(self):
+        session = self.create_session(capacity=10)
+        user = User.objects.create_user('buyer')
+        stale = [self.create_order(user, session, [seat]) for seat in (1, 2, 3)]
+        fresh = self.create_order(user, session, [4])
+        paid = self.create_order(user, session, [5], status=Ticket.BOOKED)
+        Order.objects.filter(pk=paid.pk).update(status=Order.COMPLETED)
+        Order.objects.exclude(pk=fresh.pk).update(created_at=now() - timedelta(minutes=20))
+
+        result = cancel_unpaid_orders(batch_size=2)
+
+        self.assertTrue(result.startswith('3 orders canceled in 2 batches'))
+        self.assertEqual(set(Order.objects.filter(status=Order.CANCELLED).values_list('id', flat=True)),
+                         {order.id for order in stale})
+        self.assertEqual(sorted(Ticket.objects.exclude(status=Ticket.CANCELLED).values_list('seat_number', flat=True)),
+                         [4, 5])
+
+
+class ExpireOrderTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        # As with a broker: without REDIS_URL the test settings run tasks eagerly
+        self.set_eager(False)
+        self.session = self.create_session(capacity=10)
+        self.user = User.objects.create_user('buyer')
+
+    @mock.patch('cinema_app.tasks.expire_order.apply_async')
+    @mock.patch('cinema_app.services.process_payment', return_value='https://checkout.stripe.test/pay')
+    def test_purchase_schedules_expiry_at_deadline(self, process_payment, apply_async):
+        request = RequestFactory().post('/', {'selected_seats': '[1]'})
+        request.user = self.user
+
+        with self.captureOnCommitCallbacks(execute=True):
+            _, order_id = purchase_ticket_process(request, self.session)
+
+        order = Order.objects.get(pk=order_id)
+        apply_async.assert_called_once_with(args=[order_id], eta=order.created_at + ORDER_EXPIRATION)
+
+    @mock.patch('cinema_app.tasks.expire_order.apply_async')
+    def test_seats_released_exactly_at_deadline(self, apply_async):
+        order = self.create_order(self.user, self.session, [2, 3])
+        refresh_seat_map(self.session)
+        deadline = order.created_at + ORDER_EXPIRATION
+
+        # An early delivery (e.g. clock skew between workers) reschedules instead of cancelling
+        with mock.patch('cinema_app.tasks.now', return_value=deadline - timedelta(seconds=1)):
+            expire_order(order.id)
+        apply_async.assert_called_once_with(args=[order.id], eta=deadline)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, Order.PENDING)
+
+        with mock.patch('cinema_app.tasks.now', return_value=deadline):
+            expire_order(order.id)
+
+        self.assertEqual(Order.objects.get(pk=order.pk).status, Order.CANCELLED)
+        self.assertEqual(get_cached_seat_map(self.session.slug).taken(), [])
+
+    def set_eager(self, eager):
+        # Celery reads its settings under the CELERY_ namespace, which wins over the plain task_always_eager
+        conf = expire_order.app.conf
+        self.addCleanup(conf.update, CELERY_TASK_ALWAYS_EAGER=conf.task_always_eager)
+        conf.update(CELERY_TASK_ALWAYS_EAGER=eager)
+
+    @mock.patch('cinema_app.tasks.expire_order.apply_async')
+    def test_eager_tasks_leave_expiry_to_the_sweep(self, apply_async):
+        order = self.create_order(self.user, self.session, [5])
+
+        self.set_eager(True)
+        schedule_order_expiry(order)
+        expire_order(order.id)
+
+        apply_async.assert_not_called()
+        self.assertEqual(Order.objects.get(pk=order.pk).status, Order.PENDING)
+
+    def test_paid_order_is_left_alone(self):
+        order = self.create_order(self.user, self.session, [4], status=Ticket.BOOKED)
+        Order.objects.filter(pk=order.pk).update(status=Order.COMPLETED, created_at=now() - timedelta(hours=1))
+
+        expire_order(order.id)
+
+        self.assertEqual(Ticket.objects.get(order=order).status, Ticket.BOOKED)
+
+
+# Maximum number of queries per listing view, whatever the number of rows.
+# Raise a budget only together with the change that needs the extra query.
+QUERY_BUDGETS = {
+    'movie_list': 4,  # count, page, genres of the page, genre filter options
+    'session_list': 2,  # cold cache: sessions, seat counters; a warm cache serves the schedule with none
+    'movie_session_list': 2,
+    'user_orders': 4,  # auth session, user, page of orders, their tickets
+}
+
+
+STRIPE_EVENT_FIXTURES = Path(__file__).parent / 'fixtures' / 'stripe_events'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+@mock.patch('cinema_app.tasks.process_stripe_events.delay', side_effect=lambda: process_stripe_events())
+class StripeWebhookTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = self.create_session(capacity=10)
+        self.user = User.objects.create_user('buyer')
+        self.order = self.create_order(self.user, self.session, [1, 2])
+
+    def replay(self, fixture, order, secret='whsec_test'):
+        # Recorded Stripe event, pointed at a local order and signed like Stripe does
+        event = json.loads((STRIPE_EVENT_FIXTURES / f'{fixture}.json').read_text())
+        event['data']['object']['client_reference_id'] = str(order.id)
+        payload = json.dumps(event)
+        timestamp = int(time_module.time())
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('stripe_webhook'), payload, content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}')
+
+    def test_completed_checkout_books_tickets_once(self, delay):
+        self.assertEqual(self.replay('checkout_session_completed', self.order).status_code, 200)
+        self.assertEqual(self.replay('checkout_session_completed', self.order).status_code, 200)
+
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, Order.COMPLETED)
+        self.assertEqual(set(self.order.tickets.values_list('status', flat=True)), {Ticket.BOOKED})
+
+    def test_expired_checkout_frees_seats(self, delay):
+        self.replay('checkout_session_expired', self.order)
+
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, Order.CANCELLED)
+        self.assertEqual(get_cached_seat_map(self.session.slug).taken(), [])
+
+    def test_rejects_bad_signature(self, delay):
+        response = self.replay('checkout_session_completed', self.order, secret='whsec_other')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_batch_finalises_with_constant_queries(self, delay):
+        def queries_for(order_count, first_seat):
+            orders = [self.create_order(self.user, self.session, [first_seat + i]) for i in range(order_count)]
+            StripeEvent.objects.bulk_create([
+                StripeEvent(event_id=f'evt_{order.id}', type=StripeEvent.CHECKOUT_COMPLETED, order_id=order.id,
+                            payment_status='paid')
+                for order in orders
+            ])
+            with CaptureQueriesContext(connection) as queries:
+                count, _ = process_stripe_events_batch(100)
+            self.assertEqual(count, order_count)
+            return len(queries)
+
+        self.assertEqual(queries_for(1, first_seat=3), queries_for(6, first_seat=4))
+
+    def test_success_page_checks_payment_status(self, delay):
+        stripe_client = StubStripe()
+        self.client.force_login(self.user)
+        process_payment(RequestFactory().get('/'), self.order, client=stripe_client)
+        url = reverse('success_purchase_url', args=[self.order.id])
+
+        with mock.patch('cinema_app.services.stripe.checkout', stripe_client.checkout):
+            stripe_client.sessions['cs_test_1'].payment_status = 'unpaid'
+            self.assertContains(self.client.get(url), 'Оплата ще обробляється')
+            self.assertEqual(Order.objects.get(pk=self.order.pk).status, Order.PENDING)
+
+            stripe_client.sessions['cs_test_1'].payment_status = 'paid'
+            self.assertNotContains(self.client.get(url), 'Оплата ще обробляється')
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, Order.COMPLETED)
+
+
+class QueryBudgetMixin:
+    def assertWithinQueryBudget(self, url_name, *args, query=None):
+        budget = QUERY_BUDGETS[url_name]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name, args=args), query)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{url_name} ran {len(queries)} queries, budget is {budget}:\n'
+            + '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+        return response
+
+
+class ListingQueryBudgetTests(QueryBudgetMixin, CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        genres = [Genre.objects.create(name=name) for name in ('Драма', 'Комедія', 'Фентезі')]
+        for i in range(6):
+            session = cls.create_session(capacity=20, start_time=time(10 + i, 0), original_name=f'Movie {i}')
+            session.movie.genre.set(genres[:i % 3 + 1])
+        cls.movie = session.movie
+        cls.genre = genres[0]
+
+    def test_movie_list(self):
+        response = self.assertWithinQueryBudget('movie_list')
+
+        self.assertContains(response, 'Комедія')
+
+    def test_movie_list_filtered_by_genre(self):
+        response = self.assertWithinQueryBudget('movie_list', query={'genre': [self.genre.id], 'page': 2})
+
+        self.assertEqual(response.context['paginator'].count, 6)
+
+    def test_session_list(self):
+        response = self.assertWithinQueryBudget('session_list')
+
+        self.assertEqual(len(response.context['session_list']), 6)
+
+    def test_movie_session_list(self):
+        response = self.assertWithinQueryBudget('movie_session_list', self.movie.slug)
+
+        self.assertContains(response, self.movie.title)
+
+
+class UserOrderListTests(QueryBudgetMixin, CinemaTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('regular')
+        cls.orders = []
+        for i in range(7):
+            session = cls.create_session(capacity=20, start_time=time(10 + i, 0), original_name=f'Movie {i}')
+            cls.orders.append(cls.create_order(cls.user, session, [i + 1, i + 2]))
+        # Two orders created in the same instant are still ordered by id
+        Order.objects.filter(pk__in=[cls.orders[2].pk, cls.orders[3].pk]).update(created_at=cls.orders[2].created_at)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_constant_query_count(self):
+        response = self.assertWithinQueryBudget('user_orders')
+
+        self.assertContains(response, '1, 2')
+
+    def test_keyset_pages(self):
+        seen = []
+        query = None
+        while True:
+            page = self.assertWithinQueryBudget('user_orders', query=query).context['page_obj']
+            seen.extend(order.id for order in page)
+            if not page.has_next():
+                break
+            query = {'after': page.next_cursor}
+
+        self.assertEqual(seen, [order.id for order in self.orders])
+
+        previous = self.client.get(reverse('user_orders'), {'before': page.previous_cursor}).context['page_obj']
+        self.assertEqual([order.id for order in previous], [order.id for order in self.orders[3:6]])
+
+    def test_pages_scan_the_user_index(self):
+        index = next(index for index in Order._meta.indexes if index.fields[0] == 'user')
+        paginator = KeysetPaginator(Order.objects.filter(user=self.user), 3)
+        # The keyset, either way round, is the index after its user column
+        self.assertEqual([field.lstrip('-') for field in index.fields[1:]], list(paginator.key))
+
+        if connection.vendor == 'sqlite':
+            cursor = paginator.encode_cursor(self.orders[2])
+            for queryset in (paginator.queryset, paginator.queryset.filter(paginator._beyond(
+                    paginator.decode_cursor(cursor), 'lt')).reverse()):
+                plan = queryset[:4].explain()
+                self.assertIn(f'USING INDEX {index.name}', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_malformed_cursor_gives_first_page(self):
+        page = self.client.get(reverse('user_orders'), {'after': 'garbage'}).context['page_obj']
+
+        self.assertEqual([order.id for order in page], [order.id for order in self.orders[:3]])
+
+
+class MovieSearchTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fellowship = self.create_movie('Володар перснів: Хранителі Персня',
+                                            'The Lord of the Rings: The Fellowship of the Ring')
+        self.king = self.create_movie('Володар перснів: Повернення короля',
+                                      'The Lord of the Rings: The Return of the King')
+        self.other = self.create_movie('Інтерстеллар', 'Interstellar', description='Подорож крізь кільця Сатурна')
+
+    @staticmethod
+    def create_movie(title, original_name, description='Фільм'):
+        return Movie.objects.create(title=title, original_name=original_name, description=description,
+                                    duration=120, release_date=date(2024, 1, 1), age_limit=12)
+
+    def search(self, query):
+        return list(search_movies(Movie.objects.all(), query))
+
+    def test_matches_ukrainian_and_english_titles(self):
+        self.assertEqual(self.search('повернення'), [self.king])
+        self.assertEqual(self.search('RETURN king'), [self.king])
+        self.assertEqual(self.search('lord rings'), [self.fellowship, self.king])
+
+    def test_prefix_and_ranking(self):
+        # Title hits outrank description hits
+        self.assertEqual(self.search('сатурн'), [self.other])
+        self.assertEqual(self.search('інтер'), [self.other])
+        self.assertEqual(self.search('неіснуючий'), [])
+
+    def test_index_follows_saves(self):
+        self.assertEqual(self.search('дюна'), [])
+
+        self.other.title = 'Дюна'
+        self.other.save()
+
+        self.assertEqual(self.search('дюна'), [self.other])
+
+    def test_movie_list_search(self):
+        response = self.client.get(reverse('movie_list'), {'search': 'короля'})
+
+        self.assertEqual(list(response.context['movie_list']), [self.king])
+
+    @skipUnless(connection.vendor == 'postgresql', 'prefix tsquery of the Postgres search')
+    def test_postgres_prefix_query(self):
+        self.assertEqual(prefix_tsquery("пов' & !ер_нен:ня"), 'пов:* & ер:* & нен:* & ня:*')
+        self.assertEqual(self.search('повер'), [self.king])
+        self.assertEqual(self.search('fellow'), [self.fellowship])
+        self.assertEqual(self.search('&|!'), [])
+
+    def test_index_weights(self):
+        index = MovieSearchIndex([
+            {'id': 1, 'title': 'Ring', 'original_name': '', 'description': ''},
+            {'id': 2, 'title': 'Other', 'original_name': '', 'description': 'ring ring'},
+        ])
+
+        self.assertEqual(index.search('ring'), [1, 2])
+
+
+class ScheduleCacheTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = self.create_session(capacity=20)
+        self.url = reverse('session_list')
+
+    def test_warm_cache_skips_queries(self):
+        self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+
+        self.assertContains(response, self.session.movie.title)
+
+    def test_session_changes_invalidate_their_date(self):
+        query = {'date': self.session.session_date.isoformat()}
+        hall = Hall.objects.create(name='Hall 30', capacity=30)
+        self.client.get(self.url, query)
+        self.client.get(self.url)
+
+        other_day = Session.objects.create(hall=hall, movie=self.session.movie, base_ticket_price=Decimal('100'),
+                                           session_date=date.today() + timedelta(days=3), start_time=time(12, 0))
+        with self.assertNumQueries(0):
+            self.client.get(self.url, query)
+        self.assertContains(self.client.get(self.url), 'Hall 30')
+
+        other_day.session_date = self.session.session_date
+        other_day.save()
+        self.assertContains(self.client.get(self.url, query), 'Hall 30')
+
+        other_day.delete()
+        self.assertNotContains(self.client.get(self.url, query), 'Hall 30')
+
+    def test_movie_changes_invalidate_schedule(self):
+        self.client.get(self.url)
+
+        self.session.movie.title = 'Нова назва'
+        self.session.movie.save()
+
+        self.assertContains(self.client.get(self.url), 'Нова назва')
+
+    def test_day_labels(self):
+        self.assertEqual(format_day_label(date(2024, 12, 2)), 'понеділок 02.12')
+        self.assertEqual(format_day_label(date(2024, 12, 6)), "п'ятниця 06.12")
+
+
+class FactoryTests(TestCase):
+    def test_ticket_factory_builds_a_consistent_order(self):
+        ticket = TicketFactory()
+
+        self.assertEqual(ticket.session, ticket.order.session)
+        self.assertEqual(ticket.user, ticket.order.user)
+        self.assertEqual(ticket.session.slug, generate_session_slug(ticket.session))
+
+    def test_ticket_seats_stay_within_the_hall(self):
+        TicketFactory.create_batch(5)
+        session = SessionFactory(hall__capacity=3)
+
+        seats = {TicketFactory(order__session=session).seat_number for _ in range(3)}
+
+        self.assertEqual(seats, {1, 2, 3})
+
+    def test_prepare_session_matches_save(self):
+        saved = SessionFactory(start_time=time(22, 0))
+        built = prepare_session(SessionFactory.build(movie=saved.movie, session_date=saved.session_date,
+                                                     start_time=saved.start_time))
+
+        self.assertEqual((built.slug, built.end_time), (saved.slug, saved.end_time))
+
+
+def poster_upload(width=400, height=600, color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='JPEG')
+    return SimpleUploadedFile('poster.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class PosterVariantTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.movie = Movie.objects.create(title='Фільм', original_name='Poster movie', description='Опис',
+                                          duration=120, release_date=date(2024, 1, 1), age_limit=12)
+
+    def upload(self, **kwargs):
+        # With the broker unreachable the variants are built inline after the commit
+        with mock.patch('cinema_app.tasks.generate_movie_poster_variants.delay', side_effect=KombuOperationalError), \
+                self.assertLogs('cinema_app.posters', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            self.movie.poster = poster_upload(**kwargs)
+            self.movie.save()
+        self.movie.refresh_from_db()
+        return self.movie.poster_variants
+
+    def test_variants_built_when_a_poster_is_saved(self):
+        variants = self.upload()
+
+        self.assertEqual(variants['source'], self.movie.poster.name)
+        self.assertEqual((variants['width'], variants['height']), (400, 600))
+        self.assertEqual(sorted(variants['formats']['webp']), ['160', '320'])
+        path = variants['formats']['webp']['320']
+        self.assertEqual(path, f"posters/variants/poster-movie-{variants['digest']}-320w.webp")
+        with default_storage.open(path) as file:
+            self.assertEqual(Image.open(file).size, (320, 480))
+
+    def test_new_poster_replaces_old_variants(self):
+        old = self.upload()
+        new = self.upload(color='blue')
+
+        self.assertNotEqual(old['digest'], new['digest'])
+        self.assertFalse(default_storage.exists(old['formats']['jpeg']['160']))
+        self.assertTrue(default_storage.exists(new['formats']['jpeg']['160']))
+
+    def test_picture_tag(self):
+        template = Template('{% load posters %}{% poster_picture movie sizes="150px" %}')
+        self.movie.poster = poster_upload()
+        self.movie.save()
+
+        # Until the variants exist the original is served
+        self.assertIn(f'<img src="{self.movie.poster.url}"', template.render(Context({'movie': self.movie})))
+
+        self.upload()
+        html = template.render(Context({'movie': self.movie}))
+        self.assertIn('<source type="image/webp" srcset="/media/posters/variants/', html)
+        self.assertIn('-320w.webp 320w" sizes="150px">', html)
+        self.assertIn('width="400" height="600"', html)
+
+    def test_backfill_command(self):
+        self.upload()
+        Movie.objects.filter(pk=self.movie.pk).update(poster_variants={})
+
+        call_command('backfill_poster_variants', stdout=io.StringIO())
+        self.movie.refresh_from_db()
+        self.assertIn('webp', self.movie.poster_variants['formats'])
+
+        output = io.StringIO()
+        call_command('backfill_poster_variants', stdout=output)
+        self.assertIn('0 movies generated, 1 up to date', output.getvalue())
+
+
+class SessionStatsTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.session = self.create_session(capacity=10)
+        self.user = User.objects.create_user('buyer')
+
+    def counters(self, session=None):
+        stats = SessionStats.objects.get(session=session or self.session)
+        return stats.booked, stats.reserved, stats.available, stats.revenue
+
+    def test_created_with_the_session_and_follows_the_hall(self):
+        self.assertEqual(self.counters(), (0, 0, 10, 0))
+
+        self.session.hall.capacity = 12
+        self.session.hall.save()
+        self.assertEqual(self.counters(), (0, 0, 12, 0))
+
+    def test_maintained_through_reservation_payment_and_expiry(self):
+        paid, _ = reserve_seats(self.user, self.session, [1, 2])
+        unpaid, _ = reserve_seats(self.user, self.session, [3])
+        self.assertEqual(self.counters(), (0, 3, 7, 0))
+
+        complete_paid_order(paid)
+        self.assertEqual(self.counters(), (2, 1, 7, Decimal('300.00')))
+
+        Order.objects.filter(pk=unpaid.pk).update(created_at=now() - timedelta(minutes=20))
+        cancel_unpaid_orders()
+        self.assertEqual(self.counters(), (2, 0, 8, Decimal('300.00')))
+        self.assertEqual(rebuild_session_stats(), (1, 0))
+
+    def test_rebuild_corrects_drift(self):
+        self.create_order(self.user, self.session, [1, 2], status=Ticket.BOOKED)
+        SessionStats.objects.filter(session=self.session).delete()
+        other = self.create_session(capacity=20, days_ahead=2, original_name='Other movie')
+
+        output = io.StringIO()
+        call_command('rebuild_session_stats', stdout=output)
+
+        self.assertIn('2 sessions checked, 1 corrected', output.getvalue())
+        self.assertEqual(self.counters(), (2, 0, 8, Decimal('300.00')))
+        self.assertEqual(self.counters(other), (0, 0, 20, 0))
+
+    def test_session_list_shows_and_sorts_by_availability(self):
+        full = self.create_session(capacity=2, start_time=time(12, 0), original_name='Full house')
+        self.create_order(self.user, full, [1, 2])
+        rebuild_session_stats([full.id])
+
+        with self.assertNumQueries(2):  # sessions, seat counters
+            response = self.client.get(reverse('session_list'), {'sort': 'availability'})
+
+        self.assertEqual(list(response.context['session_list']), [self.session, full])
+        self.assertContains(response, f'"{full.slug}": {{"available": 0, "capacity": 2}}')
+        self.assertContains(response, f'"{self.session.slug}": {{"available": 10, "capacity": 10}}')
+
+    def test_ticket_changes_refresh_only_the_counters(self):
+        self.client.get(reverse('session_list'))
+        self.client.get(reverse('session_list'), {'sort': 'availability'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_seats(self.user, self.session, [1, 2])
+
+        with self.assertNumQueries(1):  # the list stays cached
+            response = self.client.get(reverse('session_list'))
+        self.assertContains(response, '"available": 8, "capacity": 10')
+        with self.assertNumQueries(2):  # the order may have changed
+            self.client.get(reverse('session_list'), {'sort': 'availability'})
+
+
+class HallScheduleTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        self.session = self.create_session(start_time=time(18, 0))  # 120 minutes plus the break: until 20:15
+        self.hall, self.movie = self.session.hall, self.session.movie
+
+    def new_session(self, start_time, days_ahead=1, movie=None):
+        return Session(hall=self.hall, movie=movie or self.movie, base_ticket_price=Decimal('100'),
+                       session_date=date.today() + timedelta(days=days_ahead), start_time=start_time)
+
+    def test_overlapping_session_is_rejected(self):
+        with self.assertRaisesMessage(ValidationError, 'Hall 40 is taken from'):
+            self.new_session(time(19, 0)).save()
+
+        self.new_session(time(20, 15)).save()
+
+    def test_editing_a_session_does_not_conflict_with_itself(self):
+        self.session.start_time = time(18, 30)
+        self.session.save()
+
+    def test_session_running_past_midnight(self):
+        epic = Movie.objects.create(title='Епопея', original_name='Epic', description='-', duration=800,
+                                    release_date=date(2024, 1, 1), age_limit=0)
+        self.new_session(time(22, 0), movie=epic).save()  # until 11:35 the next day
+
+        with self.assertRaises(ValidationError):
+            self.new_session(time(11, 0), days_ahead=2).save()
+        self.new_session(time(11, 35), days_ahead=2).save()
+
+    def test_batch_validation_in_one_query(self):
+        halls = [Hall.objects.create(name=f'Import {i}', capacity=50) for i in range(50)]
+        batch = [Session(hall=hall, movie=self.movie, base_ticket_price=Decimal('100'),
+                         session_date=date.today() + timedelta(days=day), start_time=time(hour, 0))
+                 for hall in halls for day in (1, 2) for hour in (10, 13, 16)]
+        clash = self.new_session(time(17, 0))
+        double = Session(hall=halls[0], movie=self.movie, base_ticket_price=Decimal('100'),
+                         session_date=batch[0].session_date, start_time=time(11, 0))
+        batch += [clash, double]
+
+        with self.assertNumQueries(1):
+            conflicts = find_conflicts(batch)
+
+        # The 11:00 one runs into both the 10:00 and the 13:00 sessions of its hall
+        self.assertEqual(len(conflicts), 3)
+        self.assertIn((clash, self.session), conflicts)
+        self.assertIn((double, batch[0]), conflicts)
+        self.assertIn((batch[1], double), conflicts)
+        with self.assertRaises(ValidationError):
+            validate_schedule(batch[:-2] + [double], scheduled=[])
+
+
+class TimetableTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        self.session = self.create_session(start_time=time(18, 0))
+        self.hall, self.movie = self.session.hall, self.session.movie
+        self.first_date = date.today() + timedelta(days=2)
+
+    def test_recurring_schedule_is_bulk_inserted(self):
+        halls = [Hall.objects.create(name=f'Multiplex {i}', capacity=60) for i in range(8)]
+        sessions = recurring_sessions(self.movie, halls[:1], self.first_date, self.first_date + timedelta(days=29),
+                                      [time(10, 0), time(13, 0), time(16, 0), time(19, 0)], Decimal('120'))
+        for hall in halls[1:]:
+            sessions += recurring_sessions(self.movie, [hall], self.first_date, self.first_date + timedelta(days=29),
+                                           [time(10, 30 + hall.pk % 20)], Decimal('120'))
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            created = schedule_sessions(sessions)
+
+        self.assertEqual(len(created), 30 * 4 + 7 * 30)
+        self.assertLess(len(queries), 15)
+        first = Session.objects.get(hall=halls[0], session_date=self.first_date, start_time=time(10, 0))
+        self.assertEqual(first.end_time, time(12, 15))
+        self.assertEqual(first.slug, generate_session_slug(first))
+        self.assertEqual(SessionStats.objects.get(session=first).available, 60)
+        self.assertEqual(SessionStats.objects.filter(session__in=created).count(), len(created))
+
+    def test_recurrence_on_weekdays(self):
+        sessions = recurring_sessions(self.movie, [self.hall], self.first_date, self.first_date + timedelta(days=13),
+                                      [time(10, 0)], Decimal('120'), weekdays={5, 6})
+        self.assertEqual(len(sessions), 4)
+        self.assertTrue(all(session.session_date.weekday() >= 5 for session in sessions))
+
+    def test_invalid_sessions_insert_nothing(self):
+        sessions = [
+            Session(hall=self.hall, movie=self.movie, base_ticket_price=Decimal('100'),
+                    session_date=self.session.session_date, start_time=time(17, 0)),  # overlaps the 18:00 one
+            Session(hall=self.hall, movie=self.movie, base_ticket_price=Decimal('0'),
+                    session_date=self.first_date, start_time=time(10, 0)),
+            Session(hall=self.hall, movie=self.movie, base_ticket_price=Decimal('100'),
+                    session_date=self.first_date, start_time=time(14, 0)),
+        ]
+        with self.assertRaises(ValidationError) as raised:
+            schedule_sessions(sessions)
+
+        self.assertEqual(len(raised.exception.messages), 2)
+        self.assertEqual(Session.objects.count(), 1)
+
+    def test_timetable_rows(self):
+        timetable = io.StringIO(
+            'hall,movie,date,start_time,price\n'
+            f'{self.hall.name},{self.movie.slug},{self.first_date},10:00,150\n'
+            f'{self.hall.pk},{self.movie.slug},{self.first_date},13:00,150.50\n'
+        )
+        sessions = timetable_sessions(read_timetable(timetable, 'csv'))
+        self.assertEqual([(session.hall, session.start_time, session.base_ticket_price) for session in sessions],
+                         [(self.hall, time(10, 0), Decimal('150')), (self.hall, time(13, 0), Decimal('150.50'))])
+
+        rows = [{'hall': 'Nowhere', 'movie': self.movie.slug, 'date': str(self.first_date), 'start_time': '10:00',
+                 'price': 150},
+                {'hall': self.hall.pk, 'movie': 'unknown', 'date': str(self.first_date), 'start_time': '10:00',
+                 'price': 150},
+                {'hall': self.hall.pk, 'movie': self.movie.slug, 'date': 'tomorrow', 'start_time': '10:00',
+                 'price': 150}]
+        with self.assertRaises(ValidationError) as raised:
+            timetable_sessions(rows)
+        self.assertEqual([message.split(':')[0] for message in raised.exception.messages], ['Row 1', 'Row 2', 'Row 3'])
+
+    def test_import_schedule_command(self):
+        rows = [{'hall': self.hall.pk, 'movie': self.movie.slug, 'date': str(self.first_date), 'start_time': '10:00',
+                 'price': '150'}]
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'timetable.json'
+            path.write_text(json.dumps(rows))
+
+            call_command('import_schedule', str(path), '--dry-run', stdout=io.StringIO())
+            self.assertEqual(Session.objects.count(), 1)
+            call_command('import_schedule', str(path), stdout=io.StringIO())
+            self.assertEqual(Session.objects.count(), 2)
+
+        out = io.StringIO()
+        call_command('import_schedule', '--movie', self.movie.slug, '--hall', str(self.hall.pk),
+                     '--from', str(self.first_date + timedelta(days=1)), '--to', str(self.first_date + timedelta(days=2)),
+                     '--times', '10:00', '13:00', '--price', '150', stdout=out)
+        self.assertIn('4 sessions scheduled', out.getvalue())
+
+
+class ReadApiTests(CinemaTestMixin, TestCase):
+    def setUp(self):
+        self.session = self.create_session(capacity=30)
+        self.movie = self.session.movie
+        self.movie.genre.add(Genre.objects.create(name='Драма'), Genre.objects.create(name='Комедія'))
+        for i in range(3):
+            Movie.objects.create(title=f'Фільм {i}', original_name=f'Movie {i}', description='-', duration=90,
+                                 release_date=date(2023, 1, i + 1), age_limit=0).genre.add(Genre.objects.first())
+
+    def test_movie_list_is_cursor_paginated_without_n_plus_one(self):
+        with self.assertNumQueries(2):  # movies and their genres
+            response = self.client.get(reverse('api-movie-list'), {'page_size': 2})
+        data = response.json()
+        self.assertEqual([movie['slug'] for movie in data['results']], ['movie', 'movie-2'])
+        self.assertEqual(data['results'][0]['genres'], ['Драма', 'Комедія'])
+        self.assertIsNone(data['previous'])
+
+        data = self.client.get(data['next']).json()
+        self.assertEqual([movie['slug'] for movie in data['results']], ['movie-1', 'movie-0'])
+        self.assertIsNone(data['next'])
+
+    def test_sparse_fieldsets(self):
+        with self.assertNumQueries(1):  # genres are not asked for, so not prefetched
+            response = self.client.get(reverse('api-movie-list'), {'fields': 'slug,title'})
+        self.assertEqual(response.json()['results'][0], {'slug': 'movie', 'title': 'Фільм'})
+
+        response = self.client.get(reverse('api-movie-list'), {'fields': 'slug,budget'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_listing_is_not_modified(self):
+        url = reverse('api-movie-list')
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.movie.title = 'Нова назва'
+        self.movie.save()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_sessions_by_date(self):
+        url = reverse('api-session-list')
+        other_day = self.create_session(capacity=50, days_ahead=2, original_name='Other movie')
+        etag = self.client.get(url, {'date': self.session.session_date})['ETag']
+
+        with self.assertNumQueries(1):
+            data = self.client.get(url, {'date': self.session.session_date}).json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(data['results'][0], {
+            'slug': self.session.slug,
+            'movie': {'slug': 'movie', 'title': 'Фільм', 'duration': 120, 'age_limit': 12},
+            'hall': {'id': self.session.hall_id, 'name': 'Hall 30'},
+            'session_date': self.session.session_date.isoformat(), 'start_time': '18:00:00', 'end_time': '20:15:00',
+            'base_ticket_price': '150.00', 'capacity': 30, 'available': 30,
+        })
+
+        # Another day's changes leave this day's listing as it is, its own tickets do not
+        other_day.base_ticket_price = Decimal('90')
+        other_day.save()
+        response = self.client.get(url, {'date': self.session.session_date}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # Ticket sales only change the listings with the seat counters
+        fields = {'date': self.session.session_date, 'fields': 'slug,start_time'}
+        fields_etag = self.client.get(url, fields)['ETag']
+        user = User.objects.create_user(username='viewer', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_seats(user, self.session, [1, 2])
+        self.assertEqual(self.client.get(url, fields, headers={'If-None-Match': fields_etag}).status_code, 304)
+        response = self.client.get(url, {'date': self.session.session_date}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['available'], 28)
+
+        self.assertEqual(self.client.get(url, {'date': '2025-02-30'}).status_code, 400)
+
+    def test_session_seats(self):
+        url = reverse('api-session-seats', kwargs={'slug': self.session.slug})
+        response = self.client.get(url)
+        data = response.json()
+        self.assertEqual(data['available'], 30)
+        self.assertEqual(data['rows'], [10, 10, 10])
+        self.assertEqual(set(data['prices']), set(HallLayout.CATEGORIES))
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': response['ETag']}).status_code, 304)
+
+        user = User.objects.create_user(username='viewer', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_seats(user, self.session, [1])
+        refresh_seat_map(self.session)
+        response = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['available'], 29)
+
+    def test_schema(self):
+        response = self.client.get(reverse('api_schema'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'/api/v1/sessions/{slug}/seats/', response.content)
@@ -0,0 +1,166 @@
+"""
+Bulk scheduling of sessions.
+
+Session.save() handles one session at a time: it loads the movie for the slug
+and end time and checks the hall schedule with a query per row. Here whole
+timetables, from recurrence rules or a CSV/JSON file, are built in memory,
+validated together (one query for the hall conflicts, see
+cinema_app.scheduling) and inserted with bulk_create. bulk_create skips
+save() and post_save, so the counters and the cached schedule are updated
+here instead.
+"""
+import csv
+import json
+from datetime import date, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import Hall, Movie, Session
+from .schedule import invalidate_schedule
+from .scheduling import describe_conflict, find_conflicts, session_interval
+from .session_stats import create_bulk_session_stats
+from .utils import generate_session_slug
+
+BATCH_SIZE = 1000
+# Columns of a CSV timetable, or keys of each object of a JSON one; hall is a hall id or name, movie a movie slug
+TIMETABLE_FIELDS = ('hall', 'movie', 'date', 'start_time', 'price')
+
+
+def prepare_session(session):
+    """What Session.save() would set, for sessions inserted with bulk_create."""
+    session.end_time = session_interval(session).end.time()
+    session.slug = generate_session_slug(session)
+    return session
+
+
+def recurring_sessions(movie, halls, first_date, last_date, start_times, price, weekdays=None):
+    """
+    Unsaved sessions of ``movie`` in each of ``halls`` at each of
+    ``start_times`` on every day from ``first_date`` to ``last_date``, or only
+    on ``weekdays`` of them (0 is Monday).
+    """
+    sessions = []
+    day = first_date
+    while day <= last_date:
+        if weekdays is None or day.weekday() in weekdays:
+            sessions.extend(Session(hall=hall, movie=movie, base_ticket_price=price, session_date=day,
+                                    start_time=start_time)
+                            for hall in halls for start_time in start_times)
+        day += timedelta(days=1)
+    return sessions
+
+
+def read_timetable(file, file_format):
+    """Rows of a CSV timetable with a header line or of a JSON list of objects, as dicts."""
+    if file_format == 'csv':
+        return list(csv.DictReader(file))
+    if file_format == 'json':
+        rows = json.load(file)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValidationError('A JSON timetable must be a list of objects.')
+        return rows
+    raise ValidationError(f'Unknown timetable format: {file_format}.')
+
+
+def timetable_sessions(rows):
+    """
+    Unsaved sessions of timetable rows (see TIMETABLE_FIELDS). Halls and
+    movies are looked up with one query each; every invalid row is reported
+    in the ValidationError, numbered from 1.
+    """
+    hall_keys = {str(row.get('hall', '')).strip() for row in rows}
+    movie_slugs = {str(row.get('movie', '')).strip() for row in rows}
+    halls_by_id, halls_by_name = {}, {}
+    for hall in Hall.objects.filter(pk__in=[key for key in hall_keys if key.isdigit()]):
+        halls_by_id[str(hall.pk)] = hall
+    for hall in Hall.objects.filter(name__in=hall_keys):
+        halls_by_name.setdefault(hall.name, []).append(hall)
+    movies = Movie.objects.filter(slug__in=movie_slugs).only('slug', 'title', 'original_name', 'duration')
+    movies = {movie.slug: movie for movie in movies}
+
+    sessions, errors = [], []
+    for number, row in enumerate(rows, 1):
+        missing = [field for field in TIMETABLE_FIELDS if not str(row.get(field) or '').strip()]
+        if missing:
+            errors.append(f'Row {number}: missing {", ".join(missing)}.')
+            continue
+        hall_key, movie_slug = str(row['hall']).strip(), str(row['movie']).strip()
+        hall = halls_by_id.get(hall_key)
+        if hall is None:
+            named = halls_by_name.get(hall_key, [])
+            if len(named) != 1:
+                errors.append(f'Row {number}: {"several halls are" if named else "no hall is"} called {hall_key}.')
+                continue
+            hall = named[0]
+        movie = movies.get(movie_slug)
+        if movie is None:
+            errors.append(f'Row {number}: unknown movie {movie_slug}.')
+            continue
+        try:
+            session_date = date.fromisoformat(str(row['date']).strip())
+            start_time = time.fromisoformat(str(row['start_time']).strip())
+            price = Decimal(str(row['price']).strip())
+        except (ValueError, InvalidOperation):
+            errors.append(f'Row {number}: expected the date as YYYY-MM-DD, the start time as HH:MM '
+                          f'and a numeric price.')
+            continue
+        sessions.append(Session(hall=hall, movie=movie, base_ticket_price=price, session_date=session_date,
+                                start_time=start_time))
+    if errors:
+        raise ValidationError(errors)
+    return sessions
+
+
+def validate_sessions(sessions):
+    """
+    Everything Session.save() would check for each of ``sessions``, for all
+    of them at once: the field rules of Session.clean_values, free halls
+    (against each other and the saved schedule) and unique slugs. Raises a
+    ValidationError listing every problem. ``sessions`` need their
+    ``hall`` and ``movie`` set and must have gone through prepare_session.
+    """
+    errors = []
+    for session in sessions:
+        try:
+            session.clean_values()
+        except ValidationError as e:
+            errors.extend(f'{session}: {message}' for message in e.messages)
+
+    errors.extend(describe_conflict(session, other) for session, other in find_conflicts(sessions))
+
+    # The slug has no hall in it, so the same movie cannot start at the same time in two halls
+    slugs = {}
+    for session in sessions:
+        if session.slug in slugs:
+            errors.append(f'{session.movie.title} starts at {session.session_date:%d.%m} {session.start_time:%H:%M} '
+                          f'in both {slugs[session.slug].hall} and {session.hall}.')
+        slugs[session.slug] = session
+    slug_list = list(slugs)
+    for offset in range(0, len(slug_list), BATCH_SIZE):
+        taken = Session.objects.filter(slug__in=slug_list[offset:offset + BATCH_SIZE]).values_list('slug', flat=True)
+        errors.extend(f'{slugs[slug]}: another session of {slugs[slug].movie.title} already starts then.'
+                      for slug in taken)
+    if errors:
+        raise ValidationError(errors)
+
+
+def schedule_sessions(sessions, batch_size=BATCH_SIZE):
+    """
+    Validate ``sessions`` (see validate_sessions) and insert them all, or none
+    when any of them is invalid. Returns the created sessions.
+    """
+    sessions = [prepare_session(session) for session in sessions]
+    if not sessions:
+        return []
+    with transaction.atomic():
+        # Like Session.save(), keep the halls' schedules from changing between the check and the insert
+        list(Hall.objects.select_for_update().filter(pk__in={session.hall_id for session in sessions})
+             .values_list('pk', flat=True))
+        validate_sessions(sessions)
+        created = Session.objects.bulk_create(sessions, batch_size=batch_size)
+        create_bulk_session_stats(created)
+        session_dates = {session.session_date for session in created}
+        transaction.on_commit(lambda: invalidate_schedule(*session_dates))
+    return created
@@ -14,16 +14,30 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.apps import apps
 from django.urls import path, include
 from cinema_app import custom_auth_views, views, user_profile_views, services
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
+from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
+from rest_framework.routers import DefaultRouter
+
+from cinema_app import api
+
+api_router = DefaultRouter()
+api_router.register('movies', api.MovieViewSet, basename='api-movie')
+api_router.register('genres', api.GenreViewSet, basename='api-genre')
+api_router.register('halls', api.HallViewSet, basename='api-hall')
+api_router.register('sessions', api.SessionViewSet, basename='api-session')
 
 
 urlpatterns = [
     # Main views
     path('', views.redirect_to_home),
+    path('healthz/', views.healthz, name='healthz'),
+    path('readyz/', views.readyz, name='readyz'),
+    path('metrics/', views.metrics, name='metrics'),
     path('home/', views.HomePageView.as_view(), name='home'),
     path('movies/', views.MovieListView.as_view(), name='movie_list'),
     path('movies/<slug:slug>/', views.MovieDetailView.as_view(), name='movie_detail'),
@@ -40,8 +54,16 @@ urlpatterns = [
     path('purchase_success/<int:order_id>/', views.purchase_success, name='success_purchase_url'),
     path('purchase_cancel/<int:order_id>/', views.purchase_cancel, name='cancel_purchase_url'),
     path('session/<slug:session_slug>/available_seats/', views.get_available_seats, name='available_seats'),
+    path('session/<slug:session_slug>/seat_events/', views.seat_events, name='seat_events'),
+    path('session/<slug:session_slug>/hold_seats/', views.hold_seats, name='hold_seats'),
     # Payment
     path('retry_purchase/order/<int:pk>', views.retry_payment, name='retry_payment'),
+    path('stripe/webhook/', views.stripe_webhook, name='stripe_webhook'),
+
+    # Read-only REST API
+    path('api/v1/', include(api_router.urls)),
+    path('api/v1/schema/', SpectacularAPIView.as_view(), name='api_schema'),
+    path('api/v1/docs/', SpectacularSwaggerView.as_view(url_name='api_schema'), name='api_docs'),
 
     # Authentication paths
     path('social-auth/', include('social_django.urls', namespace='social')),
@@ -65,6 +87,8 @@ urlpatterns = [
 # Static files (only in DEBUG mode)
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Installed by the development settings only
+if apps.is_installed('debug_toolbar'):
     urlpatterns += [
         path('__debug__/', include('debug_toolbar.urls')),
     ]
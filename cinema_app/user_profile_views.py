@@ -1,10 +1,12 @@
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import Prefetch
 from django.urls import reverse_lazy
 from django.views.generic import ListView, TemplateView, UpdateView
 
 from .forms import ProfileUpdateForm
 from .models import *
+from .pagination import KeysetPaginator
 
 
 class UserProfileView(LoginRequiredMixin, TemplateView):
@@ -34,10 +36,21 @@ class UserProfileSettingsView(LoginRequiredMixin, UpdateView):
         return super().form_invalid(form)
 
 
-class UserOrderListView(ListView):
+class UserOrderListView(LoginRequiredMixin, ListView):
     model = Order
     template_name = 'profile/order_list.html'
     paginate_by = 3
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).order_by('created_at')
+        # Sessions, movies and halls are joined and seat numbers prefetched, so a page costs two queries
+        tickets = Ticket.objects.only('order', 'seat_number').order_by('seat_number')
+        return (Order.objects.filter(user=self.request.user)
+                .select_related('session__movie', 'session__hall')
+                .prefetch_related(Prefetch('tickets', queryset=tickets)))
+
+    def paginate_queryset(self, queryset, page_size):
+        page = KeysetPaginator(queryset, page_size).page(
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+        )
+        return None, page, page.object_list, page.has_other_pages()
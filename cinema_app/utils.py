@@ -1,6 +1,9 @@
 from django.utils.text import slugify
 from decimal import Decimal
 
+from .pricing import price_vector
+from .seats import cached_hall_layout
+
 
 def poster_upload_to(instance, filename):
     slug = slugify(instance.original_name)
@@ -15,23 +18,21 @@ def generate_session_slug(instance):
     return f"{film_title_slug}-{session_date_str}-{start_time_str}"
 
 
-def calculate_dynamic_price(seat_number, base_price, hall_capacity):
-    if seat_number is None or base_price is None or hall_capacity is None:
-        raise ValueError("seat_number, base_price, and hall_capacity must not be None.")
+# Weekday names as strftime('%A') gives them under the uk_UA locale, without depending on the process locale
+UKRAINIAN_WEEKDAYS = ('понеділок', 'вівторок', 'середа', 'четвер', "п'ятниця", 'субота', 'неділя')
 
-    total_rows = hall_capacity // 10
-    total_seats_in_row = 10
-    row = (seat_number - 1) // total_seats_in_row + 1
 
-    if base_price <= 0:
-        raise ValueError("Base price must be greater than 0.")
+def format_day_label(day):
+    return f'{UKRAINIAN_WEEKDAYS[day.weekday()]} {day:%d.%m}'
 
-    center_rows = range(total_rows // 2 - 1, total_rows // 2 + 1)
-    center_seats = range(total_seats_in_row // 2 - 3, total_seats_in_row // 2 + 4)
 
-    if row in center_rows and seat_number in center_seats:
-        return float(base_price * Decimal('1.5'))
-    elif row in center_rows:
-        return float(base_price * Decimal('1.2'))
+def calculate_dynamic_price(seat_number, base_price, hall_capacity, seats_per_row=10):
+    """Price of one seat without demand surge; see cinema_app.pricing for whole halls."""
+    if seat_number is None or base_price is None or hall_capacity is None:
+        raise ValueError("seat_number, base_price, and hall_capacity must not be None.")
+    if base_price <= 0:
+        raise ValueError("Base price must be greater than 0.")
+    if not 1 <= seat_number <= hall_capacity:
+        raise ValueError(f"Seat number must be between 1 and {hall_capacity}.")
 
-    return float(base_price)
\ No newline at end of file
+    return price_vector(cached_hall_layout(hall_capacity, seats_per_row), Decimal(base_price))[seat_number]
@@ -1,22 +1,72 @@
-import locale
+import hmac
+import json
 
+import stripe
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from django.shortcuts import render, get_object_or_404, redirect
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, Http404, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render, get_object_or_404, redirect
 from django.utils.dateparse import parse_date
+from django.utils.functional import SimpleLazyObject
 from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.views.generic import ListView, TemplateView, DetailView
-from cinema import settings
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
 from .models import *
-from django.db.models import Q
-from .services import purchase_ticket_process, process_payment
+from django.db.models import F, Prefetch
+from .instrumentation import render_metrics
+from .pricing import session_category_prices
+from .schedule import get_availability_version, get_schedule_version
+from .search import search_movies
+from .seats import (acquire_seat_holds, aget_cached_seat_map, aget_seat_holds, apply_seat_holds, get_cached_seat_map,
+                    release_seat_holds, seat_grid_payload, stream_seat_events)
+from .services import acheck_order_payment, apurchase_ticket_process, aprocess_payment, record_stripe_event
+from .utils import format_day_label
 
 
 def redirect_to_home(request):
     return redirect("home")
 
 
+def healthz(request):
+    """Liveness probe: the process is up and serving requests."""
+    return JsonResponse({'status': 'ok'})
+
+
+def readyz(request):
+    """Readiness probe: the database and the cache answer; 503 otherwise."""
+    checks = {}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        checks['database'] = 'ok'
+    except DatabaseError:
+        checks['database'] = 'error'
+    try:
+        cache.set('readyz', 1, 10)
+        checks['cache'] = 'ok' if cache.get('readyz') == 1 else 'error'
+    except Exception:
+        # Backend-specific errors (e.g. redis.ConnectionError) share no base class
+        checks['cache'] = 'error'
+
+    ready = all(status == 'ok' for status in checks.values())
+    return JsonResponse({'status': 'ok' if ready else 'error', **checks}, status=200 if ready else 503)
+
+
+def metrics(request):
+    """Prometheus scrape endpoint; requires ``Authorization: Bearer <METRICS_TOKEN>`` when the token is set."""
+    authorization = request.headers.get('Authorization', '').encode()
+    if settings.METRICS_TOKEN and not hmac.compare_digest(authorization, f'Bearer {settings.METRICS_TOKEN}'.encode()):
+        return HttpResponse(status=403)
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
+
+
 class HomePageView(TemplateView):
     template_name = 'cinema_app/index.html'
 
@@ -28,20 +78,22 @@ class MovieListView(ListView):
     paginate_by = 3
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = (super().get_queryset()
+                    .only('title', 'slug', 'release_date', 'age_limit', 'poster', 'poster_variants')
+                    .prefetch_related(Prefetch('genre', queryset=Genre.objects.only('name')))
+                    .order_by('id'))
         selected_genres = self.request.GET.getlist('genre')
         age_limit = self.request.GET.get('age_limit')
         search_query = self.request.GET.get('search', '')
 
         if selected_genres and "" not in selected_genres:
-            queryset = queryset.filter(genre__id__in=selected_genres).distinct()
+            # Semi-join on the m2m table instead of JOIN + DISTINCT over the whole movie row
+            movie_ids = Movie.genre.through.objects.filter(genre_id__in=selected_genres).values('movie_id')
+            queryset = queryset.filter(id__in=movie_ids)
         if age_limit:
             queryset = queryset.filter(age_limit=age_limit)
         if search_query:
-            search_query = search_query.capitalize()
-            query = Q(title__icontains=search_query) | Q(description__icontains=search_query) | Q(
-                original_name__icontains=search_query)
-            queryset = queryset.filter(query)
+            queryset = search_movies(queryset, search_query)
 
         return queryset
 
@@ -70,9 +122,18 @@ class SessionListView(ListView):
     model = Session
     template_name = 'cinema_app/session_list.html'
     context_object_name = 'session_list'
+    SORT_BY_AVAILABILITY = 'availability'
 
     def get_queryset(self):
-        sessions = Session.objects.filter(session_date__gte=date.today()).order_by('session_date', 'start_time')
+        # Seat counters come from the joined SessionStats row, not from counting tickets
+        sessions = (Session.objects.filter(session_date__gte=date.today())
+                    .select_related('movie', 'hall', 'stats')
+                    .only('slug', 'session_date', 'start_time', 'movie__title', 'movie__poster',
+                          'movie__poster_variants', 'hall__name', 'stats__capacity', 'stats__available'))
+        if self.request.GET.get('sort') == self.SORT_BY_AVAILABILITY:
+            sessions = sessions.order_by(F('stats__available').desc(nulls_last=True), 'session_date', 'start_time')
+        else:
+            sessions = sessions.order_by('session_date', 'start_time')
 
         # Проверяем наличие slug фильма в параметрах URL
         movie_slug = self.kwargs.get('slug')
@@ -89,11 +150,10 @@ class SessionListView(ListView):
         return sessions
 
     def get_context_data(self, **kwargs):
+        # The session queryset is only evaluated inside the cached fragment of the template,
+        # so a warm cache serves the schedule without queries or rendering of the list
         context = super().get_context_data(**kwargs)
 
-        # Устанавливаем локаль на украинский
-        locale.setlocale(locale.LC_TIME, 'uk_UA.UTF-8')
-
         today = date.today()
         selected_date = self.request.GET.get('date', None)
 
@@ -104,8 +164,13 @@ class SessionListView(ListView):
         # Добавляем информацию о фильме в контекст, если передан `slug`
         movie_slug = self.kwargs.get('slug')
         if movie_slug:
-            movie = Movie.objects.get(slug=movie_slug)
-            context['movie'] = movie
+            context['movie'] = SimpleLazyObject(lambda: Movie.objects.get(slug=movie_slug))
+
+        # Ticket sales change the seat counters only: the list fragment depends on them when sorted by them
+        schedule_version = get_schedule_version(selected_date)
+        availability_version = get_availability_version(selected_date)
+        if self.request.GET.get('sort') == self.SORT_BY_AVAILABILITY:
+            schedule_version = f'{schedule_version}-{availability_version}'
 
         context.update({
             'today': today,
@@ -113,10 +178,22 @@ class SessionListView(ListView):
             'tomorrow': today + timedelta(days=1),
             'tomorrow_label': "Завтра",
             'upcoming_days': [
-                {'date': today + timedelta(days=i), 'label': (today + timedelta(days=i)).strftime('%A %d.%m')}
+                {'date': today + timedelta(days=i), 'label': format_day_label(today + timedelta(days=i))}
                 for i in range(2, 5)
             ],
             'selected_date': selected_date,
+            'selected_sort': self.request.GET.get('sort') == self.SORT_BY_AVAILABILITY and self.SORT_BY_AVAILABILITY,
+            'movie_slug': movie_slug,
+            'schedule_version': schedule_version,
+            'availability_version': availability_version,
+            # Called only when the cached counters are stale, by the availability fragment of the template
+            'session_availability': lambda: {
+                slug: {'available': available, 'capacity': capacity}
+                for slug, available, capacity in self.object_list.values_list('slug', 'stats__available',
+                                                                              'stats__capacity')
+                if capacity is not None
+            },
+            'SCHEDULE_CACHE_TIMEOUT': settings.SCHEDULE_CACHE_TIMEOUT,
         })
 
         return context
@@ -128,47 +205,91 @@ class SessionDetailView(DetailView):
     context_object_name = 'session_detail'
 
 
-def get_available_seats(request, session_slug):
-    session = get_object_or_404(Session, slug=session_slug)
-    available_seats = session.get_available_seats()
+async def get_available_seats(request, session_slug):
+    seat_map = await aget_cached_seat_map(session_slug)
+    if seat_map is None:
+        raise Http404
+    user = await request.auser()
+    seat_map = apply_seat_holds(seat_map, await aget_seat_holds(session_slug, seat_map), user.id)
+
+    return JsonResponse({'available_seats': seat_map.available()})
+
 
-    return JsonResponse({'available_seats': available_seats})
+async def seat_events(request, session_slug):
+    seat_map = await aget_cached_seat_map(session_slug)
+    if seat_map is None:
+        raise Http404
+    if not isinstance(request, ASGIRequest):
+        # WSGI buffers an async stream whole before sending it: five silent minutes holding a worker. 204 makes
+        # EventSource give up, and the page polls available_seats instead.
+        return HttpResponse(status=204)
+    user = await request.auser()
+
+    response = StreamingHttpResponse(stream_seat_events(session_slug, seat_map, user.id),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@require_POST
+def hold_seats(request, session_slug):
+    seat_map = get_cached_seat_map(session_slug)
+    if seat_map is None:
+        raise Http404
+
+    try:
+        data = json.loads(request.body)
+        hold = [int(seat) for seat in data.get('hold', [])]
+        release = [int(seat) for seat in data.get('release', [])]
+    except (TypeError, ValueError, AttributeError):
+        return JsonResponse({'error': 'Неправильний номер місця'}, status=400)
+
+    release_seat_holds(session_slug, request.user.id, release)
+    conflicts = acquire_seat_holds(session_slug, request.user.id, hold, seat_map)
+
+    return JsonResponse({
+        'held': [] if conflicts else hold,
+        'conflicts': conflicts,
+        'expires_in': settings.SEAT_HOLD_TTL,
+    }, status=409 if conflicts else 200)
 
 
 @cache_control(no_cache=True, must_revalidate=True, no_store=True)
 @login_required
-def purchase_ticket(request, session_slug):
-    session = get_object_or_404(Session, slug=session_slug)
-    available_seats = session.get_available_seats()
-    seats_per_row = 10
-    row_capacity = session.hall.capacity // seats_per_row
-    # List comprehension to create seat data with unique IDs and their availability status
-    seats_by_row = [
-        [
-            (row * seats_per_row + seat_number,
-             'Free' if (row * seats_per_row + seat_number) in available_seats else 'Booked')
-            for seat_number in range(1, seats_per_row + 1)
-        ]
-        for row in range(row_capacity)
-    ]
+async def purchase_ticket(request, session_slug):
+    session = await aget_object_or_404(Session.objects.select_related('hall', 'movie'), slug=session_slug)
+    user = await request.auser()
 
     if request.method == 'POST':
-        # success, result, order_id = purchase_ticket_process(request, session)
-        redirect_url, order_id = purchase_ticket_process(request, session)
-        return redirect(redirect_url)
+        redirect_url, result = await apurchase_ticket_process(request, user, session)
+        if redirect_url:
+            return redirect(redirect_url)
+        messages.error(request, result)
+        return redirect('purchase_ticket', session_slug=session.slug)
+
+    seat_map = await session.aget_seat_map()
+    # Demand pricing counts sold and reserved seats only, the same occupancy checkout will price with
+    prices = session_category_prices(session, seat_map)
+    seat_map = apply_seat_holds(seat_map, await aget_seat_holds(session.slug, seat_map), user.id)
 
     context = {
         'session': session,
-        'seats': seats_by_row,
+        # The grid is drawn client-side from the cached hall layout and a bitmask of taken seats
+        'seat_grid': seat_grid_payload(session.hall, seat_map),
+        'seat_prices': {category: str(price) for category, price in prices.items()},
     }
 
-    return render(request, 'payments/purchase_ticket.html', context)
+    # Rendering runs the context processors (user, session, messages), which are synchronous
+    return await sync_to_async(render)(request, 'payments/purchase_ticket.html', context)
 
 
 @login_required
-def retry_payment(request, pk):
-    order = get_object_or_404(Order, id=pk)
-    redirect_url = process_payment(request, order)
+async def retry_payment(request, pk):
+    user = await request.auser()
+    order = await aget_object_or_404(Order, id=pk, user=user, status=Order.PENDING)
+    redirect_url = await aprocess_payment(request, order)
     if redirect_url:
         return redirect(redirect_url)
     else:
@@ -176,29 +297,43 @@ def retry_payment(request, pk):
         return redirect('home')
 
 
-def purchase_success(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
+async def purchase_success(request, order_id):
+    order = await aget_object_or_404(Order.objects.select_related('session__movie', 'session__hall'), id=order_id)
+    user = await request.auser()
 
-    if order.user != request.user:
+    if order.user_id != user.id:
         messages.error(request, "You are not allowed to view this order.")
         return redirect('home')
 
-    order.status = Order.COMPLETED
-    order.save()
-
-    tickets = Ticket.objects.filter(order=order)
-    for ticket in tickets:
-        ticket.status = Ticket.BOOKED
-    tickets.bulk_update(tickets, ['status'])
-    seat_numbers = order.get_seat_numbers()
+    # The webhook finalises orders; this only catches up when the buyer is back before it was processed
+    await acheck_order_payment(order)
+    seat_numbers = ', '.join([str(seat) async for seat in order.tickets.values_list('seat_number', flat=True)])
 
     context = {
         'seat_numbers': seat_numbers,
         'price': order.total_price,
         'session': order.session,
+        'paid': order.status == Order.COMPLETED,
     }
 
-    return render(request, 'payments/purchase_success.html', context)
+    return await sync_to_async(render)(request, 'payments/purchase_success.html', context)
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    # Verify and store the event only; orders are finalised by a Celery task so web workers return at once
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        return HttpResponse(status=400)
+    try:
+        event = stripe.Webhook.construct_event(request.body, request.headers.get('Stripe-Signature', ''),
+                                               settings.STRIPE_WEBHOOK_SECRET)
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return HttpResponse(status=400)
+
+    if event['type'] in StripeEvent.HANDLED_TYPES:
+        record_stripe_event(event)
+    return HttpResponse(status=200)
 
 
 def purchase_cancel(request, order_id):
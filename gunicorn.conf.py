@@ -0,0 +1,63 @@
+"""
+Gunicorn settings for the production container: ``gunicorn -c gunicorn.conf.py``.
+
+Serves cinema.asgi with uvicorn workers. Every value can be overridden from the
+environment (WEB_CONCURRENCY, GUNICORN_BIND, ...) or on the command line.
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+
+wsgi_app = os.environ.get('GUNICORN_APP', 'cinema.asgi:application')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Async workers multiplex many requests each; (2 x CPU) + 1 keeps every core busy while others wait on I/O.
+# Each worker holds its own database pool (DATABASE_POOL_MAX_SIZE), so
+# workers x pool size must stay below the Postgres max_connections.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cinema.settings')
+
+
+def _process_local_cache():
+    from django.conf import settings
+    return settings.CACHES['default']['BACKEND'].endswith('.LocMemCache')
+
+
+# Seat holds (cache.add is the lock), seat maps and the schedule versions live in the default cache. With a
+# per-process LocMemCache every worker would keep its own, and two buyers served by different workers could
+# hold the same seat, so without a shared cache (REDIS_URL) there is a single worker.
+if workers > 1 and _process_local_cache():
+    print(f'gunicorn.conf.py: the default cache is local to each process, running 1 worker instead of {workers}; '
+          f'set REDIS_URL or use cinema.settings_prod to run more', file=sys.stderr)
+    workers = 1
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then to bound memory growth; the jitter keeps them from restarting together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+# Prometheus multiprocess mode: every worker writes its metrics to this directory and /metrics/ merges
+# them, whichever worker answers the scrape. Set here, before the workers import the app; emptied on start.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+
+
+def on_starting(server):
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)